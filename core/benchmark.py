@@ -0,0 +1,110 @@
+"""
+Benchmark of the main pages: latency percentiles and query counts.
+
+Each target is requested through the Django test client, once to warm up
+and then `runs` times, timing every request and counting its queries.
+Results can be written as JSON and compared with budgets, e.g.
+
+    BENCHMARK_BUDGETS = {
+        'dashboard': {'p95_ms': 150, 'queries': 5},
+    }
+
+in settings, or a JSON file of the same shape passed to the command, so a
+change that makes a page slower or chattier fails the run. Seed a large
+dataset first with `python manage.py seed_scale`.
+"""
+import math
+import time
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from transactions.models import PurchaseBill, SaleBill
+
+
+def _latest(model):
+    return model.objects.order_by('-pk').values_list('pk', flat=True).first()
+
+
+def targets():
+    """{name: url} of the pages to measure. Bill pages use the latest bills."""
+    urls = {
+        'home': reverse('home'),
+        'dashboard': reverse('dashboard'),
+        'inventory_list': reverse('inventory:inventory_list'),
+        'stock_list': reverse('inventory:inventory'),
+        'stock_search': reverse('inventory:inventory') + '?q=bolt',
+        'low_stock': reverse('inventory:low-stock'),
+        'stock_autocomplete': reverse('inventory:stock-autocomplete') + '?q=bo',
+        'purchases_list': reverse('transactions:purchases-list'),
+        'sales_list': reverse('transactions:sales-list'),
+        'new_sale': reverse('transactions:new-sale'),
+    }
+    purchase, sale = _latest(PurchaseBill), _latest(SaleBill)
+    if purchase:
+        urls['purchase_bill'] = reverse('transactions:purchase-bill', args=[purchase])
+    if sale:
+        urls['sale_bill'] = reverse('transactions:sale-bill', args=[sale])
+    return urls
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of `values`."""
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def measure(client, url, runs=20, cold=False):
+    """Latency figures in milliseconds and the query count of GET `url`."""
+    client.get(url)                                         # warm up templates, caches and the connection
+    timings = []
+    for _ in range(runs):
+        if cold:
+            cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            response = client.get(url)
+            if response.streaming:
+                b''.join(response.streaming_content)
+            timings.append((time.perf_counter() - started) * 1000)
+    return {
+        'url': url,
+        'status': response.status_code,
+        'queries': len(queries),
+        'mean_ms': round(sum(timings) / len(timings), 2),
+        'p50_ms': round(percentile(timings, 50), 2),
+        'p95_ms': round(percentile(timings, 95), 2),
+        'p99_ms': round(percentile(timings, 99), 2),
+        'max_ms': round(max(timings), 2),
+    }
+
+
+def over_budget(result, budget):
+    """Descriptions of the figures in `result` above their `budget`, e.g. ['p95_ms 180.2 > 150']."""
+    failures = []
+    if result['status'] != 200:
+        failures.append(f"status {result['status']}")
+    for key, limit in budget.items():
+        if key in result and result[key] > limit:
+            failures.append(f"{key} {result[key]} > {limit}")
+    return failures
+
+
+def run(user, names=None, runs=20, budgets=None, cold=False, host='127.0.0.1'):
+    """Measure every target (or those in `names`) as `user`. Returns {name: result}."""
+    budgets = budgets or {}
+    client = Client(HTTP_HOST=host)
+    client.force_login(user)
+    results = {}
+    for name, url in targets().items():
+        if names and name not in names:
+            continue
+        result = measure(client, url, runs=runs, cold=cold)
+        result['budget'] = budgets.get(name, {})
+        result['failures'] = over_budget(result, result['budget'])
+        results[name] = result
+    return results
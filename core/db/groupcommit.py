@@ -0,0 +1,96 @@
+"""
+Group commit: many small write transactions committed as one.
+
+On SQLite every commit waits for the write lock and, in WAL mode, for
+its own sync, so a stream of tiny transactions (one stock change per
+request during a cycle count) is bound by commits rather than by work.
+GroupCommitter hands such writes to a committer thread. The thread
+gathers the writes that arrive within GROUP_COMMIT_WINDOW_MS of the
+first one, up to GROUP_COMMIT_MAX, and runs them in a single
+transaction, each in its own savepoint: a write that raises is undone
+on its own and its caller gets the exception, the others commit. If the
+commit itself fails, every caller of the batch gets that error.
+
+Callers block until their batch has committed, so a successful return
+still means the write is durable. The thread stops after a second
+without work and closes its connection; the next write starts it again.
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+from .writes import write_atomic
+
+
+class GroupCommitter:
+    """Runs submitted write functions in shared transactions on a committer thread."""
+
+    def __init__(self, using=DEFAULT_DB_ALIAS, idle=1.0):
+        self.using = using
+        self.idle = idle                                # seconds without work before the thread stops
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def submit(self, fn, *args, **kwargs):
+        """Run fn(*args, **kwargs) in the next group transaction; returns its result or raises its exception."""
+        future = Future()
+        with self._lock:
+            self._queue.put((future, fn, args, kwargs))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='group-commit', daemon=True)
+                self._thread.start()
+        return future.result()
+
+    def _run(self):
+        try:
+            while True:
+                try:
+                    first = self._queue.get(timeout=self.idle)
+                except queue.Empty:
+                    with self._lock:
+                        if self._queue.empty():         # nothing was submitted while timing out
+                            self._thread = None
+                            return
+                    continue
+                self._commit(self._gather(first))
+        finally:
+            connections[self.using].close()
+
+    def _gather(self, first):
+        batch = [first]
+        deadline = time.monotonic() + getattr(settings, 'GROUP_COMMIT_WINDOW_MS', 2) / 1000
+        while len(batch) < getattr(settings, 'GROUP_COMMIT_MAX', 100):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _commit(self, batch):
+        connections[self.using].close_if_unusable_or_obsolete()
+        outcomes = []
+        try:
+            with write_atomic(using=self.using):
+                for future, fn, args, kwargs in batch:
+                    try:
+                        with transaction.atomic(using=self.using):
+                            outcomes.append((future, fn(*args, **kwargs), None))
+                    except Exception as exc:
+                        outcomes.append((future, None, exc))
+        except Exception as exc:
+            for future, *_ in batch:
+                future.set_exception(exc)
+            return
+        for future, result, exc in outcomes:
+            if exc is None:
+                future.set_result(result)
+            else:
+                future.set_exception(exc)
@@ -0,0 +1,57 @@
+"""
+Switching the default database of a running process.
+
+use_database() points the `default` alias at another settings dict, e.g.
+one of SQLITE_PROFILES on a scratch file, for every thread, and back on
+exit. `python manage.py sqlite_benchmark` runs each profile this way, and
+ScratchDatabaseMixin runs a test class on one.
+"""
+import os
+import tempfile
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.management import call_command
+from django.db import connections
+
+
+@contextmanager
+def use_database(settings_dict):
+    """Point the default database at `settings_dict` for every thread, then back."""
+    original = connections.databases['default']
+    connections['default'].close()
+    connections.databases['default'] = settings_dict
+    connections.ensure_defaults('default')
+    connections.prepare_test_settings('default')
+    del connections['default']                                      # each thread opens a new connection
+    try:
+        yield
+    finally:
+        connections['default'].close()
+        connections.databases['default'] = original
+        del connections['default']
+
+
+class ScratchDatabaseMixin:
+    """
+    TransactionTestCase mixin running the class on `database_profile` in a
+    database file of its own. Tests of concurrent writers need one: the test
+    database is in memory, where SQLite locks whole tables and does not wait
+    for them.
+    """
+    database_profile = 'default'
+
+    @classmethod
+    def setUpClass(cls):
+        cls.database_directory = tempfile.TemporaryDirectory()
+        name = os.path.join(cls.database_directory.name, f'{cls.database_profile}.sqlite3')
+        cls.scratch_database = use_database(dict(settings.SQLITE_PROFILES[cls.database_profile], NAME=name))
+        cls.scratch_database.__enter__()
+        call_command('migrate', run_syncdb=True, verbosity=0)
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls.scratch_database.__exit__(None, None, None)
+        cls.database_directory.cleanup()
@@ -0,0 +1,76 @@
+"""
+SQLite backend tuned for many concurrent writers (ENGINE 'core.db.sqlite3').
+
+It is Django's sqlite3 backend with three OPTIONS of its own:
+
+- `pragmas`: {name: value} run on every new connection, e.g. WAL
+  journaling so readers are never blocked by a bill being posted;
+- `transaction_mode`: 'IMMEDIATE' starts every atomic block with
+  BEGIN IMMEDIATE, taking the write lock up front. With the default
+  deferred BEGIN a transaction that reads first and writes later can
+  fail with `database is locked` halfway through, when another writer
+  got there first; SQLite cannot wait for the lock in that case;
+- `retries` and `retry_backoff`: a BEGIN, a statement outside any
+  transaction or a connection's pragmas that still find the database
+  locked once the busy `timeout` has passed are retried that many times,
+  waiting retry_backoff * 2**attempt seconds (with jitter) in between.
+  Nothing has been written at that point, so retrying is safe.
+"""
+import random
+import time
+
+from django.db import OperationalError
+from django.db.backends.sqlite3 import base
+
+
+OPTIONS = ('pragmas', 'transaction_mode', 'retries', 'retry_backoff')
+
+
+def is_locked(exc):
+    """Whether `exc` is SQLite's transient 'database is locked' / 'database table is locked'."""
+    return 'is locked' in str(exc)
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        options = self.settings_dict['OPTIONS']
+        self.transaction_mode = options.get('transaction_mode')
+        self.retries = options.get('retries', 0)
+        self.retry_backoff = options.get('retry_backoff', 0.05)
+        # first in the list, so it is the outermost wrapper and every attempt is timed (query counting sets the locked ones apart)
+        self.execute_wrappers.insert(0, self._retry_outside_transaction)
+
+    def get_connection_params(self):
+        kwargs = super().get_connection_params()
+        for name in OPTIONS:
+            kwargs.pop(name, None)                          # ours, not sqlite3.connect()'s
+        return kwargs
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        for name, value in self.settings_dict['OPTIONS'].get('pragmas', {}).items():
+            # switching to WAL needs the write lock, another process may hold it
+            self.with_retries(lambda: conn.execute(f'PRAGMA {name} = {value}'))
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        # not in an atomic block yet, so _retry_outside_transaction retries a locked BEGIN
+        self.cursor().execute(f'BEGIN {self.transaction_mode}' if self.transaction_mode else 'BEGIN')
+
+    def with_retries(self, func):
+        """Call `func`, retrying with exponential backoff while the database is locked."""
+        for attempt in range(self.retries + 1):
+            try:
+                return func()
+            except (OperationalError, base.Database.OperationalError) as exc:
+                if attempt == self.retries or not is_locked(exc):
+                    raise
+            time.sleep(self.retry_backoff * 2 ** attempt * random.uniform(0.5, 1.5))
+
+    def _retry_outside_transaction(self, execute, sql, params, many, context):
+        if self.in_atomic_block:
+            # a locked statement inside a transaction cannot be retried alone
+            return execute(sql, params, many, context)
+        return self.with_retries(lambda: execute(sql, params, many, context))
@@ -0,0 +1,56 @@
+"""
+Write transactions that change stock.
+
+`write_atomic()` is transaction.atomic() for the transactions that move
+stock (posting or deleting a bill, a stock change). With
+SQLITE_WRITER_QUEUE on, the outermost one also waits its turn in a
+first-come first-served queue shared by the threads of this process, so
+a process's writers take SQLite's single write lock one after the other
+instead of all polling for it. Nested calls join the transaction that
+is already open without queueing again.
+"""
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+
+class WriterQueue:
+    """A lock handed out in the order it was asked for."""
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._next = 0
+        self._serving = 0
+
+    @property
+    def waiting(self):
+        return self._next - self._serving
+
+    def __enter__(self):
+        with self._condition:
+            ticket = self._next
+            self._next += 1
+            self._condition.wait_for(lambda: self._serving == ticket)
+        return self
+
+    def __exit__(self, *exc):
+        with self._condition:
+            self._serving += 1
+            self._condition.notify_all()
+
+
+writer_queue = WriterQueue()
+
+
+@contextmanager
+def write_atomic(using=None):
+    """transaction.atomic(), queued behind the other writers of this process when SQLITE_WRITER_QUEUE is on."""
+    connection = connections[using or DEFAULT_DB_ALIAS]
+    if connection.in_atomic_block or not getattr(settings, 'SQLITE_WRITER_QUEUE', False):
+        with transaction.atomic(using=using):
+            yield
+        return
+    with writer_queue, transaction.atomic(using=using):
+        yield
@@ -0,0 +1,171 @@
+"""
+Streaming CSV / JSON Lines export.
+
+An export is a header plus an iterator of row tuples, normally a
+values_list() queryset read with .iterator(chunk_size=...), so rows are
+encoded and sent as they come from the database and memory use does not
+grow with the size of the export. The same generators serve the
+StreamingHttpResponse of the export views and the file output of the
+export management commands.
+"""
+import csv
+import datetime
+import sys
+import zlib
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+
+FORMATS = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+}
+CHUNK_SIZE = 2000                                       # rows fetched from the database at a time
+BLOCK_SIZE = 64 * 1024                                  # bytes handed to the response / file at a time
+
+
+class ExportError(ValueError):
+    """Raised for bad export parameters, e.g. an unparsable date."""
+
+
+class _Echo:
+    """File-like object whose write() returns the line, so csv.writer can produce strings."""
+
+    def write(self, value):
+        return value
+
+
+def encode_rows(header, rows, format='csv'):
+    """Yield the export as text lines in `format` ('csv' or 'jsonl')."""
+    if format == 'csv':
+        writer = csv.writer(_Echo())
+        yield writer.writerow(header)
+        for row in rows:
+            yield writer.writerow(row)
+    elif format == 'jsonl':
+        encoder = DjangoJSONEncoder(separators=(',', ':'))
+        for row in rows:
+            yield encoder.encode(dict(zip(header, row))) + '\n'
+    else:
+        raise ExportError(f"Unknown export format '{format}'.")
+
+
+def stream_export(header, rows, format='csv', compress=False):
+    """Yield the export as bytes blocks of about BLOCK_SIZE, gzipped when `compress`."""
+    gzip = zlib.compressobj(wbits=31) if compress else None     # wbits=31 writes a gzip header and trailer
+    block = []
+    size = 0
+    for line in encode_rows(header, rows, format):
+        data = line.encode()
+        block.append(data)
+        size += len(data)
+        if size >= BLOCK_SIZE:
+            data = b''.join(block)
+            block, size = [], 0
+            if gzip:
+                data = gzip.compress(data)
+            if data:
+                yield data
+    data = b''.join(block)
+    if gzip:
+        data = gzip.compress(data) + gzip.flush()
+    if data:
+        yield data
+
+
+def export_response(filename, header, rows, format='csv', compress=False):
+    """StreamingHttpResponse that downloads the export as `filename`.<format>[.gz]."""
+    filename = f"{filename}.{format}"
+    content_type = FORMATS[format]
+    if compress:
+        filename += '.gz'
+        content_type = 'application/gzip'
+    response = StreamingHttpResponse(stream_export(header, rows, format, compress), content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+def parse_options(data):
+    """
+    Read the export options from a dict such as request.GET: `since` and
+    `until` (YYYY-MM-DD, both inclusive), `stock` (id), `format` and `gzip`.
+    Raises ExportError for values that cannot be parsed.
+    """
+    options = {
+        'since': _date(data.get('since')),
+        'until': _date(data.get('until')),
+        'stock': None,
+        'format': data.get('format') or 'csv',
+        'compress': str(data.get('gzip', '')).lower() in ('1', 'true', 'yes', 'on'),
+    }
+    if data.get('stock'):
+        try:
+            options['stock'] = int(data['stock'])
+        except (TypeError, ValueError):
+            raise ExportError(f"Invalid stock id '{data['stock']}'.")
+    if options['format'] not in FORMATS:
+        raise ExportError(f"Unknown export format '{options['format']}'.")
+    return options
+
+
+def date_range(field, since=None, until=None):
+    """
+    Filter kwargs selecting `field` between the `since` and `until` dates,
+    both inclusive. Compares against datetimes rather than __date so an
+    index on `field` can be used.
+    """
+    filters = {}
+    if since:
+        filters[f'{field}__gte'] = _start_of(since)
+    if until:
+        filters[f'{field}__lt'] = _start_of(until + datetime.timedelta(days=1))
+    return filters
+
+
+def _start_of(date):
+    start = datetime.datetime.combine(date, datetime.time.min)
+    return timezone.make_aware(start) if settings.USE_TZ else start
+
+
+def _date(value):
+    if value in (None, ''):
+        return None
+    if isinstance(value, datetime.date):
+        return value
+    try:
+        date = parse_date(value)
+    except ValueError:
+        date = None
+    if date is None:
+        raise ExportError(f"Invalid date '{value}', expected YYYY-MM-DD.")
+    return date
+
+
+def add_arguments(parser):
+    """The export options shared by the export management commands."""
+    parser.add_argument('--since', help="First day to export, YYYY-MM-DD.")
+    parser.add_argument('--until', help="Last day to export, YYYY-MM-DD.")
+    parser.add_argument('--stock', type=int, help="Only rows for this stock id.")
+    parser.add_argument('--format', choices=sorted(FORMATS), default='csv')
+    parser.add_argument('--gzip', action='store_true', help="Gzip the output.")
+    parser.add_argument('-o', '--output', help="File to write, standard output when omitted.")
+
+
+def write_export(path, header, rows, format='csv', compress=False):
+    """Write the export to `path`, or to standard output when `path` is empty. Returns the bytes written."""
+    written = 0
+    out = open(path, 'wb') if path else sys.stdout.buffer
+    try:
+        for block in stream_export(header, rows, format, compress):
+            out.write(block)
+            written += len(block)
+    finally:
+        if path:
+            out.close()
+        else:
+            out.flush()
+    return written
@@ -0,0 +1,83 @@
+"""
+Index advisor: EXPLAIN QUERY PLAN over a catalog of the project's hot queries.
+
+Apps list their hot query shapes in a `queries.py` module:
+
+    from core.index_advisor import register
+
+    @register('stock list page')
+    def stock_list():
+        return Stock.objects.filter(is_deleted=False).order_by('name', 'id')[:10]
+
+`python manage.py index_advisor` imports every app's queries module, asks
+SQLite for the plan of each queryset and flags plans that read a whole
+table (`SCAN table` without an index) or sort the whole result in a
+temporary b-tree. A scan that is expected, e.g. of a tiny table, can be
+allowed with `register(name, allow=['SCAN some_table'])`. The test suite
+runs the advisor too, so a query that loses its index fails there first.
+"""
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection
+from django.utils.module_loading import autodiscover_modules
+
+
+_catalog = {}
+
+
+class QueryPlan:
+    """The plan of one catalogued query and the problems found in it."""
+
+    def __init__(self, name, sql, lines, problems):
+        self.name = name
+        self.sql = sql
+        self.lines = lines
+        self.problems = problems
+
+    @property
+    def ok(self):
+        return not self.problems
+
+
+def register(name, allow=()):
+    """Decorator adding a function that returns a queryset to the catalog."""
+    def decorator(func):
+        _catalog[name] = (func, tuple(allow))
+        return func
+    return decorator
+
+
+def catalog():
+    """The registered queries, {name: (function, allowed plan lines)}, after loading every app's queries module."""
+    autodiscover_modules('queries')
+    return dict(_catalog)
+
+
+def explain(queryset):
+    """(sql, plan lines) of `queryset` from SQLite's EXPLAIN QUERY PLAN."""
+    if connection.vendor != 'sqlite':
+        raise ImproperlyConfigured("The index advisor reads SQLite query plans only.")
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+        return sql, [row[-1] for row in cursor.fetchall()]
+
+
+def problems(lines, allow=()):
+    """Plan lines that read a whole table or sort a whole result, minus the allowed ones."""
+    found = []
+    for line in lines:
+        full_scan = line.startswith('SCAN') and ' USING ' not in line
+        if (full_scan or 'USE TEMP B-TREE' in line) and not any(line.startswith(prefix) for prefix in allow):
+            found.append(line)
+    return found
+
+
+def advise(names=None):
+    """QueryPlan of every catalogued query, or only of those in `names`."""
+    plans = []
+    for name, (func, allow) in sorted(catalog().items()):
+        if names and name not in names:
+            continue
+        sql, lines = explain(func())
+        plans.append(QueryPlan(name, sql, lines, problems(lines, allow)))
+    return plans
@@ -0,0 +1,156 @@
+"""
+Keyset (cursor) pagination.
+
+Instead of OFFSET, each page continues from the sort key of the last row
+of the previous page, so deep pages cost the same as the first one. The
+sort key must be unique, e.g. ('-time', '-billno') or ('name', 'id').
+Counting the total number of rows is optional because COUNT(*) is what
+gets slow on big tables.
+"""
+import base64
+import datetime
+import json
+from functools import reduce
+
+from django.db.models import Q
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+class KeysetPage:
+    """One page of results, iterable like a regular Django Page."""
+
+    is_keyset = True
+
+    def __init__(self, object_list, paginator, next_key=None, previous_key=None):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.next_cursor = paginator.encode_cursor('next', next_key) if next_key is not None else None
+        self.previous_cursor = paginator.encode_cursor('prev', previous_key) if previous_key is not None else None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class KeysetPaginator:
+    """
+    Paginates `queryset` by the fields in `ordering`. `page(cursor)` returns
+    the first page when `cursor` is empty. With `count=True` the paginator
+    also exposes the total number of rows as `count`.
+    """
+
+    def __init__(self, queryset, ordering, per_page, count=False):
+        self.queryset = queryset
+        self.ordering = list(ordering)
+        self.per_page = int(per_page)
+        self.with_count = count
+        self.fields = [name.lstrip('-') for name in self.ordering]
+        self.descending = [name.startswith('-') for name in self.ordering]
+
+    @property
+    def count(self):
+        if not self.with_count:
+            return None
+        if not hasattr(self, '_count'):
+            self._count = self.queryset.count()
+        return self._count
+
+    def page(self, cursor=None):
+        try:
+            direction, key = self.decode_cursor(cursor) if cursor else ('next', None)
+        except InvalidCursor:
+            direction, key = 'next', None                               # a bad cursor falls back to the first page
+
+        if direction == 'prev':
+            ordering = [name[1:] if name.startswith('-') else '-' + name for name in self.ordering]
+            rows = list(self._after(self.queryset.order_by(*ordering), key, reverse=True)[:self.per_page + 1])
+            has_more = len(rows) > self.per_page
+            rows = rows[:self.per_page][::-1]
+            return KeysetPage(
+                rows,
+                self,
+                next_key=self.key(rows[-1]) if rows else key,
+                previous_key=self.key(rows[0]) if rows and has_more else None,
+            )
+
+        queryset = self.queryset.order_by(*self.ordering)
+        if key is not None:
+            queryset = self._after(queryset, key)
+        rows = list(queryset[:self.per_page + 1])
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        return KeysetPage(
+            rows,
+            self,
+            next_key=self.key(rows[-1]) if rows and has_more else None,
+            previous_key=self.key(rows[0]) if rows and key is not None else None,
+        )
+
+    def key(self, obj):
+        return [getattr(obj, field) for field in self.fields]
+
+    def _after(self, queryset, key, reverse=False):
+        """Rows that sort strictly after `key` (strictly before when `reverse`)."""
+        if key is None:
+            return queryset
+        conditions = []
+        for i, field in enumerate(self.fields):
+            lookup = 'lt' if self.descending[i] != reverse else 'gt'
+            condition = dict(zip(self.fields[:i], key[:i]))
+            condition[f'{field}__{lookup}'] = key[i]
+            conditions.append(Q(**condition))
+        return queryset.filter(reduce(lambda a, b: a | b, conditions))
+
+    def encode_cursor(self, direction, key):
+        values = [value.isoformat() if isinstance(value, (datetime.date, datetime.datetime)) else value for value in key]
+        data = json.dumps([direction, values], separators=(',', ':')).encode()
+        return base64.urlsafe_b64encode(data).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        try:
+            data = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+            direction, values = json.loads(data)
+            if direction not in ('next', 'prev') or len(values) != len(self.fields):
+                raise ValueError
+            model = self.queryset.model
+            key = [model._meta.get_field(field).to_python(value) for field, value in zip(self.fields, values)]
+        except Exception:
+            raise InvalidCursor(cursor)
+        return direction, key
+
+
+class KeysetPaginationMixin:
+    """
+    Opt-in keyset pagination for a ListView. Set `keyset_pagination = True`
+    (on the class or through as_view()) and `keyset_ordering`; otherwise
+    the view keeps Django's page number pagination.
+    """
+
+    keyset_pagination = False
+    keyset_ordering = None
+    keyset_count = False                                                # run COUNT(*) for the total as well
+    cursor_kwarg = 'cursor'
+
+    def paginate_queryset(self, queryset, page_size):
+        if not self.keyset_pagination:
+            return super().paginate_queryset(queryset, page_size)
+        paginator = KeysetPaginator(queryset, self.keyset_ordering, page_size, count=self.keyset_count)
+        page = paginator.page(self.request.GET.get(self.cursor_kwarg))
+        return (paginator, page, page.object_list, page.has_other_pages())
@@ -0,0 +1,173 @@
+"""
+On-demand profiling of single requests.
+
+ProfilerMiddleware profiles a request when a staff user asks for it, with
+`?profile=1` or an `X-Profile: 1` header, and a PROFILE_SAMPLE_RATE share
+of all other requests. A profiled request is run under cProfile while a
+sampling thread records the request thread's stack every
+PROFILE_SAMPLE_INTERVAL seconds, and two files tagged with the view name
+are written to PROFILE_DIR:
+
+- `<stem>.prof`, pstats data: `python -m pstats <stem>.prof` or snakeviz;
+- `<stem>.collapsed`, one `frame;frame;frame count` line per sampled
+  stack, the input of flamegraph.pl and speedscope.
+
+The response names the profile in an X-Profile header. Only the newest
+PROFILE_KEEP profiles are kept. Staff list and download them at
+/admin/profiles/.
+"""
+import cProfile
+import os
+import random
+import re
+import sys
+import threading
+import uuid
+from collections import Counter
+
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import FileResponse, Http404
+from django.shortcuts import render
+from django.utils import timezone
+
+
+EXTENSIONS = ('.prof', '.collapsed')
+
+
+def profile_dir():
+    return getattr(settings, 'PROFILE_DIR', os.path.join(settings.BASE_DIR, 'profiles'))
+
+
+class StackSampler:
+    """Samples the stack of one thread from a background thread, counting each distinct stack."""
+
+    def __init__(self, thread_id, interval=0.001):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(_frame_name(frame))
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def collapsed(self):
+        """The samples in collapsed stack format, one line per stack."""
+        return ''.join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    filename = code.co_filename
+    for prefix in sorted(sys.path, key=len, reverse=True):
+        if prefix and filename.startswith(prefix + os.sep):
+            filename = filename[len(prefix) + 1:]
+            break
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})".replace(';', ':')
+
+
+def _wants_profile(request):
+    user = getattr(request, 'user', None)
+    asked = request.GET.get('profile') in ('1', 'true') or request.META.get('HTTP_X_PROFILE') in ('1', 'true')
+    if asked and user is not None and user.is_staff:
+        return True
+    return random.random() < getattr(settings, 'PROFILE_SAMPLE_RATE', 0)
+
+
+class ProfilerMiddleware:
+    """Profile requests on demand. Install it after AuthenticationMiddleware."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not _wants_profile(request):
+            return self.get_response(request)
+
+        profiler = cProfile.Profile()
+        interval = getattr(settings, 'PROFILE_SAMPLE_INTERVAL', 0.001)
+        with StackSampler(threading.get_ident(), interval) as sampler:
+            profiler.enable()
+            try:
+                response = self.get_response(request)
+            finally:
+                profiler.disable()
+
+        match = getattr(request, 'resolver_match', None)
+        stem = save_profile(match.view_name if match else request.path, profiler, sampler)
+        response['X-Profile'] = stem
+        return response
+
+
+def save_profile(view_name, profiler, sampler):
+    """Write the .prof and .collapsed files of a request to PROFILE_DIR. Returns their common file stem."""
+    directory = profile_dir()
+    os.makedirs(directory, exist_ok=True)
+    tag = re.sub(r'[^A-Za-z0-9_.-]+', '-', view_name.replace(':', '.')).strip('-') or 'request'
+    stem = f"{timezone.now():%Y%m%d-%H%M%S%f}-{tag}-{uuid.uuid4().hex[:6]}"    # sorts by time, to the microsecond
+    profiler.dump_stats(os.path.join(directory, stem + '.prof'))
+    with open(os.path.join(directory, stem + '.collapsed'), 'w') as f:
+        f.write(sampler.collapsed())
+    _prune(directory, getattr(settings, 'PROFILE_KEEP', 200))
+    return stem
+
+
+def profiles():
+    """[{'stem', 'view', 'taken_at', 'files': [(name, size)]}] of the saved profiles, newest first."""
+    directory = profile_dir()
+    if not os.path.isdir(directory):
+        return []
+    found = {}
+    for name in os.listdir(directory):
+        stem, extension = os.path.splitext(name)
+        if extension in EXTENSIONS:
+            found.setdefault(stem, []).append((name, os.path.getsize(os.path.join(directory, name))))
+    listing = []
+    for stem in sorted(found, reverse=True):
+        date, time, view = (stem.split('-', 2) + ['', ''])[:3]
+        listing.append({
+            'stem': stem,
+            'view': view.rsplit('-', 1)[0],
+            'taken_at': f"{date[:4]}-{date[4:6]}-{date[6:]} {time[:2]}:{time[2:4]}:{time[4:6]}",
+            'files': sorted(found[stem]),
+        })
+    return listing
+
+
+def _prune(directory, keep):
+    for entry in profiles()[keep:]:
+        for name, _ in entry['files']:
+            os.remove(os.path.join(directory, name))
+
+
+@staff_member_required
+def profile_list(request):
+    return render(request, 'admin/profiles.html', {
+        'title': 'Request profiles',
+        'profiles': profiles(),
+        'directory': profile_dir(),
+    })
+
+
+@staff_member_required
+def profile_download(request, name):
+    # only names listed in the profile directory, never a path
+    if name not in {file for entry in profiles() for file, _ in entry['files']}:
+        raise Http404("No such profile.")
+    return FileResponse(open(os.path.join(profile_dir(), name), 'rb'), as_attachment=True, filename=name)
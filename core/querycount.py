@@ -0,0 +1,179 @@
+"""
+Per-request query counting, with budgets per view.
+
+QueryCountMiddleware wraps every database connection while a request is
+handled and records each query's SQL and duration. A query whose SQL and
+parameters both repeat an earlier one is a *duplicate*; one whose SQL
+repeats with other parameters is *similar*, the usual sign of a query in
+a template loop (N+1). The figures are
+
+- attached to the response as `response.query_stats` (a RequestStats);
+- sent as X-Query-Count, X-Query-Time-Ms, X-Duplicate-Queries,
+  X-Similar-Queries and X-Response-Time-Ms headers when
+  QUERY_COUNT_HEADERS is on (it follows DEBUG; turn it on in staging);
+- logged to the `core.querycount` logger for a QUERY_COUNT_LOG_SAMPLE_RATE
+  share of requests, and always, as a warning, when a view goes over its
+  budget.
+
+Budgets are declared on the view, function or class:
+
+    @query_budget(queries=6, similar=0)
+    class SaleView(ListView):
+        ...
+
+and tests check them with QueryBudgetTestMixin.assertWithinQueryBudget().
+Queries run while a streaming response is consumed are not counted, nor
+are attempts that found the database locked: core.db.sqlite3 retries
+those, and they are counted apart as `locked` so that contention does not
+push a view over its budget.
+"""
+import logging
+import random
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+from core.db.sqlite3.base import is_locked
+
+
+logger = logging.getLogger(__name__)
+
+BUDGET_KEYS = ('queries', 'duplicates', 'similar', 'sql_ms', 'total_ms')
+
+
+def query_budget(**budget):
+    """Declare the most queries (and duplicates, similar queries, ms) a view may use per request."""
+    unknown = set(budget) - set(BUDGET_KEYS)
+    if unknown:
+        raise TypeError(f"Unknown budget figure(s): {', '.join(sorted(unknown))}.")
+
+    def decorator(view):
+        view.query_budget = budget
+        return view
+    return decorator
+
+
+def budget_of(view_func):
+    """The budget declared on a resolved view function (or its class), or None."""
+    budget = getattr(view_func, 'query_budget', None)
+    if budget is None:
+        budget = getattr(getattr(view_func, 'view_class', None), 'query_budget', None)
+    return budget
+
+
+class RequestStats:
+    """The queries of one request."""
+
+    def __init__(self):
+        self.queries = []                                   # (sql, params, ms)
+        self.locked = 0                                     # attempts that found the database locked
+        self.total_ms = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        except Exception as exc:
+            if is_locked(exc):
+                self.locked += 1
+                started = None
+            raise
+        finally:
+            if started is not None:
+                self.queries.append((sql, repr(params), (time.perf_counter() - started) * 1000))
+
+    @property
+    def count(self):
+        return len(self.queries)
+
+    @property
+    def sql_ms(self):
+        return sum(ms for _, _, ms in self.queries)
+
+    @property
+    def duplicates(self):
+        """Queries repeating an earlier one exactly, SQL and parameters."""
+        return self.count - len({(sql, params) for sql, params, _ in self.queries})
+
+    @property
+    def similar(self):
+        """Queries repeating the SQL of an earlier one with other parameters."""
+        return len({(sql, params) for sql, params, _ in self.queries}) - len({sql for sql, _, _ in self.queries})
+
+    def repeated(self):
+        """[(sql, times run)] of the SQL run more than once, most repeated first."""
+        counts = Counter(sql for sql, _, _ in self.queries)
+        return [(sql, n) for sql, n in counts.most_common() if n > 1]
+
+    def figures(self):
+        return {
+            'queries': self.count,
+            'duplicates': self.duplicates,
+            'similar': self.similar,
+            'sql_ms': round(self.sql_ms, 2),
+            'total_ms': round(self.total_ms, 2),
+            'locked': self.locked,
+        }
+
+    def over(self, budget):
+        """Descriptions of the figures above `budget`, e.g. ['queries 12 > 6']."""
+        figures = self.figures()
+        return [f"{key} {figures[key]} > {limit}" for key, limit in (budget or {}).items() if figures[key] > limit]
+
+
+class QueryCountMiddleware:
+    """Count and time the queries of every request. Install it first in MIDDLEWARE."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        stats = RequestStats()
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(stats))
+            response = self.get_response(request)
+        stats.total_ms = (time.perf_counter() - started) * 1000
+        response.query_stats = stats
+
+        figures = stats.figures()
+        if getattr(settings, 'QUERY_COUNT_HEADERS', settings.DEBUG):
+            response['X-Query-Count'] = figures['queries']
+            response['X-Query-Time-Ms'] = figures['sql_ms']
+            response['X-Duplicate-Queries'] = figures['duplicates']
+            response['X-Similar-Queries'] = figures['similar']
+            response['X-Response-Time-Ms'] = figures['total_ms']
+
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match else request.path
+        over = stats.over(budget_of(match.func)) if match else []
+        if over:
+            logger.warning("%s %s over its query budget: %s", request.method, view, ', '.join(over),
+                           extra={'query_stats': figures, 'repeated': stats.repeated()[:3]})
+        elif random.random() < getattr(settings, 'QUERY_COUNT_LOG_SAMPLE_RATE', 0):
+            logger.info("%s %s %s queries (%s duplicate, %s similar) %.1fms sql %.1fms total",
+                        request.method, view, figures['queries'], figures['duplicates'], figures['similar'],
+                        figures['sql_ms'], figures['total_ms'], extra={'query_stats': figures})
+        return response
+
+
+class QueryBudgetTestMixin:
+    """TestCase mixin checking responses against the query budget of their view."""
+
+    def assertWithinQueryBudget(self, response, **budget):
+        """Fail if the request behind `response` went over its view's budget (or `budget`, if given)."""
+        stats = getattr(response, 'query_stats', None)
+        if stats is None:
+            self.fail("The response has no query stats, is QueryCountMiddleware installed?")
+        if not budget:
+            budget = budget_of(response.resolver_match.func)
+            if budget is None:
+                self.fail(f"{response.resolver_match.view_name} declares no query budget.")
+        over = stats.over(budget)
+        if over:
+            repeated = ''.join(f"\n  {n}x {sql}" for sql, n in stats.repeated()[:5])
+            self.fail(f"{response.resolver_match.view_name} over its query budget: {', '.join(over)}{repeated}")
@@ -0,0 +1,134 @@
+"""
+Read replica routing.
+
+With a `replica` database configured (READ_REPLICA in settings), views
+marked with `@read_replica` read the models of this project's apps from
+it, so the home chart, the dashboard, the history and bill lists and the
+exports stop competing with bill posting for the primary. Everything
+else, every write, and every read inside a transaction or from
+Django's own apps (sessions, users), goes to `default`.
+
+Reads stick to the primary after a write: once a request has written,
+its later reads go to `default`, and ReplicaMiddleware sets a short
+lived cookie so the requests that follow (the page a form redirects
+to) also read from the primary for REPLICA_STICKY_SECONDS, until the
+replica has caught up.
+
+For SQLite the replica is a second database file, refreshed from the
+primary with the SQLite backup API by `python manage.py refresh_replica`.
+"""
+import sqlite3
+import threading
+from contextlib import closing
+
+from django.conf import settings
+from django.core.signals import request_finished
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+REPLICA = 'replica'
+STICKY_COOKIE = 'use_primary'
+APPS = ('inventory', 'transactions')                    # app labels whose reads may go to the replica
+
+
+def read_replica(view):
+    """Mark a read-only view, function or class, as served from the replica."""
+    view.read_replica = True
+    return view
+
+
+class _State(threading.local):
+    use_replica = False
+    wrote = False
+
+
+state = _State()
+
+
+def replica_configured():
+    return REPLICA in settings.DATABASES
+
+
+class ReplicaRouter:
+    """Send reads of marked views to the replica, everything else to the primary."""
+
+    def db_for_read(self, model, **hints):
+        if (
+            state.use_replica and not state.wrote
+            and model._meta.app_label in APPS
+            and replica_configured()
+            and not connections[DEFAULT_DB_ALIAS].in_atomic_block
+        ):
+            return REPLICA
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True                                     # the replica holds the same rows
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+class ReplicaMiddleware:
+    """Turn replica reads on for marked GET views, and keep a client on the primary after it writes."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        _reset()
+        response = self.get_response(request)
+        if state.wrote:
+            response.set_cookie(STICKY_COOKIE, '1', max_age=getattr(settings, 'REPLICA_STICKY_SECONDS', 5), httponly=True)
+        # the routing is reset when the request finishes: a streaming response reads its rows while it is sent
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        marked = getattr(view_func, 'read_replica', False) or getattr(getattr(view_func, 'view_class', None), 'read_replica', False)
+        state.use_replica = (
+            marked and request.method in ('GET', 'HEAD') and STICKY_COOKIE not in request.COOKIES
+        )
+
+
+def _reset(**kwargs):
+    state.use_replica = False
+    state.wrote = False
+
+
+request_finished.connect(_reset, dispatch_uid='core.replica.reset')
+
+
+class _Restarted(Exception):
+    pass
+
+
+def refresh(source, target, pages=-1, progress=None):
+    """
+    Copy the SQLite database `source` into `target` (file names or URIs)
+    with the online backup API. By default it is copied in one step under
+    a read lock, which does not block writers of a WAL database. With
+    `pages` > 0 it is copied that many pages per step, leaving the
+    primary free in between; SQLite restarts such a copy whenever the
+    primary is written, so after a restart the copy is done in one step.
+    """
+    with closing(sqlite3.connect(source, uri=True)) as src, closing(sqlite3.connect(target, uri=True)) as dst:
+        if pages > 0:
+            left = []
+
+            def step(status, remaining, total):
+                if left and remaining > left[-1]:       # the source changed, the copy started over
+                    raise _Restarted
+                left.append(remaining)
+                if progress:
+                    progress(status, remaining, total)
+
+            try:
+                src.backup(dst, pages=pages, progress=step)
+                return
+            except _Restarted:
+                pass
+        src.backup(dst, pages=-1, progress=progress)
@@ -48,11 +48,15 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.querycount.QueryCountMiddleware',                 # first, so it counts the queries of every other middleware too
+    'core.slowqueries.SlowQueryMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'core.profiling.ProfilerMiddleware',                    # after authentication, it checks for a staff user
+    'core.replica.ReplicaMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 
@@ -83,13 +87,94 @@ WSGI_APPLICATION = 'core.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/3.0/ref/settings/#databases
 
-DATABASES = {
+# 'default' is Django's stock setup; 'production' is tuned for many tills writing at once (see core/db/sqlite3/base.py),
+# opt in with SQLITE_PROFILE=production in the environment
+
+SQLITE_PROFILES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
-    }
+    },
+    'production': {
+        'ENGINE': 'core.db.sqlite3',
+        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        'OPTIONS': {
+            'timeout': 10,                                  # seconds a statement waits for a lock (busy timeout)
+            'transaction_mode': 'IMMEDIATE',                # take the write lock at BEGIN, not halfway through
+            'retries': 5,                                   # then retry a locked BEGIN with backoff
+            'retry_backoff': 0.05,
+            'pragmas': {
+                'journal_mode': 'WAL',                      # readers do not wait for the writer
+                'synchronous': 'NORMAL',                    # fsync at checkpoints only, safe with WAL
+                'mmap_size': 256 * 1024 * 1024,
+                'cache_size': -64000,                       # KiB, i.e. 64 MB of page cache per connection
+                'temp_store': 'MEMORY',
+            },
+        },
+    },
 }
 
+SQLITE_PROFILE = os.environ.get('SQLITE_PROFILE') or 'default'
+
+DATABASES = {
+    'default': SQLITE_PROFILES[SQLITE_PROFILE],
+}
+
+# a read replica for the read-only views marked @read_replica, see core/replica.py;
+# set READ_REPLICA to the replica's SQLite file and refresh it with `python manage.py refresh_replica`
+READ_REPLICA = os.environ.get('READ_REPLICA', '')
+
+if READ_REPLICA:
+    DATABASES['replica'] = dict(DATABASES['default'], NAME=READ_REPLICA, TEST={'MIRROR': 'default'})
+
+DATABASE_ROUTERS = ['core.replica.ReplicaRouter']
+
+REPLICA_STICKY_SECONDS = 5                              # reads stay on the primary this long after a client writes
+
+SQLITE_WRITER_QUEUE = False                             # queue this process's stock writes, see core/db/writes.py
+
+# commit concurrent stock change form posts together, see core/db/groupcommit.py
+STOCK_GROUP_COMMIT = False
+GROUP_COMMIT_WINDOW_MS = 2                              # how long a batch waits for more writes after its first
+GROUP_COMMIT_MAX = 100                                  # writes per transaction
+
+RESERVATION_TTL_SECONDS = 600                           # how long a sale basket holds its lines, see inventory/reservations.py
+
+STOCK_SHARD_CACHE_SECONDS = 2                           # how long a sharded stock's summed quantity is cached, see inventory/shards.py
+
+
+# Cache
+# https://docs.djangoproject.com/en/3.0/topics/cache/
+# the local memory cache is per process: with several workers a write in one would not invalidate the
+# dashboard figures, autocomplete index or shard totals the others cached. CACHE_DIR in the environment
+# switches to a file cache the workers share, and the production profile uses one under BASE_DIR/cache
+
+CACHE_DIR = os.environ.get('CACHE_DIR') or (os.path.join(BASE_DIR, 'cache') if SQLITE_PROFILE == 'production' else '')
+
+if CACHE_DIR:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': CACHE_DIR,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+DASHBOARD_CACHE_TIMEOUT = 300                           # seconds the dashboard figures are cached, writes invalidate them sooner
+
+
+# Search
+# 'auto' uses SQLite FTS5 when the sqlite library has it and falls back to the trigram index otherwise
+
+INVENTORY_SEARCH_BACKEND = 'auto'                       # 'auto', 'fts5' or 'trigram'
+
+SEARCH_RESULT_LIMIT = 200                               # most results a stock search returns
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.0/ref/settings/#auth-password-validators
@@ -140,4 +225,70 @@ LOGIN_REQUIRED_IGNORE_VIEW_NAMES = [                    # urls ignored by the lo
     'login',
     'logout',
     'about',
-]
\ No newline at end of file
+]
+
+# Benchmark
+# budgets `python manage.py benchmark` checks each page against, measured on a `seed_scale` dataset with default sizes
+
+BENCHMARK_BUDGETS = {
+    'home': {'queries': 8, 'p95_ms': 500},
+    'dashboard': {'queries': 3, 'p95_ms': 500},
+    'inventory_list': {'queries': 5, 'p95_ms': 1000},
+    'stock_list': {'queries': 5, 'p95_ms': 200},
+    'stock_search': {'queries': 6, 'p95_ms': 200},
+    'low_stock': {'queries': 4, 'p95_ms': 200},
+    'stock_autocomplete': {'queries': 3, 'p95_ms': 50},
+    'purchases_list': {'queries': 6, 'p95_ms': 200},
+    'sales_list': {'queries': 6, 'p95_ms': 200},
+    'new_sale': {'queries': 3, 'p95_ms': 200},
+    'purchase_bill': {'queries': 7, 'p95_ms': 200},
+    'sale_bill': {'queries': 6, 'p95_ms': 200},
+}
+
+
+# Query counting
+# see core/querycount.py, budgets are declared on the views with @query_budget
+
+QUERY_COUNT_HEADERS = DEBUG                             # X-Query-Count etc. response headers, turn on in staging
+
+QUERY_COUNT_LOG_SAMPLE_RATE = 0 if DEBUG else 0.01      # share of requests logged to 'core.querycount', over budget ones always are
+
+
+# Slow queries
+# see core/slowqueries.py, `python manage.py query_stats` prints the statistics
+
+SLOW_QUERY_LOG = not DEBUG                              # SlowQueryMiddleware records and logs queries, turn on in staging
+
+SLOW_QUERY_MS = 100                                     # statements slower than this are logged with their query plan
+
+SLOW_QUERY_LOG_PARAMS = False                           # also write their raw SQL and parameters (user data) to slow.jsonl
+
+QUERY_STATS_DIR = os.path.join(BASE_DIR, 'querystats')  # per-process statistics and slow.jsonl
+
+QUERY_STATS_FLUSH_SECONDS = 10                          # how often each process writes its statistics
+
+
+# Profiling
+# see core/profiling.py, staff profile a request with ?profile=1 or an X-Profile: 1 header
+
+PROFILE_DIR = os.path.join(BASE_DIR, 'profiles')        # where .prof and .collapsed files are written
+
+PROFILE_SAMPLE_RATE = 0                                 # share of all requests profiled, e.g. 0.001 in production
+
+PROFILE_SAMPLE_INTERVAL = 0.001                         # seconds between stack samples
+
+PROFILE_KEEP = 200                                      # newest profiles kept, older ones are deleted
+
+
+# Logging
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'core': {'handlers': ['console'], 'level': 'INFO'},
+    },
+}
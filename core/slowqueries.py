@@ -0,0 +1,258 @@
+"""
+Slow-query log and per-fingerprint query statistics.
+
+SlowQueryMiddleware wraps the database connections while a request is
+handled, timing every statement. Each statement is reduced to a
+fingerprint: its SQL with literals and parameters replaced by `?` and IN
+lists and multi-row VALUES collapsed, so `WHERE id IN (1, 2)` and
+`WHERE id IN (3, 4, 5)` count as one query shape. Per fingerprint the
+process keeps the count, the total time, a sample of durations for
+percentiles and the time spent per view.
+
+A statement slower than SLOW_QUERY_MS is also logged to the
+`core.slowqueries` logger and appended to `slow.jsonl`, with its
+EXPLAIN QUERY PLAN, the view and the line of project code that ran it.
+The parameters can hold customer names, notes and other user data: the
+entry keeps only the fingerprint and the normalized SQL, unless
+SLOW_QUERY_LOG_PARAMS is on to debug with the raw SQL and parameters.
+
+Each process writes its statistics to QUERY_STATS_DIR every
+QUERY_STATS_FLUSH_SECONDS and on exit; `python manage.py query_stats`
+merges the files of every process and prints the heaviest query shapes.
+The middleware does nothing unless SLOW_QUERY_LOG is on (it is off with
+DEBUG, so development servers and test runs write no files).
+"""
+import atexit
+import hashlib
+import json
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+from contextlib import ExitStack
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_SIZE = 500                                       # durations kept per fingerprint for percentiles
+SLOW_LOG = 'slow.jsonl'
+EXPLAINED = ('SELECT', 'WITH', 'UPDATE', 'DELETE')      # an insert's plan says nothing about why it was slow
+NOT_CALLERS = {'core.querycount', 'core.slowqueries', 'core.profiling', 'core.db.sqlite3.base'}    # middleware and backend frames
+
+_NORMALIZE = [
+    (re.compile(r"'(?:[^']|'')*'"), '?'),               # string literals
+    (re.compile(r'\b\d+(?:\.\d+)?\b'), '?'),            # numbers
+    (re.compile(r'%s'), '?'),                           # parameters
+    (re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)'), '(...)'),         # IN lists and VALUES rows
+    (re.compile(r'\(\.\.\.\)(?:\s*,\s*\(\.\.\.\))+'), '(...)'),   # several VALUES rows
+    (re.compile(r'\s+'), ' '),
+]
+
+
+@lru_cache(maxsize=4096)                                # the same SQL text comes back again and again
+def normalize(sql):
+    """The query shape of `sql`: literals and parameters as ?, lists collapsed."""
+    for pattern, replacement in _NORMALIZE:
+        sql = pattern.sub(replacement, sql)
+    return sql.strip()
+
+
+@lru_cache(maxsize=4096)
+def fingerprint(sql):
+    """Short stable id of the query shape of `sql`."""
+    return hashlib.sha1(normalize(sql).encode()).hexdigest()[:12]
+
+
+def stats_dir():
+    return getattr(settings, 'QUERY_STATS_DIR', os.path.join(settings.BASE_DIR, 'querystats'))
+
+
+class QueryStats:
+    """Statistics per fingerprint for this process."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.shapes = {}
+        self.flushed_at = time.monotonic()
+        self.filename = f"stats-{os.getpid()}-{int(time.time())}.json"
+
+    def add(self, sql, ms, view):
+        key = fingerprint(sql)
+        with self.lock:
+            shape = self.shapes.get(key)
+            if shape is None:
+                shape = self.shapes[key] = {'sql': normalize(sql), 'count': 0, 'total_ms': 0.0, 'samples': [], 'views': {}}
+            shape['count'] += 1
+            shape['total_ms'] += ms
+            shape['views'][view] = shape['views'].get(view, 0.0) + ms
+            # reservoir sample, so the kept durations stay representative however many are seen
+            if len(shape['samples']) < SAMPLE_SIZE:
+                shape['samples'].append(ms)
+            else:
+                i = random.randrange(shape['count'])
+                if i < SAMPLE_SIZE:
+                    shape['samples'][i] = ms
+        return key
+
+    def flush(self, force=False):
+        """Write this process's statistics to QUERY_STATS_DIR, at most every QUERY_STATS_FLUSH_SECONDS."""
+        interval = getattr(settings, 'QUERY_STATS_FLUSH_SECONDS', 10)
+        if not force and time.monotonic() - self.flushed_at < interval:
+            return
+        with self.lock:
+            self.flushed_at = time.monotonic()
+            if not self.shapes:
+                return
+            data = json.dumps(self.shapes)
+        directory = stats_dir()
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, self.filename)
+        with open(path + '.tmp', 'w') as f:
+            f.write(data)
+        os.replace(path + '.tmp', path)                 # readers never see a half written file
+
+    def reset(self):
+        with self.lock:
+            self.shapes = {}
+
+
+stats = QueryStats()
+atexit.register(lambda: stats.flush(force=True))
+
+
+def caller():
+    """'path/to/file.py:line in function' of the project code that ran the current query, or ''."""
+    base = str(settings.BASE_DIR) + os.sep
+    frame = sys._getframe(1)
+    # execute wrappers run inside the cursor, the caller is the first project frame outside it
+    while frame is not None and not frame.f_code.co_filename.endswith(os.path.join('django', 'db', 'backends', 'utils.py')):
+        frame = frame.f_back
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if (filename.startswith(base) and 'site-packages' not in filename
+                and frame.f_globals.get('__name__') not in NOT_CALLERS):
+            return f"{filename[len(base):]}:{frame.f_lineno} in {frame.f_code.co_name}"
+        frame = frame.f_back
+    return ''
+
+
+def explain(connection, sql, params):
+    """The query plan of `sql` as a list of lines, or [] if it cannot be explained."""
+    prefix = 'EXPLAIN QUERY PLAN ' if connection.vendor == 'sqlite' else 'EXPLAIN '
+    try:
+        with connection.cursor() as cursor:
+            # the backend's own cursor, so the EXPLAIN is not timed or counted by the execute wrappers
+            cursor.cursor.execute(prefix + sql, params)
+            return [str(row[-1]) for row in cursor.cursor.fetchall()]
+    except Exception:                                   # e.g. a statement that cannot be explained
+        return []
+
+
+class QueryRecorder:
+    """execute_wrapper that times statements, adds them to the statistics and logs the slow ones."""
+
+    def __init__(self, view):
+        self.view = view                                # a callable, the view is only known once the URL is resolved
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            ms = (time.perf_counter() - started) * 1000
+            view = self.view()
+            key = stats.add(sql, ms, view)
+            if ms >= getattr(settings, 'SLOW_QUERY_MS', 100):
+                self.log_slow(context['connection'], sql, params, many, ms, view, key)
+
+    def log_slow(self, connection, sql, params, many, ms, view, key):
+        plan = explain(connection, sql, params) if not many and sql.lstrip().upper().startswith(EXPLAINED) else []
+        entry = {
+            'at': timezone.now().isoformat(),
+            'ms': round(ms, 2),
+            'fingerprint': key,
+            'view': view,
+            'caller': caller(),
+            'sql': normalize(sql),
+            'plan': plan,
+        }
+        if getattr(settings, 'SLOW_QUERY_LOG_PARAMS', False):
+            entry.update(sql=sql, params=repr(params)[:500])
+        logger.warning("Slow query %.1fms in %s (%s) [%s]: %s | plan: %s",
+                       ms, view, entry['caller'], key, normalize(sql)[:300], ' / '.join(plan))
+        directory = stats_dir()
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, SLOW_LOG), 'a') as f:
+            f.write(json.dumps(entry) + '\n')
+
+
+class SlowQueryMiddleware:
+    """Time every query of every request per fingerprint and log the slow ones."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not getattr(settings, 'SLOW_QUERY_LOG', True):
+            return self.get_response(request)
+
+        def view():
+            match = getattr(request, 'resolver_match', None)
+            return match.view_name if match else request.path
+
+        recorder = QueryRecorder(view)
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(recorder))
+            response = self.get_response(request)
+        stats.flush()
+        return response
+
+
+def load():
+    """The statistics of every process that wrote to QUERY_STATS_DIR, merged per fingerprint."""
+    directory = stats_dir()
+    merged = {}
+    if not os.path.isdir(directory):
+        return merged
+    for name in os.listdir(directory):
+        if not (name.startswith('stats-') and name.endswith('.json')):
+            continue
+        with open(os.path.join(directory, name)) as f:
+            shapes = json.load(f)
+        for key, shape in shapes.items():
+            into = merged.setdefault(key, {'sql': shape['sql'], 'count': 0, 'total_ms': 0.0, 'samples': [], 'views': {}})
+            into['count'] += shape['count']
+            into['total_ms'] += shape['total_ms']
+            into['samples'].extend(shape['samples'])
+            for view, ms in shape['views'].items():
+                into['views'][view] = into['views'].get(view, 0.0) + ms
+    return merged
+
+
+def slow_entries(limit=20):
+    """The last `limit` slow queries logged by any process, newest first."""
+    path = os.path.join(stats_dir(), SLOW_LOG)
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        lines = f.readlines()[-limit:]
+    return [json.loads(line) for line in reversed(lines)]
+
+
+def reset():
+    """Forget the statistics of this process and delete every process's files."""
+    stats.reset()
+    directory = stats_dir()
+    if os.path.isdir(directory):
+        for name in os.listdir(directory):
+            if name.startswith('stats-') or name == SLOW_LOG:
+                os.remove(os.path.join(directory, name))
@@ -0,0 +1,537 @@
+import os
+import pstats
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import closing
+from io import StringIO
+from unittest import mock
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase, TransactionTestCase, Client, RequestFactory, override_settings
+from django.urls import reverse
+from django.contrib.auth.models import User
+from django.conf import settings
+from django.db import connection, transaction, OperationalError
+from django.db.utils import ConnectionHandler
+from django.core.signals import request_finished
+from django.http import StreamingHttpResponse
+from django.test.utils import CaptureQueriesContext
+from core.index_advisor import explain, problems
+from core.querycount import QueryBudgetTestMixin, RequestStats
+from core import slowqueries
+from core.db.groupcommit import GroupCommitter
+from core.db.writes import WriterQueue
+from core import replica
+from inventory.models import Stock, StockHistory
+from inventory import views as inventory_views
+from inventory.views import StockListView
+from inventory.services import record_movement, InsufficientStock, REJECT
+
+
+class StockKeysetPaginationTest(TestCase):
+    """Test cursor pagination of the stock list"""
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        # duplicate-free names in shuffled creation order
+        for i in (4, 11, 0, 7, 23, 15, 2, 19, 8, 13, 21, 5, 1, 17, 9, 24, 3, 12, 6, 20, 10, 14, 22, 16, 18):
+            Stock.objects.create(name=f"Stock {i:02d}", quantity=i)
+        self.view = StockListView.as_view(keyset_pagination=True)
+
+    def get_page(self, cursor=None):
+        request = self.factory.get('/inventory/list', {'cursor': cursor} if cursor else {})
+        request.user = self.user
+        return self.view(request).context_data['page_obj']
+
+    def test_walk_forward_and_back(self):
+        """Test that following next then previous cursors visits every stock once"""
+        pages, page = [], self.get_page()
+        pages.append([stock.name for stock in page])
+        while page.has_next():
+            page = self.get_page(page.next_cursor)
+            pages.append([stock.name for stock in page])
+        self.assertEqual([len(names) for names in pages], [10, 10, 5])
+        self.assertEqual(sum(pages, []), [f"Stock {i:02d}" for i in range(25)])
+
+        page = self.get_page(page.previous_cursor)
+        self.assertEqual([stock.name for stock in page], pages[1])
+        page = self.get_page(page.previous_cursor)
+        self.assertEqual([stock.name for stock in page], pages[0])
+        self.assertFalse(page.has_previous())
+
+    def test_bad_cursor_returns_first_page(self):
+        """Test that a tampered cursor falls back to the first page"""
+        page = self.get_page('not-a-cursor')
+        self.assertEqual(page[0].name, "Stock 00")
+        self.assertIsNone(page.paginator.count)
+
+
+class IndexAdvisorTest(TestCase):
+    """Test that the catalogued hot queries are served by indexes"""
+
+    def test_no_full_scans(self):
+        out = StringIO()
+        call_command('index_advisor', stdout=out)
+        self.assertIn("queries use indexes", out.getvalue())
+
+    def test_flags_full_scan(self):
+        _, lines = explain(Stock.objects.filter(quantity=3))
+        self.assertEqual(problems(lines), ['SCAN inventory_stock'])
+        self.assertEqual(problems(lines, allow=['SCAN inventory_stock']), [])
+
+    def test_other_databases_refused(self):
+        with mock.patch.object(connection, 'vendor', 'postgresql'):
+            with self.assertRaisesMessage(ImproperlyConfigured, 'SQLite query plans only'):
+                explain(Stock.objects.all())
+            with self.assertRaisesMessage(CommandError, 'SQLite query plans only'):
+                call_command('index_advisor', stdout=StringIO())
+
+
+class QueryCountTest(QueryBudgetTestMixin, TestCase):
+    """Test the per-request query counting middleware and the query budget helper"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='budgetuser', password='testpass')
+        self.client = Client(HTTP_HOST='127.0.0.1')
+        self.client.force_login(self.user)
+        for i in range(12):
+            stock = Stock.objects.create(name=f'Budget {i}', quantity=i)
+            record_movement(stock, 1, StockHistory.IN, note='seed')
+        self.stock = stock
+
+    def test_duplicate_and_similar_queries(self):
+        stats = RequestStats()
+        with connection.execute_wrapper(stats):
+            for pk in [1, 2, 2]:
+                list(Stock.objects.filter(pk=pk))
+        self.assertEqual((stats.count, stats.duplicates, stats.similar), (3, 1, 1))
+        self.assertEqual(stats.repeated()[0][1], 3)
+        self.assertEqual(stats.over({'queries': 2, 'similar': 1}), ['queries 3 > 2'])
+
+    def test_locked_attempts_are_counted_apart(self):
+        def locked(sql, params, many, context):
+            raise OperationalError('database is locked')
+        stats = RequestStats()
+        with self.assertRaises(OperationalError):
+            stats(locked, 'BEGIN IMMEDIATE', None, False, {})
+        self.assertEqual((stats.count, stats.locked), (0, 1))
+
+    def test_helper_fails_over_budget(self):
+        response = self.client.get(reverse('inventory:inventory'))
+        with self.assertRaises(AssertionError):
+            self.assertWithinQueryBudget(response, queries=1)
+
+    @override_settings(QUERY_COUNT_HEADERS=True)
+    def test_debug_headers(self):
+        response = self.client.get(reverse('inventory:inventory'))
+        self.assertEqual(int(response['X-Query-Count']), response.query_stats.count)
+        self.assertIn('X-Similar-Queries', response)
+        self.assertIn('X-Response-Time-Ms', response)
+
+    @override_settings(QUERY_COUNT_HEADERS=False, QUERY_COUNT_LOG_SAMPLE_RATE=1)
+    def test_sampled_logging_without_headers(self):
+        with self.assertLogs('core.querycount', level='INFO') as logs:
+            response = self.client.get(reverse('inventory:inventory'))
+        self.assertNotIn('X-Query-Count', response)
+        self.assertIn('GET inventory:inventory', logs.output[0])
+
+
+class SlowQueryLogTest(TestCase):
+    """Test query fingerprints, the slow query log and the query_stats command"""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        override = override_settings(QUERY_STATS_DIR=self.directory.name, SLOW_QUERY_LOG=True, SLOW_QUERY_MS=0)
+        override.enable()
+        self.addCleanup(override.disable)
+        slowqueries.stats.reset()
+        self.addCleanup(slowqueries.stats.reset)
+        self.user = User.objects.create_user(username='slowuser', password='testpass')
+        self.client = Client(HTTP_HOST='127.0.0.1')
+        self.client.force_login(self.user)
+        Stock.objects.create(name='Slow Bolt', quantity=3)
+
+    def test_fingerprint_ignores_values_and_list_lengths(self):
+        self.assertEqual(
+            slowqueries.normalize("SELECT a FROM t WHERE id IN (%s, %s) AND name = 'x''y' LIMIT 21"),
+            "SELECT a FROM t WHERE id IN (...) AND name = ? LIMIT ?",
+        )
+        self.assertEqual(
+            slowqueries.fingerprint('INSERT INTO t (a, b) VALUES (%s, %s)'),
+            slowqueries.fingerprint('INSERT INTO t (a, b) VALUES (%s, %s), (%s, %s), (%s, %s)'),
+        )
+        self.assertNotEqual(slowqueries.fingerprint('SELECT a FROM t'), slowqueries.fingerprint('SELECT b FROM t'))
+
+    def test_slow_queries_logged_with_plan_view_and_caller(self):
+        with self.assertLogs('core.slowqueries', level='WARNING'):
+            self.client.get(reverse('inventory:inventory_list'))
+        entries = slowqueries.slow_entries(50)
+        stock_query = next(entry for entry in entries if 'FROM "inventory_stock"' in entry['sql'])
+        self.assertEqual(stock_query['view'], 'inventory:inventory_list')
+        self.assertTrue(stock_query['plan'])
+        self.assertTrue(stock_query['caller'])
+        self.assertNotIn('core/', stock_query['caller'])
+        self.assertNotIn('params', stock_query)
+
+    def test_parameters_kept_out_of_the_log_unless_asked_for(self):
+        Stock.objects.create(name='Customer Secret', quantity=1)
+        url = reverse('inventory:inventory') + '?q=secret'
+        for log_params in (False, True):
+            with self.settings(SLOW_QUERY_LOG_PARAMS=log_params), self.assertLogs('core.slowqueries', level='WARNING') as logs:
+                self.client.get(url)
+            with open(os.path.join(self.directory.name, slowqueries.SLOW_LOG)) as f:
+                self.assertEqual('secret' in f.read(), log_params)
+            self.assertNotIn('secret', '\n'.join(logs.output))
+            call_command('query_stats', '--reset', stdout=StringIO())
+
+    def test_off_without_slow_query_log(self):
+        with self.settings(SLOW_QUERY_LOG=False):
+            self.client.get(reverse('inventory:inventory'))
+        self.assertEqual(slowqueries.stats.shapes, {})
+
+    def test_query_stats_command(self):
+        with self.assertLogs('core.slowqueries', level='WARNING'):
+            for _ in range(3):
+                self.client.get(reverse('inventory:inventory'))
+        out = StringIO()
+        call_command('query_stats', '--view', 'inventory:inventory', '--slow', '1', stdout=out)
+        output = out.getvalue()
+        self.assertIn('inventory_stock', output)
+        self.assertIn('views: inventory:inventory', output)
+        self.assertIn('plan:', output)
+
+        call_command('query_stats', '--reset', stdout=StringIO())
+        self.assertEqual(slowqueries.load(), {})
+        self.assertEqual(slowqueries.slow_entries(), [])
+
+
+class ProductionSQLiteTest(TransactionTestCase):
+    """Test the tuned SQLite backend and the writer queue"""
+
+    def tuned(self, name=None, **options):
+        """A connection with the 'production' profile, on a database file of its own unless `name` is given."""
+        if name is None:
+            directory = tempfile.TemporaryDirectory()
+            self.addCleanup(directory.cleanup)
+            name = os.path.join(directory.name, 'tuned.sqlite3')
+        profile = settings.SQLITE_PROFILES['production']
+        handler = ConnectionHandler({'default': dict(profile, NAME=name, OPTIONS=dict(profile['OPTIONS'], **options))})
+        self.addCleanup(handler['default'].close)
+        return handler['default']
+
+    def held_write_lock(self):
+        """The name of a fresh database file and a plain sqlite3 connection holding its write lock."""
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        name = os.path.join(directory.name, 'locked.sqlite3')
+        holder = sqlite3.connect(name, isolation_level=None)
+        self.addCleanup(holder.close)
+        holder.execute('CREATE TABLE held (x)')
+        holder.execute('BEGIN IMMEDIATE')
+        return name, holder
+
+    def test_pragmas_and_begin_immediate(self):
+        tuned = self.tuned()
+        self.assertEqual(tuned.settings_dict['ENGINE'], 'core.db.sqlite3')
+        with tuned.cursor() as cursor:
+            cursor.execute('PRAGMA cache_size')
+            self.assertEqual(cursor.fetchone()[0], -64000)
+            cursor.execute('PRAGMA journal_mode')
+            self.assertEqual(cursor.fetchone()[0], 'wal')
+        with CaptureQueriesContext(tuned) as queries:
+            tuned.set_autocommit(False, force_begin_transaction_with_broken_autocommit=True)
+            tuned.cursor().execute('CREATE TABLE immediate (x)')
+            tuned.commit()
+            tuned.set_autocommit(True)
+        self.assertEqual(queries[0]['sql'], 'BEGIN IMMEDIATE')
+
+    def test_locked_errors_retried_with_backoff(self):
+        attempts = []
+
+        def flaky():
+            attempts.append(1)
+            if len(attempts) < 3:
+                raise OperationalError('database is locked')
+            return 'done'
+
+        with mock.patch('time.sleep') as sleep:
+            self.assertEqual(self.tuned().with_retries(flaky), 'done')
+        self.assertEqual(len(attempts), 3)
+        self.assertEqual(sleep.call_count, 2)
+        self.assertGreater(sleep.call_args_list[1][0][0], sleep.call_args_list[0][0][0] / 3)
+
+        def broken():
+            attempts.append(1)
+            raise OperationalError('no such table: nowhere')
+
+        attempts.clear()
+        with self.assertRaises(OperationalError):
+            self.tuned().with_retries(broken)
+        self.assertEqual(len(attempts), 1)
+
+    def test_locked_begin_retried_once_per_attempt(self):
+        name, holder = self.held_write_lock()
+        tuned = self.tuned(name, timeout=0.01, retries=2, retry_backoff=0, pragmas={})
+        begins = []
+
+        def count_begins(execute, sql, params, many, context):
+            if sql.startswith('BEGIN'):
+                begins.append(sql)
+            return execute(sql, params, many, context)
+
+        with tuned.execute_wrapper(count_begins), self.assertRaisesMessage(OperationalError, 'database is locked'):
+            tuned.set_autocommit(False, force_begin_transaction_with_broken_autocommit=True)
+        self.assertEqual(begins, ['BEGIN IMMEDIATE'] * 3)
+
+    def test_locked_pragmas_retried_on_connect(self):
+        name, holder = self.held_write_lock()
+        tuned = self.tuned(name, timeout=0.01)
+        with mock.patch('time.sleep', side_effect=lambda seconds: holder.execute('COMMIT')) as sleep:
+            with tuned.cursor() as cursor:
+                cursor.execute('PRAGMA journal_mode')
+                self.assertEqual(cursor.fetchone()[0], 'wal')
+        self.assertEqual(sleep.call_count, 1)
+
+    def test_writer_queue_serves_in_order(self):
+        queue = WriterQueue()
+        order = []
+        queue.__enter__()                                   # hold the queue while the others line up
+        threads = []
+        for i in range(3):
+            thread = threading.Thread(target=lambda i=i: (queue.__enter__(), order.append(i), queue.__exit__()))
+            thread.start()
+            threads.append(thread)
+            while queue.waiting < i + 2:
+                time.sleep(0.001)
+        queue.__exit__()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(order, [0, 1, 2])
+
+    @override_settings(SQLITE_WRITER_QUEUE=True)
+    def test_stock_writes_go_through_the_queue(self):
+        stock = Stock.objects.create(name='Queued', quantity=5)
+        with mock.patch('core.db.writes.writer_queue') as queue:
+            record_movement(stock, 2, StockHistory.OUT)
+            self.assertEqual(queue.__enter__.call_count, 1)
+            with transaction.atomic():                      # nested in an open transaction: not queued again
+                record_movement(stock, 1, StockHistory.OUT)
+            self.assertEqual(queue.__enter__.call_count, 1)
+        stock.refresh_from_db()
+        self.assertEqual(stock.quantity, 2)
+
+
+class ReadReplicaTest(TransactionTestCase):
+    """Test replica routing, sticking to the primary after writes, and the replica refresh"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('replica', password='pass')
+        self.stock = Stock.objects.create(name='Replicated', quantity=5)
+        self.router = replica.ReplicaRouter()
+        self.addCleanup(replica._reset)
+        patcher = mock.patch('core.replica.replica_configured', return_value=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_marked_views_read_project_models_from_the_replica(self):
+        replica._reset()
+        self.assertEqual(self.router.db_for_read(Stock), 'default')          # view not marked
+        replica.state.use_replica = True
+        self.assertEqual(self.router.db_for_read(Stock), 'replica')
+        self.assertEqual(self.router.db_for_read(User), 'default')           # sessions and users stay on the primary
+        with transaction.atomic():
+            self.assertEqual(self.router.db_for_read(Stock), 'default')
+        self.assertEqual(self.router.db_for_write(Stock), 'default')
+        self.assertEqual(self.router.db_for_read(Stock), 'default')          # read your own writes
+
+    def test_middleware_marks_get_requests_of_marked_views(self):
+        middleware = replica.ReplicaMiddleware(lambda request: None)
+        view = reverse('dashboard')
+        for request, expected in [
+            (RequestFactory().get(view), True),
+            (RequestFactory().post(view), False),
+            (RequestFactory(HTTP_COOKIE=f'{replica.STICKY_COOKIE}=1').get(view), False),
+        ]:
+            middleware.process_view(request, inventory_views.dashboard, (), {})
+            self.assertIs(replica.state.use_replica, expected)
+        middleware.process_view(RequestFactory().get('/'), inventory_views.stock_change, (), {})
+        self.assertFalse(replica.state.use_replica)
+
+    def test_writes_keep_the_client_on_the_primary(self):
+        client = Client(HTTP_HOST='127.0.0.1')
+        client.force_login(self.user)
+        response = client.post(reverse('inventory:stock_change', args=[self.stock.pk]),
+                               {'change': 2, 'type': StockHistory.OUT})
+        self.assertEqual(response.status_code, 302)
+        self.assertIn(replica.STICKY_COOKIE, response.cookies)
+        self.assertFalse(replica.state.wrote)
+        response = client.get(reverse('inventory:inventory'))
+        self.assertNotIn(replica.STICKY_COOKIE, response.cookies)
+
+    def test_refresh_copies_the_primary(self):
+        with tempfile.TemporaryDirectory() as directory:
+            target = os.path.join(directory, 'replica.sqlite3')
+            out = StringIO()
+            call_command('refresh_replica', target=target, pages=1, stdout=out)
+            self.assertIn('Refreshed', out.getvalue())
+            with closing(sqlite3.connect(target)) as copy:
+                self.assertEqual(copy.execute('SELECT name, quantity FROM inventory_stock').fetchall(), [('Replicated', 5)])
+
+    def test_refresh_restarted_by_writes_finishes_in_one_step(self):
+        with tempfile.TemporaryDirectory() as directory:
+            source, target = os.path.join(directory, 'primary.sqlite3'), os.path.join(directory, 'replica.sqlite3')
+            with closing(sqlite3.connect(source)) as primary:
+                primary.execute('CREATE TABLE t (x)')
+                primary.executemany('INSERT INTO t VALUES (?)', [(os.urandom(500),) for _ in range(2000)])
+                primary.commit()
+                steps = []
+
+                def write(status, remaining, total):            # a till posts between every step
+                    steps.append(remaining)
+                    primary.execute('INSERT INTO t VALUES (1)')
+                    primary.commit()
+
+                replica.refresh(source, target, pages=10, progress=write)
+                self.assertLess(len(steps), 10)
+                with closing(sqlite3.connect(target)) as copy:
+                    self.assertGreaterEqual(copy.execute('SELECT COUNT(*) FROM t').fetchone()[0], 2001)
+
+    def test_streaming_responses_keep_their_routing_until_finished(self):
+        def export(request):
+            replica.state.use_replica = True                            # as process_view does for a marked view
+            return StreamingHttpResponse(iter([b'rows']))
+        replica.ReplicaMiddleware(export)(RequestFactory().get('/'))
+        self.assertTrue(replica.state.use_replica)                      # the rows are still to be read
+        request_finished.send(sender=self.__class__)
+        self.assertFalse(replica.state.use_replica)
+
+    def test_refresh_needs_a_target(self):
+        with self.assertRaises(CommandError):
+            call_command('refresh_replica')
+
+
+@override_settings(GROUP_COMMIT_WINDOW_MS=200)
+class GroupCommitTest(TransactionTestCase):
+    """Test committing concurrent stock changes in shared transactions"""
+
+    def setUp(self):
+        self.stock = Stock.objects.create(name='Counted', quantity=10)
+
+    def submit_together(self, committer, calls):
+        """Submit `calls` from one thread each; returns [(result, exception)] in the same order."""
+        outcomes = [None] * len(calls)
+        batches = []
+        commit = committer._commit
+        committer._commit = lambda batch: (batches.append(len(batch)), commit(batch))
+
+        def submit(i, args):
+            try:
+                outcomes[i] = (committer.submit(record_movement, *args), None)
+            except Exception as exc:
+                outcomes[i] = (None, exc)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=submit, args=(i, args)) for i, args in enumerate(calls)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return outcomes, batches
+
+    def test_concurrent_movements_commit_together(self):
+        committer = GroupCommitter(idle=0.1)
+        calls = [(self.stock, 1, StockHistory.IN)] * 3 + [(self.stock, 2, StockHistory.OUT)]
+        outcomes, batches = self.submit_together(committer, calls)
+        self.assertEqual(batches, [4])
+        self.assertTrue(all(isinstance(history, StockHistory) and exc is None for history, exc in outcomes))
+        self.stock.refresh_from_db()
+        self.assertEqual(self.stock.quantity, 11)
+        self.assertEqual(StockHistory.objects.filter(stock=self.stock).count(), 4)
+
+    def test_failed_movement_fails_alone(self):
+        committer = GroupCommitter(idle=0.1)
+        calls = [(self.stock, 50, StockHistory.OUT, '', REJECT), (self.stock, 3, StockHistory.OUT)]
+        outcomes, batches = self.submit_together(committer, calls)
+        self.assertEqual(batches, [2])
+        self.assertIsInstance(outcomes[0][1], InsufficientStock)
+        self.assertIsNone(outcomes[1][1])
+        self.stock.refresh_from_db()
+        self.assertEqual(self.stock.quantity, 7)
+        self.assertEqual(StockHistory.objects.get(stock=self.stock).change, 3)
+
+    @override_settings(STOCK_GROUP_COMMIT=True, GROUP_COMMIT_WINDOW_MS=2)
+    def test_stock_change_view_uses_group_commit(self):
+        user = User.objects.create_user('counter', password='pass')
+        client = Client(HTTP_HOST='127.0.0.1')
+        client.force_login(user)
+        with mock.patch.object(GroupCommitter, 'submit', autospec=True, side_effect=GroupCommitter.submit) as submit:
+            response = client.post(reverse('inventory:stock_change', args=[self.stock.pk]),
+                                   {'change': 4, 'type': StockHistory.OUT})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(submit.call_count, 1)
+        self.assertIn(replica.STICKY_COOKIE, response.cookies)     # the router saw the write of the request
+        self.stock.refresh_from_db()
+        self.assertEqual(self.stock.quantity, 6)
+
+
+class RequestProfilingTest(TestCase):
+    """Test on-demand request profiling and the staff profile page."""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        override = override_settings(PROFILE_DIR=self.directory.name)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.staff = User.objects.create_user(username='staffuser', password='testpass', is_staff=True)
+        self.user = User.objects.create_user(username='plainuser', password='testpass')
+        self.client = Client(HTTP_HOST='127.0.0.1')
+
+    def test_staff_profile_writes_pstats_and_collapsed_stacks(self):
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('home'), {'profile': '1'})
+        self.assertEqual(response.status_code, 200)
+        stem = response['X-Profile']
+        self.assertIn('-home-', stem)
+        stats = pstats.Stats(os.path.join(self.directory.name, stem + '.prof'))
+        self.assertTrue(any(name == 'get' for _, _, name in stats.stats))
+        self.assertTrue(os.path.exists(os.path.join(self.directory.name, stem + '.collapsed')))
+
+        response = self.client.get(reverse('about'), HTTP_X_PROFILE='1')
+        self.assertIn('-about-', response['X-Profile'])
+
+    def test_only_staff_can_ask(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('home'), {'profile': '1'})
+        self.assertNotIn('X-Profile', response)
+        self.assertEqual(os.listdir(self.directory.name), [])
+
+    @override_settings(PROFILE_SAMPLE_RATE=1)
+    def test_sampled_requests_are_profiled(self):
+        self.client.force_login(self.user)
+        self.assertIn('X-Profile', self.client.get(reverse('about')))
+
+    @override_settings(PROFILE_KEEP=2)
+    def test_profile_page_lists_and_downloads(self):
+        self.client.force_login(self.staff)
+        stems = [self.client.get(reverse('about'), {'profile': '1'})['X-Profile'] for _ in range(3)]
+        response = self.client.get(reverse('profiles'))
+        self.assertEqual(len(response.context['profiles']), 2)
+        self.assertNotContains(response, stems[0])
+        self.assertContains(response, stems[2] + '.collapsed')
+
+        response = self.client.get(reverse('profile-download', args=[stems[2] + '.prof']))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('attachment', response['Content-Disposition'])
+        self.assertTrue(b''.join(response.streaming_content))                  # reads and closes the file
+        response.close()
+        self.assertEqual(self.client.get(reverse('profile-download', args=['..settings.py'])).status_code, 404)
+
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(reverse('profiles')).status_code, 302)
@@ -17,10 +17,13 @@ from django.contrib import admin
 from django.urls import path, include
 from django.contrib.auth import views as auth_views
 from inventory import views as inventory_views
+from core import profiling
 
 from django.conf.urls.static import static                      # used for static files
 
 urlpatterns = [
+    path('admin/profiles/', profiling.profile_list, name='profiles'),
+    path('admin/profiles/<name>', profiling.profile_download, name='profile-download'),
     path('admin/', admin.site.urls, name='admin'),
     path('login/', auth_views.LoginView.as_view(template_name='login.html'), name='login'),
     path('logout/', auth_views.LogoutView.as_view(template_name='logout.html'), name='logout'),
@@ -1,20 +1,24 @@
 from django.shortcuts import render
 from django.views.generic import View, TemplateView
+from core.querycount import query_budget
+from core.replica import read_replica
 from inventory.models import Stock
 from transactions.models import SaleBill, PurchaseBill
 
 
+@query_budget(queries=7, similar=0)
+@read_replica
 class HomeView(View):
     template_name = "home.html"
     def get(self, request):        
         labels = []
         data = []        
-        stockqueryset = Stock.objects.filter(is_deleted=False).order_by('-quantity')
+        stockqueryset = Stock.objects.filter(is_deleted=False).with_on_hand().order_by('-on_hand')
         for item in stockqueryset:
             labels.append(item.name)
-            data.append(item.quantity)
-        sales = SaleBill.objects.order_by('-time')[:3]
-        purchases = PurchaseBill.objects.order_by('-time')[:3]
+            data.append(item.on_hand)
+        sales = SaleBill.objects.for_list().order_by('-time')[:3]
+        purchases = PurchaseBill.objects.for_list().order_by('-time')[:3]
         context = {
             'labels'    : labels,
             'data'      : data,
@@ -23,5 +27,6 @@ class HomeView(View):
         }
         return render(request, self.template_name, context)
 
+@query_budget(queries=2, similar=0)
 class AboutView(TemplateView):
     template_name = "about.html"
\ No newline at end of file
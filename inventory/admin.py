@@ -1,15 +1,46 @@
 from django.contrib import admin
-from .models import Item, Stock
+from .models import Item, Reconciliation, Reservation, Stock, StockDrift, StockSnapshot
 
 @admin.register(Item)
 class ItemAdmin(admin.ModelAdmin):
-    list_display = ('name', 'sku', 'quantity', 'price', 'category', 'brand', 'expiry_date')
-    list_filter = ('category', 'brand')
+    list_display = ('name', 'sku', 'quantity', 'reorder_point', 'is_low', 'price', 'category', 'brand', 'expiry_date')
+    list_filter = ('is_low', 'category', 'brand')
     search_fields = ('name', 'sku', 'category', 'brand')
     ordering = ('name',)
 
 @admin.register(Stock)
 class StockAdmin(admin.ModelAdmin):
-    list_display = ('name', 'quantity', 'is_deleted')
-    list_filter = ('is_deleted',)
+    list_display = ('name', 'quantity', 'reorder_point', 'is_low', 'shard_count', 'is_deleted')
+    list_filter = ('is_low', 'is_deleted')
     search_fields = ('name',)
+
+    def get_readonly_fields(self, request, obj=None):
+        # an existing stock's quantity only changes through stock movements, see inventory/services.py
+        return ('quantity', 'shard_count') if obj is not None else ('shard_count',)
+
+    def save_model(self, request, obj, form, change):
+        # only the form's fields, saving the whole row would write back the quantity read with the form
+        obj.save(update_fields=list(form.base_fields) if change else None)
+
+@admin.register(Reservation)
+class ReservationAdmin(admin.ModelAdmin):
+    list_display = ('basket', 'stock', 'quantity', 'expires_at')
+    list_select_related = ('stock',)
+
+@admin.register(StockSnapshot)
+class StockSnapshotAdmin(admin.ModelAdmin):
+    list_display = ('stock', 'taken_at', 'quantity')
+    date_hierarchy = 'taken_at'
+    list_select_related = ('stock',)
+
+class StockDriftInline(admin.TabularInline):
+    model = StockDrift
+    fields = ('stock', 'quantity', 'ledger', 'difference')
+    readonly_fields = fields
+    extra = 0
+    can_delete = False
+
+@admin.register(Reconciliation)
+class ReconciliationAdmin(admin.ModelAdmin):
+    list_display = ('pk', 'started_at', 'finished_at', 'history_rows', 'drift_count', 'corrected', 'last_history_id')
+    inlines = [StockDriftInline]
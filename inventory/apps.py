@@ -1,5 +1,11 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class InventoryConfig(AppConfig):
     name = 'inventory'
+
+    def ready(self):
+        from . import signals                                       # connects the signal receivers
+        from .search import create_search_tables
+        post_migrate.connect(create_search_tables, sender=self)     # FTS5 tables are not models, create them after migrating
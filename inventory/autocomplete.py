@@ -0,0 +1,104 @@
+"""
+Typeahead index for picking a stock on the purchase and sale forms.
+
+Each process keeps the names of all live stocks in memory as a sorted
+list of (word, name, id) entries, one per word of the name, so a prefix
+lookup is a binary search instead of a query. The index is rebuilt when
+the version stored in the cache changes; the signals bump it whenever a
+stock is saved or deleted. Quantities change on every bill, so they are
+not indexed but read for the few matching rows only.
+"""
+import bisect
+import threading
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+from .search import WORD_RE
+from .models import Stock
+from .reservations import available
+
+
+VERSION_KEY = 'inventory:autocomplete:version'
+MAX_RESULTS = 10
+
+_lock = threading.Lock()
+_index = None                                   # (version, entries, names)
+
+
+def bump_autocomplete_version():
+    """Mark every process's index as stale, now and once the transaction commits."""
+    _bump()
+    transaction.on_commit(_bump)
+
+
+def _bump():
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, int(time.time() * 1000), None)
+
+
+def _build():
+    entries = []
+    names = {}
+    for pk, name in Stock.objects.filter(is_deleted=False).values_list('pk', 'name').iterator():
+        names[pk] = name
+        for word in set(WORD_RE.findall(name.lower())):
+            entries.append((word, name.lower(), pk))
+    entries.sort()
+    return entries, names
+
+
+def _get_index():
+    global _index
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        _bump()
+        version = cache.get(VERSION_KEY)
+    index = _index
+    if index is None or index[0] != version:
+        with _lock:
+            if _index is None or _index[0] != version:
+                _index = (version, *_build())
+            index = _index
+    return index
+
+
+def stock_label(pk):
+    """Name of the live stock `pk` from the index, or '' if there is none."""
+    try:
+        return _get_index()[2].get(int(pk), '')
+    except (TypeError, ValueError):
+        return ''
+
+
+def suggest(query, limit=MAX_RESULTS, basket=None):
+    """
+    Stocks whose name has a word starting with each word of `query`,
+    names starting with the query first. Returns a list of dicts with
+    the id, name and quantity available: on hand, less what sale baskets
+    other than `basket` have reserved.
+    """
+    terms = WORD_RE.findall(query.lower())
+    if not terms:
+        return []
+    _, entries, names = _get_index()
+
+    first, rest = terms[0], terms[1:]
+    matches = set()
+    start = bisect.bisect_left(entries, (first,))
+    for word, name, pk in entries[start:]:
+        if not word.startswith(first):
+            break
+        words = WORD_RE.findall(name)
+        if all(any(w.startswith(term) for w in words) for term in rest):
+            matches.add((not name.startswith(query.lower().strip()), name, pk))
+    ids = [pk for _, _, pk in sorted(matches)[:limit]]
+
+    quantities = available(Stock.objects.filter(pk__in=ids).only('pk', 'quantity', 'shard_count'), basket)
+    return [
+        {'id': pk, 'name': names[pk], 'quantity': quantities[pk]}
+        for pk in ids if pk in quantities
+    ]
@@ -0,0 +1,19 @@
+"""Exports of the stock ledger, see core/export.py."""
+from core.export import CHUNK_SIZE, date_range
+
+from .models import StockHistory
+
+
+HISTORY_HEADER = ('id', 'timestamp', 'stock_id', 'stock', 'type', 'change', 'note', 'source_type', 'source_id')
+
+
+def history_rows(since=None, until=None, stock=None, chunk_size=CHUNK_SIZE):
+    """StockHistory rows, oldest first, read from the database `chunk_size` rows at a time."""
+    queryset = StockHistory.objects.filter(**date_range('timestamp', since, until))
+    if stock:
+        queryset = queryset.filter(stock_id=stock)
+    return (
+        queryset.order_by('timestamp', 'id')
+        .values_list('id', 'timestamp', 'stock_id', 'stock__name', 'type', 'change', 'note', 'source_type', 'source_id')
+        .iterator(chunk_size=chunk_size)
+    )
@@ -4,12 +4,22 @@ from .models import Stock, Item
 class StockForm(forms.ModelForm):
     class Meta:
         model = Stock
-        fields = ['name', 'quantity']
+        fields = ['name', 'quantity', 'reorder_point']
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if self.instance.pk:
+            # an existing stock's quantity only changes through stock movements, see inventory/services.py
+            del self.fields['quantity']
 
 class ItemForm(forms.ModelForm):
     class Meta:
         model = Item
-        fields = ['name', 'sku', 'quantity', 'price', 'category', 'brand', 'expiry_date']
+        fields = ['name', 'sku', 'quantity', 'reorder_point', 'price', 'category', 'brand', 'expiry_date']
         widgets = {
             'expiry_date': forms.DateInput(attrs={'type': 'date'}),
         }
+
+class CatalogImportForm(forms.Form):
+    catalog = forms.ChoiceField(choices=[('stock', 'Stock (matched by name)'), ('item', 'Item (matched by SKU)')])
+    file = forms.FileField(help_text="CSV with a header row.")
@@ -0,0 +1,193 @@
+"""
+Bulk CSV import of the Stock and Item catalog.
+
+The file is read as a stream and handled `chunk_size` rows at a time.
+Each chunk validates its rows in Python, loads the rows that already
+exist with one in_bulk() by the natural key (Stock name, Item sku), then
+writes with one bulk_update() and one bulk_create(), so the number of
+queries grows with the number of chunks rather than rows. New stocks get
+an opening balance StockHistory row for their quantity, inserted in bulk.
+
+Existing rows are upserted: every column present in the file is updated.
+The exception is Stock.quantity, which only sets the opening balance of
+new stocks; later changes to it go through inventory/services.py so they
+are logged. Items keep no history, so their quantity is updated like any
+other column. Rows that fail validation are skipped and reported with
+their line number; the rest of the file is still imported. So are the
+rows of a chunk that clashes with rows another import added meanwhile.
+"""
+import csv
+import io
+from itertools import islice
+
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .autocomplete import bump_autocomplete_version
+from .models import Item, Stock, StockHistory
+from .search import index_objects
+from .stats import bump_dashboard_version
+
+
+# model -> (natural key, columns that can be imported)
+CATALOGS = {
+    'stock': (Stock, 'name', ('name', 'quantity', 'reorder_point')),
+    'item': (Item, 'sku', ('sku', 'name', 'quantity', 'price', 'reorder_point', 'category', 'brand', 'expiry_date')),
+}
+CHUNK_SIZE = 1000
+OPENING_BALANCE_NOTE = "Opening balance (catalog import)"
+
+
+class ImportReport:
+    """Outcome of an import: counts plus a list of (line number, message) errors."""
+
+    def __init__(self):
+        self.rows = 0
+        self.created = 0
+        self.updated = 0
+        self.errors = []
+
+    def error(self, line, message):
+        self.errors.append((line, message))
+
+    def __str__(self):
+        return f"{self.rows} rows: {self.created} created, {self.updated} updated, {len(self.errors)} errors"
+
+
+def import_catalog(file, catalog='stock', chunk_size=CHUNK_SIZE):
+    """
+    Import the CSV in `file` (a text or binary file object with a header row)
+    into the `catalog` ('stock' or 'item'). Returns an ImportReport.
+    """
+    model, key, columns = CATALOGS[catalog]
+    if isinstance(file.read(0), bytes):
+        file = io.TextIOWrapper(file, encoding='utf-8-sig', newline='')
+    reader = csv.DictReader(file)
+
+    report = ImportReport()
+    header = [name.strip() for name in reader.fieldnames or []]
+    missing = [name for name in _required(model, columns) if name not in header]
+    if missing:
+        report.error(1, f"Missing column(s): {', '.join(missing)}.")
+        return report
+    reader.fieldnames = header
+    present = [name for name in columns if name in header]
+
+    rows = enumerate(reader, start=2)                       # line 1 is the header
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            break
+        report.rows += len(chunk)
+        _import_chunk(model, key, present, chunk, report)
+
+    if report.created or report.updated:
+        bump_dashboard_version()
+        if model is Stock:
+            bump_autocomplete_version()
+    return report
+
+
+def _required(model, columns):
+    return [
+        name for name in columns
+        if not model._meta.get_field(name).has_default() and not model._meta.get_field(name).blank
+    ]
+
+
+def _clean(field, raw):
+    raw = (raw or '').strip()
+    if raw == '':
+        if field.has_default():
+            return field.get_default()
+        if field.blank:
+            return None if field.null else ''
+        raise ValidationError("This field is required.")
+    return field.clean(raw, None)
+
+
+def _parse(model, columns, row):
+    """Clean the cells of one row into {column: value}. Raises ValidationError listing every bad cell."""
+    values = {}
+    errors = []
+    for name in columns:
+        field = model._meta.get_field(name)
+        try:
+            values[name] = _clean(field, row.get(name))
+        except ValidationError as exc:
+            errors.append(f"{name}: {' '.join(exc.messages)}")
+    if values.get('quantity') is not None and values['quantity'] < 0:
+        errors.append("quantity: Must not be negative.")
+    if errors:
+        raise ValidationError('; '.join(errors))
+    return values
+
+
+def _import_chunk(model, key, columns, chunk, report):
+    parsed = {}                                             # key -> (line, values); a later row for the same key wins
+    for line, row in chunk:
+        try:
+            values = _parse(model, columns, row)
+        except ValidationError as exc:
+            report.error(line, ' '.join(exc.messages))
+            continue
+        parsed[values[key]] = (line, values)
+    if not parsed:
+        return
+
+    update_fields = [name for name in columns if name != key and not (model is Stock and name == 'quantity')]
+    try:
+        created, updated = _write_chunk(model, key, update_fields, parsed, report)
+    except IntegrityError as exc:                          # another import created some of the keys since in_bulk()
+        for line, values in parsed.values():
+            report.error(line, f"Not imported, {key} '{values[key]}' may have been added meanwhile ({exc}). Import the file again.")
+        return
+    report.created += created
+    report.updated += updated
+
+
+def _write_chunk(model, key, update_fields, parsed, report):
+    """Upsert the parsed rows of a chunk in one transaction. Returns (created, updated)."""
+    with transaction.atomic():
+        existing = model.objects.in_bulk(list(parsed), field_name=key)
+        updates = []
+        creates = []
+        for value, (line, values) in parsed.items():
+            obj = existing.get(value)
+            if obj is None:
+                obj = model(**values)
+                creates.append(obj)
+            elif getattr(obj, 'is_deleted', False):
+                report.error(line, f"{model._meta.verbose_name} '{value}' has been deleted.")
+                continue
+            else:
+                for name in update_fields:
+                    setattr(obj, name, values[name])
+                updates.append(obj)
+            obj.is_low = obj.quantity <= obj.reorder_point
+
+        if updates and update_fields:
+            model.objects.bulk_update(updates, update_fields + ['is_low'], batch_size=500)
+        if creates:
+            model.objects.bulk_create(creates, batch_size=500)
+            # bulk_create does not set primary keys on SQLite, read them back by key
+            created = model.objects.in_bulk([getattr(obj, key) for obj in creates], field_name=key)
+            creates = [created[getattr(obj, key)] for obj in creates]
+            if model is Stock:
+                _opening_balances(creates)
+
+        # bulk writes send no signals
+        index_objects(model, creates + updates)
+    return len(creates), len(updates)
+
+
+def _opening_balances(stocks):
+    timestamp = timezone.now()
+    StockHistory.objects.bulk_create([
+        StockHistory(
+            stock=stock, change=stock.quantity, type=StockHistory.IN, timestamp=timestamp,
+            note=OPENING_BALANCE_NOTE, source_type=StockHistory.IMPORT,
+        )
+        for stock in stocks if stock.quantity > 0
+    ], batch_size=500)
@@ -0,0 +1,57 @@
+import re
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from inventory.imports import OPENING_BALANCE_NOTE
+from inventory.models import StockHistory
+
+
+# notes written before the source columns existed -> source type; the group, if any, is the source id
+NOTE_PATTERNS = [
+    (re.compile(r'^Purchase from .* - Bill #(\d+)$'), StockHistory.PURCHASE),
+    (re.compile(r'^Purchase bill #(\d+) cancelled/deleted$'), StockHistory.PURCHASE_REVERSAL),
+    (re.compile(r'^Sale to customer - Bill #(\d+)$'), StockHistory.SALE),
+    (re.compile(r'^Sale bill #(\d+) cancelled/deleted$'), StockHistory.SALE_REVERSAL),
+    (re.compile(r'^Reconciliation #(\d+) adjustment$'), StockHistory.ADJUSTMENT),
+    (re.compile(r'^' + re.escape(OPENING_BALANCE_NOTE) + r'$'), StockHistory.IMPORT),
+]
+
+
+def parse_source(note):
+    """(source type, source id) recorded in an old-style note, or None."""
+    for pattern, source_type in NOTE_PATTERNS:
+        match = pattern.match(note)
+        if match:
+            groups = match.groups()
+            return source_type, int(groups[0]) if groups else None
+    return None
+
+
+class Command(BaseCommand):
+    help = "Fill StockHistory.source_type and source_id of rows written before they existed, from their notes."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=2000, help="Rows read and updated per batch.")
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        # rows left as 'manual' with a note are the only candidates; walk them in id order
+        candidates = StockHistory.objects.filter(source_type=StockHistory.MANUAL, source_id__isnull=True).exclude(note='')
+        last_id = 0
+        updated = 0
+        while True:
+            rows = list(candidates.filter(id__gt=last_id).order_by('id').only('id', 'note')[:chunk_size])
+            if not rows:
+                break
+            last_id = rows[-1].id
+            changed = []
+            for row in rows:
+                source = parse_source(row.note)
+                if source:
+                    row.source_type, row.source_id = source
+                    changed.append(row)
+            with transaction.atomic():
+                StockHistory.objects.bulk_update(changed, ['source_type', 'source_id'], batch_size=500)
+            updated += len(changed)
+        self.stdout.write(self.style.SUCCESS(f"Set the source of {updated} history rows."))
@@ -0,0 +1,51 @@
+import json
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from core import benchmark
+
+
+class Command(BaseCommand):
+    help = "Measure latency percentiles and query counts of the main pages, optionally failing on budgets."
+
+    def add_arguments(self, parser):
+        parser.add_argument('names', nargs='*', help="Only these targets (default: all).")
+        parser.add_argument('--runs', type=int, default=20, help="Timed requests per page.")
+        parser.add_argument('--user', help="Username to browse as (default: the first superuser).")
+        parser.add_argument('--budgets', help="JSON file of {target: {figure: limit}}, instead of BENCHMARK_BUDGETS.")
+        parser.add_argument('--output', help="Write the results to this JSON file.")
+        parser.add_argument('--cold', action='store_true', help="Clear the cache before every request.")
+
+    def handle(self, *args, **options):
+        User = get_user_model()
+        users = User.objects.filter(username=options['user']) if options['user'] else User.objects.filter(is_superuser=True)
+        user = users.order_by('pk').first()
+        if user is None:
+            raise CommandError("No user to browse as, create a superuser or pass --user.")
+
+        budgets = getattr(settings, 'BENCHMARK_BUDGETS', {})
+        if options['budgets']:
+            with open(options['budgets']) as f:
+                budgets = json.load(f)
+
+        results = benchmark.run(user, options['names'], runs=options['runs'], budgets=budgets, cold=options['cold'])
+
+        self.stdout.write(f"{'page':<20} {'p50':>8} {'p95':>8} {'p99':>8} {'queries':>8}")
+        for name, result in results.items():
+            line = f"{name:<20} {result['p50_ms']:>8} {result['p95_ms']:>8} {result['p99_ms']:>8} {result['queries']:>8}"
+            self.stdout.write(self.style.ERROR(line) if result['failures'] else line)
+            for failure in result['failures']:
+                self.stdout.write(self.style.ERROR(f"    over budget: {failure}"))
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump({'run_at': timezone.now().isoformat(), 'runs': options['runs'], 'results': results}, f, indent=2)
+            self.stdout.write(f"Results written to {options['output']}.")
+
+        failed = [name for name, result in results.items() if result['failures']]
+        if failed:
+            raise CommandError(f"Over budget: {', '.join(failed)}")
+        self.stdout.write(self.style.SUCCESS(f"{len(results)} pages measured."))
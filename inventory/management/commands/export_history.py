@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core import export
+from inventory.exports import HISTORY_HEADER, history_rows
+
+
+class Command(BaseCommand):
+    help = "Export the stock history ledger as CSV or JSON Lines, streamed in constant memory."
+
+    def add_arguments(self, parser):
+        export.add_arguments(parser)
+
+    def handle(self, *args, **options):
+        try:
+            params = export.parse_options(options)
+        except export.ExportError as exc:
+            raise CommandError(exc)
+        rows = history_rows(params['since'], params['until'], params['stock'])
+        written = export.write_export(options['output'], HISTORY_HEADER, rows, params['format'], params['compress'])
+        if options['output']:
+            self.stdout.write(self.style.SUCCESS(f"Wrote {written} bytes to {options['output']}."))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from inventory.imports import CATALOGS, CHUNK_SIZE, import_catalog
+
+
+class Command(BaseCommand):
+    help = "Import or update stocks (by name) or items (by sku) from a CSV file with a header row."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="CSV file to import.")
+        parser.add_argument('--catalog', choices=sorted(CATALOGS), default='stock')
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help="Rows validated and written per batch.")
+
+    def handle(self, *args, **options):
+        with open(options['path'], newline='', encoding='utf-8-sig') as f:
+            report = import_catalog(f, options['catalog'], chunk_size=options['chunk_size'])
+        for line, message in report.errors:
+            self.stderr.write(f"line {line}: {message}")
+        style = self.style.WARNING if report.errors else self.style.SUCCESS
+        self.stdout.write(style(f"Imported {report}."))
@@ -0,0 +1,33 @@
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+
+from core.index_advisor import advise
+
+
+class Command(BaseCommand):
+    help = "Run EXPLAIN QUERY PLAN over the catalog of hot queries (each app's queries.py) and flag full table scans."
+
+    def add_arguments(self, parser):
+        parser.add_argument('names', nargs='*', help="Only check these catalogued queries.")
+        parser.add_argument('--sql', action='store_true', help="Print the SQL of every query as well.")
+
+    def handle(self, *args, **options):
+        try:
+            plans = advise(options['names'])
+        except ImproperlyConfigured as exc:                 # not an SQLite database
+            raise CommandError(exc)
+
+        for plan in plans:
+            status = self.style.SUCCESS('ok  ') if plan.ok else self.style.ERROR('SCAN')
+            self.stdout.write(f"{status} {plan.name}")
+            if options['sql'] or not plan.ok:
+                if options['sql']:
+                    self.stdout.write(f"       {plan.sql}")
+                for line in plan.lines:
+                    marker = '!' if line in plan.problems else ' '
+                    self.stdout.write(f"     {marker} {line}")
+
+        flagged = [plan.name for plan in plans if not plan.ok]
+        if flagged:
+            raise CommandError(f"{len(flagged)} of {len(plans)} queries read whole tables: {', '.join(flagged)}")
+        self.stdout.write(self.style.SUCCESS(f"All {len(plans)} queries use indexes."))
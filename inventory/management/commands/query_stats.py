@@ -0,0 +1,73 @@
+from django.core.management.base import BaseCommand
+
+from core import slowqueries
+from core.benchmark import percentile
+
+
+SORT_KEYS = {
+    'total': lambda row: row['total_ms'],
+    'count': lambda row: row['count'],
+    'p95': lambda row: row['p95_ms'],
+    'mean': lambda row: row['total_ms'] / row['count'],
+}
+
+
+class Command(BaseCommand):
+    help = "Print database time per query fingerprint, merged from every process, and the latest slow queries."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sort', choices=sorted(SORT_KEYS), default='total', help="Order of the query shapes.")
+        parser.add_argument('--limit', type=int, default=20, help="Query shapes to show.")
+        parser.add_argument('--view', help="Only time spent in this view (e.g. transactions:new-sale).")
+        parser.add_argument('--slow', type=int, default=0, metavar='N', help="Also show the last N slow queries with their plans.")
+        parser.add_argument('--reset', action='store_true', help="Delete the collected statistics and slow query log.")
+
+    def handle(self, *args, **options):
+        if options['reset']:
+            slowqueries.reset()
+            self.stdout.write(self.style.SUCCESS("Query statistics deleted."))
+            return
+
+        slowqueries.stats.flush(force=True)                 # this process's own queries, if any
+        rows = []
+        for key, shape in slowqueries.load().items():
+            views = shape['views']
+            if options['view']:
+                if options['view'] not in views:
+                    continue
+                # only the share of this view: scale the count and total by its part of the time
+                share = views[options['view']] / shape['total_ms'] if shape['total_ms'] else 0
+                views = {options['view']: views[options['view']]}
+            else:
+                share = 1
+            rows.append({
+                'fingerprint': key,
+                'sql': shape['sql'],
+                'count': round(shape['count'] * share),
+                'total_ms': shape['total_ms'] * share,
+                'p50_ms': percentile(shape['samples'], 50),
+                'p95_ms': percentile(shape['samples'], 95),
+                'views': sorted(views.items(), key=lambda item: -item[1]),
+            })
+        if not rows:
+            self.stdout.write("No query statistics yet. They are collected by core.slowqueries.SlowQueryMiddleware.")
+        rows = [row for row in rows if row['count']]
+        rows.sort(key=SORT_KEYS[options['sort']], reverse=True)
+        grand_total = sum(row['total_ms'] for row in rows) or 1
+
+        for row in rows[:options['limit']]:
+            self.stdout.write(
+                f"{row['fingerprint']}  {row['total_ms']:>10.1f}ms total  {row['total_ms'] / grand_total:>5.1%}  "
+                f"{row['count']:>7} calls  p50 {row['p50_ms']:.2f}ms  p95 {row['p95_ms']:.2f}ms"
+            )
+            self.stdout.write(f"    {row['sql'][:200]}")
+            top = ', '.join(f"{view} {ms:.0f}ms" for view, ms in row['views'][:3])
+            self.stdout.write(f"    views: {top}")
+
+        for entry in slowqueries.slow_entries(options['slow']) if options['slow'] else []:
+            self.stdout.write(self.style.WARNING(
+                f"\n{entry['at']}  {entry['ms']}ms  {entry['view']}  {entry['caller']}  [{entry['fingerprint']}]"
+            ))
+            self.stdout.write(f"    {entry['sql'][:300]}")
+            for line in entry['plan']:
+                self.stdout.write(f"    plan: {line}")
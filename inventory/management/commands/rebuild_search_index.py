@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from inventory import search
+
+
+class Command(BaseCommand):
+    help = "Rebuild the stock and item search index (SQLite FTS5, or the trigram table as a fallback)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=2000, help="Rows read and indexed per batch.")
+
+    def handle(self, *args, **options):
+        counts = search.rebuild(chunk_size=options['chunk_size'])
+        backend = 'FTS5' if search.use_fts() else 'trigram'
+        for model, count in counts.items():
+            self.stdout.write(f"{model}: {count} indexed")
+        self.stdout.write(self.style.SUCCESS(f"Search index rebuilt ({backend})."))
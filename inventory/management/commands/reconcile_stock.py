@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from core.export import write_export
+from inventory.reconciliation import CHUNK_SIZE, DRIFT_HEADER, drift_rows, reconcile
+
+
+class Command(BaseCommand):
+    help = "Compare every stock's quantity with its StockHistory ledger, reading only the rows added since the last run."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--correct', action='store_true', help="Post StockHistory adjustments so the ledger matches the quantities.")
+        parser.add_argument('--report', help="Write the drift report to this CSV file.")
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help="History ids summed per query.")
+        parser.add_argument('--rebuild', action='store_true', help="Forget the checkpoint and re-read the whole ledger.")
+
+    def handle(self, *args, **options):
+        run = reconcile(correct=options['correct'], chunk_size=options['chunk_size'], rebuild=options['rebuild'])
+        self.stdout.write(f"Read {run.history_rows} history rows, checkpoint now at id {run.last_history_id}.")
+        if options['report']:
+            write_export(options['report'], DRIFT_HEADER, drift_rows(run))
+            self.stdout.write(f"Drift report written to {options['report']}.")
+        elif run.drift_count:
+            for row in drift_rows(run):
+                self.stdout.write("  {1} (id {0}): {2} on hand, {3} in ledger, {4:+d}".format(*row))
+
+        if not run.drift_count:
+            self.stdout.write(self.style.SUCCESS("No drift."))
+        elif run.corrected:
+            self.stdout.write(self.style.WARNING(f"{run.drift_count} stocks drifted, correcting entries posted."))
+        else:
+            self.stdout.write(self.style.WARNING(f"{run.drift_count} stocks drifted. Run with --correct to post adjustments."))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from inventory.models import Item, Stock
+from inventory.stats import bump_dashboard_version
+
+
+class Command(BaseCommand):
+    help = "Recompute the is_low flag of every stock and item from its quantity and reorder point."
+
+    def handle(self, *args, **options):
+        stocks = Stock.objects.refresh_low_flags()
+        items = Item.objects.refresh_low_flags()
+        bump_dashboard_version()
+        self.stdout.write(self.style.SUCCESS(f"Refreshed {stocks} stocks and {items} items."))
@@ -0,0 +1,37 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core import replica
+
+
+class Command(BaseCommand):
+    help = "Copy the primary SQLite database into the read replica with the SQLite backup API."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--target', help="Replica database file (default: the NAME of the 'replica' database).")
+        parser.add_argument('--pages', type=int, default=-1,
+                            help="Pages copied per step, the primary is free between steps (default: all in one step). "
+                                 "A copy restarted by a write to the primary is finished in one step.")
+        parser.add_argument('--every', type=float, default=0, metavar='SECONDS', help="Keep refreshing, every SECONDS.")
+
+    def handle(self, *args, **options):
+        source = settings.DATABASES['default']
+        if source['ENGINE'].rsplit('.', 1)[-1] != 'sqlite3':
+            raise CommandError("refresh_replica copies SQLite databases; replicate other databases with their own tools.")
+        target = options['target'] or settings.DATABASES.get(replica.REPLICA, {}).get('NAME')
+        if not target:
+            raise CommandError("No replica configured, set READ_REPLICA or pass --target.")
+        if options['pages'] == 0 or options['pages'] < -1:
+            raise CommandError("--pages must be positive, or -1 for a single step.")
+
+        while True:
+            started = time.perf_counter()
+            replica.refresh(str(source['NAME']), str(target), options['pages'])
+            self.stdout.write(self.style.SUCCESS(
+                f"Refreshed {target} in {(time.perf_counter() - started) * 1000:.0f}ms."
+            ))
+            if not options['every']:
+                return
+            time.sleep(options['every'])
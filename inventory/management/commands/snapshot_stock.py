@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from inventory.snapshots import take_snapshot
+
+
+class Command(BaseCommand):
+    help = "Record the quantity of every stock as a StockSnapshot. Schedule it daily, e.g. from cron."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--at',
+            help="Snapshot a past moment instead of now: YYYY-MM-DD (end of that day) or an ISO datetime.",
+        )
+        parser.add_argument('--chunk-size', type=int, default=2000, help="Snapshots inserted per batch.")
+
+    def handle(self, *args, **options):
+        at = None
+        if options['at']:
+            at = parse_datetime(options['at']) or parse_date(options['at'])
+            if at is None:
+                raise CommandError(f"Invalid --at '{options['at']}'.")
+            if hasattr(at, 'tzinfo') and timezone.is_naive(at):
+                at = timezone.make_aware(at)
+        count = take_snapshot(at, chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f"Snapshot of {count} stocks recorded."))
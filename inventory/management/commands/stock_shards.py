@@ -0,0 +1,55 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from inventory import shards
+from inventory.models import Stock
+
+
+class Command(BaseCommand):
+    help = (
+        "Split the quantity of hot stocks over several rows so concurrent sales do not all update the same row, "
+        "stop doing so, or compact the shards into Stock.quantity (see inventory/shards.py)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('stocks', nargs='*', type=int, metavar='STOCK_ID', help="Stocks to shard (or unshard).")
+        parser.add_argument('--hot', type=int, default=0, metavar='N', help="Also shard the N stocks with the most movements this week.")
+        parser.add_argument('--shards', type=int, default=shards.DEFAULT_SHARDS, help="Shards per stock.")
+        parser.add_argument('--off', action='store_true', help="Unshard the given stocks, or every sharded stock if none are given.")
+        parser.add_argument('--compact', action='store_true', help="Copy the shards of every sharded stock into Stock.quantity.")
+        parser.add_argument('--every', type=float, default=0, metavar='SECONDS', help="With --compact, keep compacting every SECONDS.")
+
+    def handle(self, *args, **options):
+        if options['compact']:
+            while True:
+                count = shards.compact()
+                self.stdout.write(f"Compacted {count} sharded stocks.")
+                if not options['every']:
+                    return
+                time.sleep(options['every'])
+
+        ids = list(options['stocks'])
+        if options['off']:
+            stocks = Stock.objects.filter(shard_count__gt=0)
+            if ids:
+                stocks = stocks.filter(pk__in=ids)
+            for stock in stocks:
+                shards.unshard(stock)
+                self.stdout.write(f"{stock.name}: {stock.quantity}, no longer sharded.")
+            return
+
+        if options['shards'] <= 0:
+            raise CommandError("--shards must be positive.")
+        ids += [pk for pk in shards.hottest(options['hot']) if pk not in ids] if options['hot'] else []
+        if not ids:
+            raise CommandError("Name the stocks to shard, or use --hot N, --off or --compact.")
+        found = {stock.pk: stock for stock in Stock.objects.filter(pk__in=ids)}
+        missing = [str(pk) for pk in ids if pk not in found]
+        if missing:
+            raise CommandError(f"No stock with id {', '.join(missing)}.")
+        for pk in ids:
+            shards.shard(found[pk], options['shards'])
+            self.stdout.write(self.style.SUCCESS(
+                f"{found[pk].name}: {found[pk].quantity} over {options['shards']} shards."
+            ))
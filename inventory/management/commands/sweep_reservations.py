@@ -0,0 +1,19 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from inventory.reservations import sweep
+
+
+class Command(BaseCommand):
+    help = "Delete expired sale basket reservations in bulk. Schedule it, or keep it running with --every."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--every', type=float, default=0, metavar='SECONDS', help="Keep sweeping, every SECONDS.")
+
+    def handle(self, *args, **options):
+        while True:
+            self.stdout.write(f"Swept {sweep()} expired reservations.")
+            if not options['every']:
+                return
+            time.sleep(options['every'])
@@ -1,16 +1,112 @@
 from decimal import Decimal
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Case, F, IntegerField, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
 from django.utils import timezone
 
+DEFAULT_REORDER_POINT = 5
+
+def low_after(delta):
+    """
+    Expression for the is_low flag once `delta` (an int or expression) has been
+    added to quantity, for use in the same UPDATE as the quantity change.
+    """
+    return Case(
+        When(quantity__lte=F('reorder_point') - delta, then=Value(True)),
+        default=Value(False),
+        output_field=models.BooleanField(),
+    )
+
+def signed_change():
+    """StockHistory.change with stock outs negated, so Sum() of it is the net movement."""
+    return Case(
+        When(type=StockHistory.OUT, then=-F('change')),
+        default=F('change'),
+        output_field=models.IntegerField(),
+    )
+
+class LowStockQuerySet(models.QuerySet):
+    def low_stock(self):
+        """Rows at or below their reorder point, served by the partial index on the is_low flag."""
+        return self.filter(is_low=True)
+
+    def refresh_low_flags(self):
+        """Recompute is_low in one statement, for rows written without going through save()."""
+        return self.update(is_low=low_after(0))
+
+class StockQuerySet(LowStockQuerySet):
+    def refresh_low_flags(self):
+        """Recompute is_low in one statement, summing the shards of sharded stocks."""
+        return self.update(is_low=Case(
+            When(shard_count=0, then=low_after(0)),
+            When(reorder_point__gte=shards_total(), then=Value(True)),
+            default=Value(False),
+            output_field=models.BooleanField(),
+        ))
+
+    def with_on_hand(self):
+        """
+        Annotate `on_hand`, the quantity on hand. Stock.quantity of a sharded
+        stock is the figure of its last compaction, on_hand sums its shards.
+        """
+        return self.annotate(on_hand=Case(
+            When(shard_count=0, then=F('quantity')),
+            default=shards_total(),
+            output_field=IntegerField(),
+        ))
+
 class Stock(models.Model):
     id = models.AutoField(primary_key=True)
     name = models.CharField(max_length=30, unique=True, verbose_name='Name')
     quantity = models.IntegerField(default=1)
+    reorder_point = models.IntegerField(default=DEFAULT_REORDER_POINT, verbose_name='Reorder point')
+    is_low = models.BooleanField(default=False, editable=False)     # quantity <= reorder_point, kept up to date on every write
     is_deleted = models.BooleanField(default=False)
+    # a hot stock's quantity can be split over this many StockShard rows, see inventory/shards.py; 0: not sharded
+    shard_count = models.PositiveSmallIntegerField(default=0, editable=False)
+
+    objects = StockQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # only low rows are indexed, so the low stock screen never reads the rest of the table
+            models.Index(fields=['name'], name='stock_low_name_idx', condition=Q(is_low=True, is_deleted=False)),
+            # the stock list, ordered by name and keyset paginated on (name, id), never reads deleted rows
+            models.Index(fields=['name', 'id'], name='stock_live_name_idx', condition=Q(is_deleted=False)),
+        ]
 
     def __str__(self):
 	    return self.name
 
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'quantity' not in update_fields:
+            if 'reorder_point' not in update_fields:
+                return super().save(*args, **kwargs)
+            # the quantity in memory may be stale (a sale posted since it was read): flag from the stored one
+            with transaction.atomic():
+                super().save(*args, **kwargs)
+                Stock.objects.filter(pk=self.pk).refresh_low_flags()
+            return
+        self.is_low = self.quantity <= self.reorder_point
+        if update_fields is not None:
+            kwargs['update_fields'] = set(update_fields) | {'is_low'}
+        super().save(*args, **kwargs)
+
+def shards_total():
+    """Expression for the sum of the shards of the stock of the outer query (0 if it has none)."""
+    total = StockShard.objects.filter(stock=OuterRef('pk')).order_by().values('stock').annotate(total=Sum('quantity')).values('total')
+    return Coalesce(Subquery(total, output_field=IntegerField()), 0)
+
+class StockHistoryQuerySet(models.QuerySet):
+    def for_source(self, source_type, source_id=None):
+        """Movements caused by `source_type` (one or a list), e.g. a bill's, served by the source index."""
+        types = [source_type] if isinstance(source_type, str) else list(source_type)
+        queryset = self.filter(source_type__in=types)
+        if source_id is not None:
+            queryset = queryset.filter(source_id=source_id)
+        return queryset
+
 class StockHistory(models.Model):
     IN = 'IN'
     OUT = 'OUT'
@@ -19,36 +115,108 @@ class StockHistory(models.Model):
         (OUT, 'Stock Out'),
     ]
 
+    # what caused the movement; source_id is the bill number, import or reconciliation run it belongs to
+    MANUAL = 'manual'
+    PURCHASE = 'purchase'
+    PURCHASE_REVERSAL = 'purchase_reversal'
+    SALE = 'sale'
+    SALE_REVERSAL = 'sale_reversal'
+    IMPORT = 'import'
+    ADJUSTMENT = 'adjustment'
+    SOURCE_CHOICES = [
+        (MANUAL, 'Manual'),
+        (PURCHASE, 'Purchase'),
+        (PURCHASE_REVERSAL, 'Purchase cancelled'),
+        (SALE, 'Sale'),
+        (SALE_REVERSAL, 'Sale cancelled'),
+        (IMPORT, 'Catalog import'),
+        (ADJUSTMENT, 'Reconciliation adjustment'),
+    ]
+
     stock = models.ForeignKey(Stock, on_delete=models.CASCADE, related_name='stock_history')
     change = models.IntegerField()
     type = models.CharField(max_length=3, choices=TYPE_CHOICES)
     timestamp = models.DateTimeField(default=timezone.now)
     note = models.CharField(max_length=255, blank=True)
+    source_type = models.CharField(max_length=20, choices=SOURCE_CHOICES, default=MANUAL)
+    source_id = models.IntegerField(null=True, blank=True)
+
+    objects = StockHistoryQuerySet.as_manager()
 
     class Meta:
         ordering = ['-timestamp']
+        indexes = [
+            # point-in-time queries only read the rows between a snapshot and the date asked for
+            models.Index(fields=['timestamp'], name='history_timestamp_idx'),
+            # one stock's history, newest first
+            models.Index(fields=['stock', '-timestamp'], name='history_stock_time_idx'),
+            # a bill's movements, or all movements of one kind, without scanning the notes
+            models.Index(fields=['source_type', 'source_id'], name='history_source_idx'),
+        ]
 
     def __str__(self):
         return f"{self.timestamp} - {self.stock.name} - {self.type} {self.change}"
         return self.name
 
 
+class StockSnapshot(models.Model):
+    """
+    Quantity of a stock at `taken_at`, written for every stock at once by
+    `python manage.py snapshot_stock`. Past quantities are worked out from
+    the nearest snapshot instead of replaying the whole ledger, see
+    inventory/snapshots.py.
+    """
+    stock = models.ForeignKey(Stock, on_delete=models.CASCADE, related_name='snapshots')
+    taken_at = models.DateTimeField()
+    quantity = models.IntegerField()
+
+    class Meta:
+        ordering = ['-taken_at']
+        constraints = [
+            models.UniqueConstraint(fields=['stock', 'taken_at'], name='snapshot_stock_taken_at_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['taken_at'], name='snapshot_taken_at_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.taken_at} - {self.stock.name} - {self.quantity}"
+
+
 class Item(models.Model):
     name = models.CharField(max_length=200)
     sku = models.CharField(max_length=100, unique=True)
     quantity = models.IntegerField(default=0)
     price = models.DecimalField(max_digits=10, decimal_places=2)
+    reorder_point = models.IntegerField(default=DEFAULT_REORDER_POINT)
+    is_low = models.BooleanField(default=False, editable=False)     # quantity <= reorder_point, kept up to date by save()
 
     # New metadata fields
     expiry_date = models.DateField(null=True, blank=True)
     category = models.CharField(max_length=100, blank=True)
     brand = models.CharField(max_length=100, blank=True)
 
-    def is_low_stock(self, threshold=5):
+    objects = LowStockQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['name'], name='item_low_name_idx', condition=Q(is_low=True)),
+        ]
+
+    def save(self, *args, **kwargs):
+        self.is_low = self.quantity <= self.reorder_point
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'quantity', 'reorder_point'} & set(update_fields):
+            kwargs['update_fields'] = set(update_fields) | {'is_low'}
+        super().save(*args, **kwargs)
+
+    def is_low_stock(self, threshold=None):
         """
         Returns True if quantity is less than or equal to threshold.
-        Default threshold is 5 but callers can pass a different value.
+        The threshold defaults to the item's reorder point but callers can pass a different value.
         """
+        if threshold is None:
+            threshold = self.reorder_point
         return self.quantity <= threshold
 
     def total_value(self):
@@ -60,3 +228,141 @@ class Item(models.Model):
     def __str__(self):
         # Friendly representation without exposing sensitive data
         return self.name or self.sku
+
+
+class SearchTrigram(models.Model):
+    """
+    Trigram search index used when SQLite FTS5 is not available, see inventory/search.py.
+    One row per distinct trigram of an indexed Stock or Item.
+    """
+    STOCK = 'stock'
+    ITEM = 'item'
+    KIND_CHOICES = [
+        (STOCK, 'Stock'),
+        (ITEM, 'Item'),
+    ]
+
+    kind = models.CharField(max_length=5, choices=KIND_CHOICES)
+    object_id = models.IntegerField()
+    trigram = models.CharField(max_length=3)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['kind', 'trigram', 'object_id'], name='search_trigram_idx'),
+            models.Index(fields=['kind', 'object_id'], name='search_trigram_object_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} {self.object_id} - {self.trigram}"
+
+
+class StockShard(models.Model):
+    """
+    A share of a sharded stock's quantity. Movements of a hot stock change
+    one of its shards instead of its Stock row, so they do not all wait
+    for the same row lock; the stock's quantity on hand is the sum of its
+    shards, copied to Stock.quantity by compaction. See inventory/shards.py.
+    """
+    stock = models.ForeignKey(Stock, on_delete=models.CASCADE, related_name='shards')
+    number = models.PositiveSmallIntegerField()
+    quantity = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['stock', 'number'], name='shard_stock_number_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.stock_id}/{self.number} - {self.quantity}"
+
+
+class ReservationQuerySet(models.QuerySet):
+    def active(self):
+        """Reservations that have not expired."""
+        return self.filter(expires_at__gt=timezone.now())
+
+    def reserved(self, stocks, excluding=None):
+        """{stock id: quantity held} by the active reservations of the stock ids in `stocks`, leaving out basket `excluding`."""
+        queryset = self.active().filter(stock_id__in=list(stocks))
+        if excluding:
+            queryset = queryset.exclude(basket=excluding)
+        return dict(queryset.order_by().values('stock').annotate(total=Sum('quantity')).values_list('stock', 'total'))
+
+    def held(self, excluding=None):
+        """
+        Expression for the quantity the active reservations hold of the
+        stock of the outer query (0 if none), leaving out basket `excluding`.
+        """
+        queryset = self.active().filter(stock=OuterRef('pk'))
+        if excluding:
+            queryset = queryset.exclude(basket=excluding)
+        total = queryset.order_by().values('stock').annotate(total=Sum('quantity')).values('total')
+        return Coalesce(Subquery(total, output_field=IntegerField()), 0)
+
+
+class Reservation(models.Model):
+    """
+    Quantity of a stock held for a sale basket (a till's open new-sale
+    page) until `expires_at`. Posting the bill turns the basket's
+    reservations into the sale; see inventory/reservations.py.
+    """
+    basket = models.CharField(max_length=32)
+    stock = models.ForeignKey(Stock, on_delete=models.CASCADE, related_name='reservations')
+    quantity = models.PositiveIntegerField()
+    expires_at = models.DateTimeField()
+
+    objects = ReservationQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['basket', 'stock'], name='reservation_basket_stock_uniq'),
+        ]
+        indexes = [
+            # what is held against a stock is summed over its unexpired rows
+            models.Index(fields=['stock', 'expires_at'], name='reservation_stock_expiry_idx'),
+            # the sweep deletes the expired rows of every stock
+            models.Index(fields=['expires_at'], name='reservation_expiry_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.basket} - {self.stock_id} x {self.quantity}"
+
+
+class LedgerBalance(models.Model):
+    """
+    Running sum of a stock's StockHistory rows, kept by the reconciliation
+    job so each run only has to add the rows written since the last one.
+    """
+    stock = models.OneToOneField(Stock, on_delete=models.CASCADE, primary_key=True, related_name='ledger_balance')
+    balance = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.stock_id} - {self.balance}"
+
+
+class Reconciliation(models.Model):
+    """One run of `python manage.py reconcile_stock`. `last_history_id` is the checkpoint the next run starts from."""
+    started_at = models.DateTimeField(default=timezone.now)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    last_history_id = models.IntegerField(default=0)
+    history_rows = models.IntegerField(default=0)           # ledger rows read by this run
+    drift_count = models.IntegerField(default=0)
+    corrected = models.BooleanField(default=False)
+
+    class Meta:
+        ordering = ['-started_at']
+
+    def __str__(self):
+        return f"Reconciliation {self.pk} - {self.drift_count} drifted"
+
+
+class StockDrift(models.Model):
+    """A stock whose quantity did not match its ledger in a reconciliation run."""
+    reconciliation = models.ForeignKey(Reconciliation, on_delete=models.CASCADE, related_name='drifts')
+    stock = models.ForeignKey(Stock, on_delete=models.CASCADE, related_name='drifts')
+    quantity = models.IntegerField()
+    ledger = models.IntegerField()
+    difference = models.IntegerField()                      # quantity - ledger
+
+    def __str__(self):
+        return f"{self.stock.name}: {self.quantity} on hand, {self.ledger} in ledger"
@@ -0,0 +1,57 @@
+"""Hot query shapes of the inventory app, checked by `python manage.py index_advisor`."""
+from django.utils import timezone
+
+from core.index_advisor import register
+
+from .models import Reservation, Stock, StockHistory, StockSnapshot
+
+
+@register('stock list')
+def stock_list():
+    return Stock.objects.filter(is_deleted=False).order_by('name', 'id')[:10]
+
+
+@register('stock list, next keyset page')
+def stock_list_next_page():
+    return Stock.objects.filter(is_deleted=False, name__gt='m').order_by('name', 'id')[:10]
+
+
+@register('low stock list')
+def low_stock_list():
+    return Stock.objects.filter(is_deleted=False).low_stock().order_by('name', 'id')[:25]
+
+
+@register('stock history preview')
+def history_preview():
+    return StockHistory.objects.select_related('stock')[:20]
+
+
+@register('history of one stock')
+def stock_history():
+    return StockHistory.objects.filter(stock_id=1).order_by('-timestamp')[:20]
+
+
+@register('history in a date range')
+def history_range():
+    now = timezone.now()
+    return StockHistory.objects.filter(timestamp__gte=now - timezone.timedelta(days=1), timestamp__lt=now)
+
+
+@register('movements of a bill', allow=['USE TEMP B-TREE'])      # sorts only the few rows of one bill
+def bill_movements():
+    return StockHistory.objects.for_source([StockHistory.SALE, StockHistory.SALE_REVERSAL], 1)
+
+
+@register('stock held by other sale baskets')
+def reserved_stock():
+    return Reservation.objects.active().filter(stock_id__in=[1, 2]).exclude(basket='0' * 32).order_by().values('stock')
+
+
+@register('expired reservations')
+def expired_reservations():
+    return Reservation.objects.filter(expires_at__lte=timezone.now())
+
+
+@register('latest snapshot')
+def latest_snapshot():
+    return StockSnapshot.objects.filter(taken_at__lte=timezone.now()).order_by('-taken_at')[:1]
@@ -0,0 +1,146 @@
+"""
+Reconciliation of Stock.quantity against the StockHistory ledger.
+
+Quantities can drift from the ledger, e.g. when a quantity is typed over
+on the stock form. A run first brings LedgerBalance, the running ledger
+sum per stock, up to date: history rows after the checkpoint (the
+`last_history_id` of the previous run) are added in id ranges of
+`chunk_size`, each range in one grouped query and saved with the new
+checkpoint in the same transaction, so an interrupted run resumes where
+it stopped. Then a single query lists the stocks whose quantity differs
+from their balance. Rows written while the run is going are counted in
+that query too, so a busy shop does not show up as drift.
+
+With `correct=True` a correcting StockHistory row is posted per drifted
+stock so the ledger matches the quantity on hand; the quantity itself is
+left alone. The corrections are picked up by the next run like any other
+new rows. History rows are treated as append-only: editing or deleting
+rows behind the checkpoint needs a run with `rebuild=True`.
+"""
+from django.db import transaction
+from django.db.models import Count, F, IntegerField, Max, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from . import shards
+from .models import LedgerBalance, Reconciliation, Stock, StockDrift, StockHistory, signed_change
+from .stats import bump_dashboard_version
+
+
+CHUNK_SIZE = 50000                                      # history ids per grouped query
+DRIFT_HEADER = ('stock_id', 'stock', 'quantity', 'ledger', 'difference')
+
+
+def reconcile(correct=False, chunk_size=CHUNK_SIZE, rebuild=False):
+    """Run a reconciliation and return the Reconciliation, with its StockDrift rows saved."""
+    if rebuild:
+        with transaction.atomic():
+            LedgerBalance.objects.all().delete()
+            Reconciliation.objects.update(last_history_id=0)
+
+    shards.compact()                                    # the quantities of sharded stocks are those of their shards
+    checkpoint = Reconciliation.objects.aggregate(last=Max('last_history_id'))['last'] or 0
+    run = Reconciliation.objects.create(last_history_id=checkpoint)
+    end = StockHistory.objects.aggregate(last=Max('id'))['last'] or 0
+
+    while run.last_history_id < end:
+        upto = min(run.last_history_id + chunk_size, end)
+        with transaction.atomic():
+            run.history_rows += _apply(run.last_history_id, upto)
+            run.last_history_id = upto
+            run.save(update_fields=['last_history_id', 'history_rows'])
+
+    drifts = [
+        StockDrift(
+            reconciliation=run,
+            stock_id=pk,
+            quantity=quantity,
+            ledger=ledger,
+            difference=quantity - ledger,
+        )
+        for pk, quantity, ledger in _drifted(run.last_history_id).iterator()
+    ]
+    with transaction.atomic():
+        StockDrift.objects.bulk_create(drifts, batch_size=500)
+        if correct and drifts:
+            _correct(run, drifts)
+        run.drift_count = len(drifts)
+        run.corrected = correct and bool(drifts)
+        run.finished_at = timezone.now()
+        run.save(update_fields=['drift_count', 'corrected', 'finished_at'])
+    return run
+
+
+def drift_rows(run):
+    """The drift report of `run` as rows matching DRIFT_HEADER, largest difference first."""
+    return (
+        run.drifts.order_by('-difference', 'stock_id')
+        .values_list('stock_id', 'stock__name', 'quantity', 'ledger', 'difference')
+        .iterator()
+    )
+
+
+def _apply(after, upto):
+    """Add the net of history rows with after < id <= upto to the balances. Returns the rows read."""
+    totals = list(
+        StockHistory.objects.filter(id__gt=after, id__lte=upto)
+        .order_by()
+        .values('stock_id')
+        .annotate(net=Sum(signed_change()), rows=Count('id'))
+        .values_list('stock_id', 'net', 'rows')
+    )
+    if not totals:
+        return 0
+    balances = LedgerBalance.objects.in_bulk([pk for pk, _, _ in totals])
+    updates = []
+    creates = []
+    for pk, net, _ in totals:
+        if pk in balances:
+            balances[pk].balance += net
+            updates.append(balances[pk])
+        else:
+            creates.append(LedgerBalance(stock_id=pk, balance=net))
+    LedgerBalance.objects.bulk_update(updates, ['balance'], batch_size=500)
+    LedgerBalance.objects.bulk_create(creates, batch_size=500)
+    return sum(rows for _, _, rows in totals)
+
+
+def _drifted(checkpoint):
+    """(stock id, quantity, ledger) of every stock whose quantity differs from its ledger, in one query."""
+    balance = LedgerBalance.objects.filter(stock=OuterRef('pk')).values('balance')
+    # rows written after the checkpoint are read in the same statement as the quantity they changed
+    pending = (
+        StockHistory.objects.filter(stock=OuterRef('pk'), id__gt=checkpoint)
+        .order_by()
+        .values('stock')
+        .annotate(net=Sum(signed_change()))
+        .values('net')
+    )
+    ledger = (
+        Coalesce(Subquery(balance, output_field=IntegerField()), 0)
+        + Coalesce(Subquery(pending, output_field=IntegerField()), 0)
+    )
+    return (
+        Stock.objects.annotate(ledger=ledger)
+        .exclude(quantity=F('ledger'))
+        .order_by('pk')
+        .values_list('pk', 'quantity', 'ledger')
+    )
+
+
+def _correct(run, drifts):
+    """Post a StockHistory row per drift that brings the ledger to the quantity on hand."""
+    timestamp = timezone.now()
+    StockHistory.objects.bulk_create([
+        StockHistory(
+            stock_id=drift.stock_id,
+            change=abs(drift.difference),
+            type=StockHistory.IN if drift.difference > 0 else StockHistory.OUT,
+            timestamp=timestamp,
+            note=f"Reconciliation #{run.pk} adjustment",
+            source_type=StockHistory.ADJUSTMENT,
+            source_id=run.pk,
+        )
+        for drift in drifts
+    ], batch_size=500)
+    bump_dashboard_version()
@@ -0,0 +1,89 @@
+"""
+Stock reservations for sale baskets.
+
+The new-sale page is a basket: it gets an id when it is opened, and each
+line a till adds is reserved against its stock for RESERVATION_TTL_SECONDS
+(every change to the basket renews all its lines). A stock's available
+quantity is its quantity on hand minus the unexpired reservations of
+other baskets, so a till cannot be promised units another till is
+holding. Posting the bill (issue_stock with the basket) takes the stock
+and deletes the basket's reservations in the same transaction.
+
+A reservation is written in its own short transaction when the line is
+added; nothing stays locked while the till works on the sale. Oversell
+is still ruled out at posting time by issue_stock, which counts other
+baskets' reservations as taken. Expired reservations are ignored
+everywhere and deleted in bulk by sweep(), see `python manage.py
+sweep_reservations`.
+"""
+import datetime
+import re
+import uuid
+
+from django.conf import settings
+from django.utils import timezone
+
+from core.db.writes import write_atomic
+
+from . import shards
+from .models import Reservation, Stock
+from .services import InsufficientStock
+
+
+BASKET_RE = re.compile(r'[0-9a-f]{32}')
+
+
+def ttl():
+    return datetime.timedelta(seconds=getattr(settings, 'RESERVATION_TTL_SECONDS', 600))
+
+
+def new_basket():
+    """A fresh basket id."""
+    return uuid.uuid4().hex
+
+
+def valid_basket(value):
+    """Whether `value` looks like a basket id from new_basket()."""
+    return bool(BASKET_RE.fullmatch(value or ''))
+
+
+def available(stocks, basket=None):
+    """
+    {stock id: quantity on hand minus what other baskets hold} of the
+    stocks in the queryset `stocks`, read in one query.
+    """
+    stocks = list(stocks.annotate(held=Reservation.objects.held(excluding=basket)))
+    quantities = shards.on_hand(stocks)
+    return {stock.pk: quantities[stock.pk] - stock.held for stock in stocks}
+
+
+def reserve(basket, stock, quantity):
+    """
+    Hold `quantity` of `stock` for `basket`, replacing its earlier hold on
+    that stock; 0 releases it. Renews every line of the basket. Returns
+    the quantity of the stock left available to other baskets. Raises
+    InsufficientStock, changing nothing, when fewer units are available.
+    """
+    expires_at = timezone.now() + ttl()
+    with write_atomic():
+        # a short lock on the stock row, so two tills cannot both be promised its last units
+        row = Stock.objects.select_for_update().get(pk=stock.pk)
+        free = shards.on_hand([row], cached=False)[row.pk] - Reservation.objects.reserved([row.pk], excluding=basket).get(row.pk, 0)
+        if quantity <= 0:
+            Reservation.objects.filter(basket=basket, stock=row).delete()
+        elif quantity > free:
+            raise InsufficientStock(row, quantity, max(free, 0))
+        elif not Reservation.objects.filter(basket=basket, stock=row).update(quantity=quantity, expires_at=expires_at):
+            Reservation.objects.create(basket=basket, stock=row, quantity=quantity, expires_at=expires_at)
+        Reservation.objects.filter(basket=basket).update(expires_at=expires_at)
+    return free - max(quantity, 0)
+
+
+def release(basket):
+    """Drop every reservation of `basket`, e.g. when the sale is abandoned."""
+    return Reservation.objects.filter(basket=basket).delete()[0]
+
+
+def sweep():
+    """Delete every expired reservation in one statement. Returns how many there were."""
+    return Reservation.objects.filter(expires_at__lte=timezone.now()).delete()[0]
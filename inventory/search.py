@@ -0,0 +1,230 @@
+"""
+Ranked search over Stock names and Item name, sku, category and brand.
+
+Both backends match the same way: every word of the query must be the
+start of a word of the object, e.g. "bol m8" finds "Hex Bolt M8" but "olt"
+finds nothing. Words are split, lower-cased and stripped of diacritics as
+the FTS5 tokenizer does it (words()).
+
+On SQLite builds with FTS5 every model has an FTS5 table whose rowid is
+the object's primary key, queried with prefix terms and ordered by bm25.
+Elsewhere (or with INVENTORY_SEARCH_BACKEND = 'trigram') the SearchTrigram
+table is used instead: it holds the trigrams of every word and a marker
+of the first two letters of each, the objects having all those of the
+query are checked against the query words, and shorter texts rank first.
+Either way a search reads the index, never the whole Stock or Item table.
+
+The indexes are kept in sync by the receivers in inventory/signals.py.
+Bulk writes send no signals and must call index_objects() themselves.
+`python manage.py rebuild_search_index` rebuilds everything.
+"""
+import re
+import unicodedata
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Case, Count, IntegerField, Value, When
+
+from .models import Item, SearchTrigram, Stock
+
+
+# model -> (FTS5 table, indexed fields, SearchTrigram kind)
+INDEXES = {
+    Stock: ('inventory_stock_fts', ('name',), SearchTrigram.STOCK),
+    Item: ('inventory_item_fts', ('name', 'sku', 'category', 'brand'), SearchTrigram.ITEM),
+}
+
+WORD_RE = re.compile(r'[^\W_]+')                          # letters and digits, like the unicode61 tokenizer
+WORD_START = '^'                                            # marks the first letters of a word in SearchTrigram
+VERIFY_CHUNK = 500                                          # trigram candidates checked against their text at a time
+
+_fts5_available = None
+
+
+def use_fts():
+    """True when the FTS5 tables are used, False for the trigram fallback."""
+    global _fts5_available
+    backend = getattr(settings, 'INVENTORY_SEARCH_BACKEND', 'auto')
+    if backend != 'auto':
+        return backend == 'fts5'
+    if connection.vendor != 'sqlite':
+        return False
+    if _fts5_available is None:
+        with connection.cursor() as cursor:
+            cursor.execute("PRAGMA compile_options")
+            _fts5_available = any(row[0] == 'ENABLE_FTS5' for row in cursor.fetchall())
+    return _fts5_available
+
+
+def create_search_tables(**kwargs):
+    """Create the FTS5 tables if they do not exist yet. Connected to post_migrate."""
+    if not use_fts():
+        return
+    with connection.cursor() as cursor:
+        for table, fields, _ in INDEXES.values():
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {table} USING fts5("
+                f"{', '.join(fields)}, tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+            )
+
+
+def drop_search_tables():
+    with connection.cursor() as cursor:
+        for table, _, _ in INDEXES.values():
+            cursor.execute(f"DROP TABLE IF EXISTS {table}")
+
+
+def words(text):
+    """The words of `text`, lower-cased and without diacritics."""
+    text = unicodedata.normalize('NFKD', text.lower())
+    return WORD_RE.findall(''.join(char for char in text if not unicodedata.combining(char)))
+
+
+def trigrams(text):
+    """Trigrams of every word in `text`, plus WORD_START and the first two letters of each word."""
+    grams = set()
+    for word in words(text):
+        grams.add(WORD_START + word[:2])
+        grams.update(word[i:i + 3] for i in range(len(word) - 2))
+    return grams
+
+
+def _matches(text, terms):
+    """Whether every term starts a word of `text`, the FTS5 rule for "term"* queries."""
+    text_words = words(text)
+    return all(any(word.startswith(term) for word in text_words) for term in terms)
+
+
+def index_objects(model, objects):
+    """Add or replace the index entries of `objects` (instances of `model`)."""
+    objects = list(objects)
+    if not objects:
+        return
+    table, fields, kind = INDEXES[model]
+    if use_fts():
+        with connection.cursor() as cursor:
+            cursor.executemany(f"DELETE FROM {table} WHERE rowid = %s", [(obj.pk,) for obj in objects])
+            cursor.executemany(
+                f"INSERT INTO {table} (rowid, {', '.join(fields)}) VALUES (%s{', %s' * len(fields)})",
+                [(obj.pk, *[getattr(obj, field) or '' for field in fields]) for obj in objects],
+            )
+    else:
+        SearchTrigram.objects.filter(kind=kind, object_id__in=[obj.pk for obj in objects]).delete()
+        SearchTrigram.objects.bulk_create([
+            SearchTrigram(kind=kind, object_id=obj.pk, trigram=gram)
+            for obj in objects
+            for gram in trigrams(' '.join(str(getattr(obj, field) or '') for field in fields))
+        ], batch_size=500)
+
+
+def unindex_objects(model, pks):
+    """Remove the index entries of the objects with primary keys `pks`."""
+    pks = list(pks)
+    table, _, kind = INDEXES[model]
+    if use_fts():
+        with connection.cursor() as cursor:
+            cursor.executemany(f"DELETE FROM {table} WHERE rowid = %s", [(pk,) for pk in pks])
+    else:
+        SearchTrigram.objects.filter(kind=kind, object_id__in=pks).delete()
+
+
+def search_ids(model, query, limit=None):
+    """Primary keys of the `model` objects matching `query`, best match first."""
+    limit = limit or getattr(settings, 'SEARCH_RESULT_LIMIT', 200)
+    terms = words(query)
+    if not terms:
+        return []
+    table, fields, kind = INDEXES[model]
+
+    if use_fts():
+        # every term must match as a word prefix, e.g. "bol"* AND "m8"*
+        match = ' '.join(f'"{term}"*' for term in terms)
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT rowid FROM {table} WHERE {table} MATCH %s ORDER BY rank LIMIT %s", [match, limit])
+            return [row[0] for row in cursor.fetchall()]
+
+    grams = SearchTrigram.objects.filter(kind=kind)
+    candidates = None
+    long_grams = set()
+    for term in terms:
+        # a word starting with the term's first letters, as a range so the index is used
+        start = WORD_START + term[:2]
+        ids = set(grams.filter(trigram__gte=start, trigram__lt=start + '\uffff').values_list('object_id', flat=True))
+        candidates = ids if candidates is None else candidates & ids
+        long_grams |= trigrams(term) - {start}
+    if long_grams and candidates:
+        ids = set(
+            grams.filter(trigram__in=long_grams)
+            .values('object_id')
+            .annotate(hits=Count('id'))
+            .filter(hits=len(long_grams))
+            .values_list('object_id', flat=True)
+        )
+        candidates &= ids
+    if not candidates:
+        return []
+
+    # fewer trigrams means a shorter text, i.e. the query covers more of it
+    ranked = list(
+        grams.filter(object_id__in=candidates)
+        .values('object_id')
+        .annotate(size=Count('id'))
+        .order_by('size', 'object_id')
+        .values_list('object_id', flat=True)
+    )
+    # having the trigrams does not make the terms word prefixes: check the candidates' text, best first
+    found = []
+    for start in range(0, len(ranked), VERIFY_CHUNK):
+        chunk = ranked[start:start + VERIFY_CHUNK]
+        texts = {
+            pk: ' '.join(str(value or '') for value in values)
+            for pk, *values in model.objects.filter(pk__in=chunk).values_list('pk', *fields)
+        }
+        found += [pk for pk in chunk if pk in texts and _matches(texts[pk], terms)]
+        if len(found) >= limit:
+            break
+    return found[:limit]
+
+
+def search(queryset, query, limit=None):
+    """
+    (`queryset` narrowed to the best `limit` matches of `query` ordered by
+    rank, whether there were more matches than that).
+    """
+    limit = limit or getattr(settings, 'SEARCH_RESULT_LIMIT', 200)
+    ids = search_ids(queryset.model, query, limit + 1)
+    if not ids:
+        return queryset.none(), False
+    truncated = len(ids) > limit
+    ids = ids[:limit]
+    rank = Case(*[When(pk=pk, then=Value(position)) for position, pk in enumerate(ids)], output_field=IntegerField())
+    return queryset.filter(pk__in=ids).order_by(rank), truncated
+
+
+def search_queryset(queryset, query, limit=None):
+    """Narrow `queryset` to the objects matching `query`, ordered by rank."""
+    return search(queryset, query, limit)[0]
+
+
+def rebuild(chunk_size=2000):
+    """Rebuild both indexes from scratch. Returns {model name: rows indexed}."""
+    counts = {}
+    with transaction.atomic():
+        if use_fts():
+            drop_search_tables()
+            create_search_tables()
+        else:
+            SearchTrigram.objects.all().delete()
+
+        for model, (_, fields, _) in INDEXES.items():
+            count = 0
+            chunk = []
+            for obj in model.objects.only('pk', *fields).iterator(chunk_size=chunk_size):
+                chunk.append(obj)
+                if len(chunk) >= chunk_size:
+                    index_objects(model, chunk)
+                    count += len(chunk)
+                    chunk = []
+            index_objects(model, chunk)
+            counts[model.__name__] = count + len(chunk)
+    return counts
@@ -0,0 +1,249 @@
+"""
+Stock mutation service.
+
+Every change to Stock.quantity goes through this module so that the new
+quantity and the StockHistory row describing it are written in the same
+database transaction. Quantities are changed with database-side F()
+expressions, never with a read-modify-write in Python, so concurrent
+writers cannot lose each other's updates, and the is_low flag is set in
+the same UPDATE as the quantity. Bulk writes send no model
+signals, so the batch functions invalidate cached figures themselves.
+
+With STOCK_GROUP_COMMIT on, single movements posted at the same time
+(submit_movement) are committed together, see core/db/groupcommit.py.
+Movements of sharded stocks change their StockShard rows instead of the
+Stock row, see inventory/shards.py. Stock outs leave the quantities
+reserved for open sale baskets alone, see inventory/reservations.py.
+"""
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connection, router
+from django.db.models import F, Case, When, Value, IntegerField
+from django.utils import timezone
+
+from core.db.groupcommit import GroupCommitter
+from core.db.writes import write_atomic
+
+from . import shards
+from .models import Reservation, Stock, StockHistory, low_after
+from .stats import bump_dashboard_version
+
+
+# what to do when a stock out asks for more than is on hand
+CLAMP = 'clamp'                                 # take what is there and leave the stock at zero
+REJECT = 'reject'                               # refuse the movement with InsufficientStock
+
+
+class InsufficientStock(Exception):
+    """Raised when a stock out cannot be filled under the REJECT policy."""
+
+    def __init__(self, stock, requested, available):
+        self.stock = stock
+        self.requested = requested
+        self.available = available
+        super().__init__(
+            f"Not enough '{stock.name}' in stock: {requested} requested, {available} available."
+        )
+
+
+def record_movement(stock, change, type, note='', policy=CLAMP, timestamp=None,
+                    source_type=StockHistory.MANUAL, source_id=None):
+    """
+    Apply a stock in/out of `change` units to `stock` and log it, with
+    `source_type` and `source_id` saying what caused it (e.g. a sale bill).
+    Returns the StockHistory row. The history row records the quantity
+    that was actually applied, so with CLAMP a short stock out logs only
+    what was on hand. `stock.quantity` is refreshed from the database
+    (for a sharded stock it is the figure of the last compaction).
+    """
+    if change <= 0:
+        raise ValueError("change must be a positive integer")
+
+    with write_atomic():
+        if type == StockHistory.IN:
+            if not _add(Stock.objects.filter(pk=stock.pk, shard_count=0), change):
+                shards.add(stock.pk, Stock.objects.values_list('shard_count', flat=True).get(pk=stock.pk), change)
+            applied = change
+        else:
+            applied = _take(stock, change, policy)
+
+        history = StockHistory.objects.create(
+            stock=stock,
+            change=applied,
+            type=type,
+            timestamp=timestamp or timezone.now(),
+            note=note,
+            source_type=source_type,
+            source_id=source_id,
+        )
+
+    stock.refresh_from_db(fields=['quantity'])
+    return history
+
+
+group_committer = GroupCommitter()
+
+
+def submit_movement(stock, change, type, note='', policy=CLAMP):
+    """
+    record_movement() for a single movement posted on its own, e.g. from
+    the stock change form. With STOCK_GROUP_COMMIT on it is committed in
+    one transaction with the movements other threads post at the same
+    time; either way it has committed when this returns.
+    """
+    if not getattr(settings, 'STOCK_GROUP_COMMIT', False) or connection.in_atomic_block:
+        return record_movement(stock, change, type, note=note, policy=policy)
+    # routers keep per-request state (the replica's sticky primary), so they must see the write in this thread
+    router.db_for_write(StockHistory)
+    return group_committer.submit(record_movement, stock, change, type, note=note, policy=policy)
+
+
+def _take(stock, change, policy):
+    """Remove up to `change` units from `stock`, leaving what sale baskets hold alone; returns the units removed."""
+    if stock.shard_count:
+        taken = _take_shards(stock, stock.shard_count, change, policy)
+        if taken is not None:
+            return taken
+    # the common case is a single conditional UPDATE that only succeeds when enough stock is free
+    elif _add(Stock.objects.filter(pk=stock.pk, shard_count=0, quantity__gte=Reservation.objects.held() + change), -change):
+        return change
+
+    # short on stock: lock the row (sqlite already holds the write lock from the UPDATE above)
+    quantity, held, shard_count = (
+        Stock.objects.select_for_update().annotate(held=Reservation.objects.held())
+        .values_list('quantity', 'held', 'shard_count').get(pk=stock.pk)
+    )
+    if shard_count:                                     # sharded since `stock` was read
+        return _take_shards(stock, shard_count, change, policy)
+    available = max(quantity - held, 0)
+    taken = min(change, available)
+    if taken < change and policy == REJECT:
+        raise InsufficientStock(stock, change, available)
+
+    if taken:
+        _add(Stock.objects.filter(pk=stock.pk), -taken)
+    return taken
+
+
+def _take_shards(stock, shard_count, change, policy):
+    """_take() for a sharded stock; None if it has no shards (any more)."""
+    reserved = Reservation.objects.reserved([stock.pk]).get(stock.pk, 0)
+    taken = shards.take(stock.pk, shard_count, change, partial=policy != REJECT, reserved=reserved)
+    if taken is None:
+        return None
+    taken, available = taken
+    if taken < change and policy == REJECT:
+        raise InsufficientStock(stock, change, available)
+    return taken
+
+
+def receive_stock(lines, note='', timestamp=None, source_type=StockHistory.MANUAL, source_id=None):
+    """
+    Apply a batch of stock ins, e.g. the lines of a purchase bill.
+    `lines` is a list of (stock, quantity) pairs. All quantities are added
+    with a single UPDATE and one StockHistory row per line is bulk inserted,
+    so the number of queries does not grow with the number of lines.
+    Returns the StockHistory rows. The stock instances are not refreshed.
+    """
+    totals = _totals(lines)
+    if not totals:
+        return []
+
+    timestamp = timestamp or timezone.now()
+    with write_atomic():
+        if _add(Stock.objects.filter(pk__in=totals, shard_count=0), _by_stock(totals)) < len(totals):
+            for pk, shard_count in Stock.objects.filter(pk__in=totals, shard_count__gt=0).values_list('pk', 'shard_count'):
+                shards.add(pk, shard_count, totals[pk])
+        history = StockHistory.objects.bulk_create([
+            StockHistory(
+                stock=stock, change=quantity, type=StockHistory.IN, timestamp=timestamp, note=note,
+                source_type=source_type, source_id=source_id,
+            )
+            for stock, quantity in lines
+        ])
+        bump_dashboard_version()
+    return history
+
+
+def _add(queryset, delta):
+    """Add `delta` (an int or expression) to the quantity of every row in one UPDATE, keeping is_low in step."""
+    return queryset.update(quantity=F('quantity') + delta, is_low=low_after(delta))
+
+
+def _totals(lines):
+    """Sum the quantities of (stock, quantity) lines per stock id."""
+    totals = defaultdict(int)
+    for stock, quantity in lines:
+        if quantity <= 0:
+            raise ValueError("quantity must be a positive integer")
+        totals[stock.pk] += quantity
+    return totals
+
+
+def _by_stock(values):
+    """CASE expression picking each stock's value from a {stock id: value} dict."""
+    return Case(
+        *[When(pk=pk, then=Value(value)) for pk, value in values.items()],
+        default=Value(0),
+        output_field=IntegerField(),
+    )
+
+
+def issue_stock(lines, note='', timestamp=None, source_type=StockHistory.MANUAL, source_id=None, basket=None):
+    """
+    Apply a batch of stock outs, e.g. the lines of a sale bill, all or nothing.
+    `lines` is a list of (stock, quantity) pairs. The affected Stock rows are
+    locked in ascending id order, so concurrent baskets sharing stocks queue
+    up instead of deadlocking, then availability is checked for the whole
+    basket before a single UPDATE takes every quantity. Sharded stocks are
+    not locked; their quantities are taken from their shards. Quantities
+    reserved for other sale baskets are not available; the reservations of
+    `basket`, if given, are used up by this sale and deleted. Raises
+    InsufficientStock, changing nothing, if any stock cannot cover its lines.
+    Returns the StockHistory rows. The stock instances are not refreshed.
+    """
+    totals = _totals(lines)
+    if not totals:
+        return []
+
+    stocks = {stock.pk: stock for stock, _ in lines}
+    timestamp = timestamp or timezone.now()
+    with write_atomic():
+        available = dict(
+            Stock.objects.select_for_update()
+            .filter(pk__in=totals, shard_count=0)
+            .order_by('pk')
+            .values_list('pk', 'quantity')
+        )
+        reserved = Reservation.objects.reserved(totals, excluding=basket)
+        from_shards = set()
+        if len(available) < len(totals):
+            sharded = Stock.objects.filter(pk__in=totals, shard_count__gt=0).order_by('pk').values_list('pk', 'shard_count')
+            for pk, shard_count in sharded:
+                taken = shards.take(pk, shard_count, totals[pk], reserved=reserved.get(pk, 0))
+                if taken is None:                       # unsharded meanwhile: take it from its row like the others
+                    available[pk] = Stock.objects.select_for_update().values_list('quantity', flat=True).get(pk=pk)
+                elif not taken[0]:                      # the transaction rolls back what was taken already
+                    raise InsufficientStock(stocks[pk], totals[pk], taken[1])
+                else:
+                    from_shards.add(pk)
+        for pk in sorted(totals):
+            free = available.get(pk, 0) - reserved.get(pk, 0)
+            if pk not in from_shards and free < totals[pk]:
+                raise InsufficientStock(stocks[pk], totals[pk], max(free, 0))
+
+        plain = {pk: quantity for pk, quantity in totals.items() if pk not in from_shards}
+        if plain:
+            _add(Stock.objects.filter(pk__in=plain), -_by_stock(plain))
+        history = StockHistory.objects.bulk_create([
+            StockHistory(
+                stock=stock, change=quantity, type=StockHistory.OUT, timestamp=timestamp, note=note,
+                source_type=source_type, source_id=source_id,
+            )
+            for stock, quantity in lines
+        ])
+        if basket:
+            Reservation.objects.filter(basket=basket).delete()
+        bump_dashboard_version()
+    return history
@@ -0,0 +1,201 @@
+"""
+Sharded quantities for hot stocks.
+
+A few fast-moving stocks get most of the sales and purchases, and every
+one of those transactions updates the same Stock row. A stock can be
+split over `shard_count` StockShard rows instead: its quantity on hand is
+the sum of the shards, a stock in adds to a random shard and a stock out
+takes from a random shard that holds enough, so concurrent movements
+mostly touch different rows.
+
+Shards never go below zero, so a stock cannot be oversold: when no single
+shard covers a stock out, take() locks all the stock's shards, checks
+their sum and takes from the fullest first. The sale then waits for the
+other writers of that stock, as every sale did before.
+
+Stock.quantity of a sharded stock is the figure of the last compaction:
+compact() copies the sum of the shards into it and spreads the quantity
+evenly over the shards again, so stock outs keep finding a shard with
+enough. Run `python manage.py stock_shards --compact --every 10` next to
+the server. Pages read the exact figure through
+Stock.objects.with_on_hand(), on_hand() gives it cached for
+STOCK_SHARD_CACHE_SECONDS. Reconciliation and snapshots compact first.
+Stock.is_low is kept exact: a movement writes the Stock row when it
+takes the stock across its reorder point, and only then.
+
+Every write goes through inventory/services.py, which sends the
+movements of sharded stocks here. On SQLite, which locks the whole
+database for a write, sharding spreads nothing; it pays off on databases
+with row locks.
+"""
+import datetime
+import random
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import BooleanField, Case, Count, F, Sum, Value, When
+from django.utils import timezone
+
+from .models import Stock, StockHistory, StockShard, shards_total
+from .stats import bump_dashboard_version
+
+
+DEFAULT_SHARDS = 8
+CACHE_KEY = 'inventory:on_hand:{}'
+
+
+def _spread(total, count):
+    """`total` split into `count` near equal non-negative parts."""
+    total = max(total, 0)
+    return [total // count + (1 if n < total % count else 0) for n in range(count)]
+
+
+def shard(stock, count=DEFAULT_SHARDS):
+    """Split the quantity of `stock` over `count` shards. A sharded stock is re-split."""
+    if count <= 0:
+        raise ValueError("count must be a positive integer")
+    with transaction.atomic():
+        row = Stock.objects.select_for_update().get(pk=stock.pk)
+        parts = _spread(_total(row), count)
+        StockShard.objects.filter(stock=row).delete()
+        StockShard.objects.bulk_create([StockShard(stock=row, number=n, quantity=part) for n, part in enumerate(parts)])
+        total = sum(parts)
+        Stock.objects.filter(pk=row.pk).update(quantity=total, shard_count=count, is_low=total <= row.reorder_point)
+    cache.delete(CACHE_KEY.format(stock.pk))
+    stock.refresh_from_db(fields=['quantity', 'shard_count', 'is_low'])
+
+
+def unshard(stock):
+    """Fold the shards of `stock` back into Stock.quantity and stop sharding it."""
+    with transaction.atomic():
+        row = Stock.objects.select_for_update().get(pk=stock.pk)
+        total = _total(row)
+        StockShard.objects.filter(stock=row).delete()
+        Stock.objects.filter(pk=row.pk).update(quantity=total, shard_count=0, is_low=total <= row.reorder_point)
+    cache.delete(CACHE_KEY.format(stock.pk))
+    stock.refresh_from_db(fields=['quantity', 'shard_count', 'is_low'])
+
+
+def _total(row):
+    if not row.shard_count:
+        return row.quantity
+    return StockShard.objects.filter(stock=row).aggregate(total=Sum('quantity'))['total'] or 0
+
+
+def add(stock_id, shard_count, quantity):
+    """Add `quantity` units to a random shard of a sharded stock."""
+    StockShard.objects.filter(stock_id=stock_id, number=random.randrange(shard_count)).update(
+        quantity=F('quantity') + quantity,
+    )
+    _flag_low(stock_id)
+
+
+def _flag_low(stock_id):
+    """Set is_low of a sharded stock from the sum of its shards, writing the Stock row only if it flips."""
+    low = Case(When(reorder_point__gte=shards_total(), then=Value(True)), default=Value(False), output_field=BooleanField())
+    if Stock.objects.filter(pk=stock_id).exclude(is_low=low).update(is_low=low):
+        bump_dashboard_version()
+
+
+def take(stock_id, shard_count, change, partial=False, reserved=0):
+    """
+    Take `change` units from the shards of a sharded stock, or with
+    `partial` as many as there are, leaving `reserved` units (held for
+    other baskets) alone. Returns (units taken, units there were free),
+    the latter None when a single shard covered it; nothing is taken when
+    there are too few and not `partial`. Returns None if the stock has no
+    shards.
+    """
+    # the common case: one conditional UPDATE of a random shard; reserved units need the sum of all shards
+    number = random.randrange(shard_count)
+    if not reserved and StockShard.objects.filter(stock_id=stock_id, number=number, quantity__gte=change).update(quantity=F('quantity') - change):
+        _flag_low(stock_id)
+        return change, None
+
+    # no luck: lock every shard of the stock, in order, and take from the fullest first
+    shards = list(StockShard.objects.select_for_update().filter(stock_id=stock_id).order_by('number'))
+    if not shards:
+        return None
+    available = sum(s.quantity for s in shards) - reserved
+    wanted = min(change, available) if partial else change
+    if wanted > available or wanted <= 0:
+        return 0, max(available, 0)
+    left = wanted
+    changed = []
+    for s in sorted(shards, key=lambda s: -s.quantity):
+        part = min(left, s.quantity)
+        if part:
+            s.quantity -= part
+            changed.append(s)
+            left -= part
+        if not left:
+            break
+    StockShard.objects.bulk_update(changed, ['quantity'])
+    _flag_low(stock_id)
+    return wanted, available
+
+
+def compact(stocks=None):
+    """
+    Copy the sum of the shards of every sharded stock (or those in
+    `stocks`, ids) into Stock.quantity and is_low, and spread it evenly
+    over the shards again, one stock per transaction. Returns the number
+    of stocks compacted.
+    """
+    ids = Stock.objects.filter(shard_count__gt=0)
+    if stocks is not None:
+        ids = ids.filter(pk__in=list(stocks))
+    done = 0
+    for pk in ids.order_by('pk').values_list('pk', flat=True):
+        with transaction.atomic():
+            row = Stock.objects.select_for_update().filter(pk=pk, shard_count__gt=0).first()
+            if row is None:                             # unsharded meanwhile
+                continue
+            shards = list(StockShard.objects.select_for_update().filter(stock=row).order_by('number'))
+            total = sum(s.quantity for s in shards)
+            for s, part in zip(shards, _spread(total, len(shards))):
+                s.quantity = part
+            StockShard.objects.bulk_update(shards, ['quantity'])
+            Stock.objects.filter(pk=pk).update(quantity=total, is_low=total <= row.reorder_point)
+        cache.set(CACHE_KEY.format(pk), total, getattr(settings, 'STOCK_SHARD_CACHE_SECONDS', 2))
+        done += 1
+    if done:
+        bump_dashboard_version()
+    return done
+
+
+def on_hand(stocks, cached=True):
+    """
+    {stock id: quantity on hand} of the Stock instances `stocks`, summing
+    the shards of sharded ones (cached for STOCK_SHARD_CACHE_SECONDS, or
+    read now with `cached=False`).
+    """
+    stocks = list(stocks)
+    quantities = {stock.pk: stock.quantity for stock in stocks if not stock.shard_count}
+    sharded = [stock.pk for stock in stocks if stock.shard_count]
+    if sharded:
+        keys = {CACHE_KEY.format(pk): pk for pk in sharded}
+        found = cache.get_many(list(keys)) if cached else {}
+        quantities.update({keys[key]: value for key, value in found.items()})
+        missing = [pk for pk in sharded if CACHE_KEY.format(pk) not in found]
+        if missing:
+            sums = dict(
+                StockShard.objects.filter(stock_id__in=missing).order_by().values('stock')
+                .annotate(total=Sum('quantity')).values_list('stock', 'total')
+            )
+            fresh = {pk: sums.get(pk, 0) for pk in missing}
+            cache.set_many({CACHE_KEY.format(pk): total for pk, total in fresh.items()},
+                           getattr(settings, 'STOCK_SHARD_CACHE_SECONDS', 2))
+            quantities.update(fresh)
+    return quantities
+
+
+def hottest(count, days=7):
+    """Ids of the `count` live stocks with the most movements in the last `days` days."""
+    since = timezone.now() - datetime.timedelta(days=days)
+    return list(
+        StockHistory.objects.filter(timestamp__gte=since, stock__is_deleted=False).order_by()
+        .values('stock').annotate(moves=Count('id')).order_by('-moves', 'stock')
+        .values_list('stock', flat=True)[:count]
+    )
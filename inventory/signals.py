@@ -0,0 +1,34 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Item, Stock, StockHistory
+from .autocomplete import bump_autocomplete_version
+from .search import index_objects, unindex_objects
+from .stats import bump_dashboard_version
+
+
+# bulk writes (queryset.update(), bulk_create) send no signals, inventory/services.py bumps the version itself
+@receiver([post_save, post_delete], sender=Stock)
+@receiver([post_save, post_delete], sender=StockHistory)
+def invalidate_dashboard(sender, **kwargs):
+    bump_dashboard_version()
+
+
+# keeps the search index in step with single-object writes
+@receiver(post_save, sender=Stock)
+@receiver(post_save, sender=Item)
+def index_for_search(sender, instance, raw=False, **kwargs):
+    if not raw:
+        index_objects(sender, [instance])
+
+
+@receiver(post_delete, sender=Stock)
+@receiver(post_delete, sender=Item)
+def unindex_for_search(sender, instance, **kwargs):
+    unindex_objects(sender, [instance.pk])
+
+
+# stock names are cached in every process for the autocomplete, see inventory/autocomplete.py
+@receiver([post_save, post_delete], sender=Stock)
+def invalidate_autocomplete(sender, **kwargs):
+    bump_autocomplete_version()
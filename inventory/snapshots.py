@@ -0,0 +1,123 @@
+"""
+Point-in-time stock quantities.
+
+`python manage.py snapshot_stock` (run daily from cron, say) writes a
+StockSnapshot of every stock with a single timestamp. To find the
+quantity at some moment, as_of() starts from the latest snapshot taken at
+or before it and adds the StockHistory rows between the two, so the work
+depends on the activity since that snapshot, not on the age of the
+ledger. Stocks with no earlier snapshot are worked out backwards from the
+earliest later snapshot, or from their current quantity.
+
+A quantity "as of" a date is the quantity at the end of that day. Past
+quantities are only as good as the ledger: quantities edited on the stock
+form are not logged, so they show up from the next snapshot on.
+"""
+import datetime
+
+from django.conf import settings
+from django.db.models import Max, Min, Sum
+from django.utils import timezone
+
+from . import shards
+from .models import Stock, StockHistory, StockSnapshot, signed_change
+
+
+def moment(when):
+    """The datetime `when` stands for; a date means the end of that day."""
+    if isinstance(when, datetime.datetime):
+        return when
+    start = datetime.datetime.combine(when + datetime.timedelta(days=1), datetime.time.min)
+    return timezone.make_aware(start) if settings.USE_TZ else start
+
+
+def as_of(when, stocks=None):
+    """
+    Quantities at `when` (a date or datetime) as {stock id: quantity}, for
+    every stock or only for the ids in `stocks`.
+    """
+    at = moment(when)
+    ids = set(stocks) if stocks is not None else None       # None means every stock, without an IN list
+    quantities = {}
+
+    # forward from the latest snapshot at or before `at`
+    taken_at = _only(StockSnapshot.objects, ids).filter(taken_at__lte=at).aggregate(taken_at=Max('taken_at'))['taken_at']
+    if taken_at is not None:
+        quantities = dict(_only(StockSnapshot.objects, ids).filter(taken_at=taken_at).values_list('stock_id', 'quantity'))
+        for pk, net in _net(ids, taken_at, at).items():
+            if pk in quantities:
+                quantities[pk] += net
+
+    # the rest (stocks added since that snapshot) backwards from the earliest snapshot after `at`
+    rest = _rest(ids, quantities)
+    if rest != set():
+        taken_at = _only(StockSnapshot.objects, rest).filter(taken_at__gt=at).aggregate(taken_at=Min('taken_at'))['taken_at']
+        if taken_at is not None:
+            later = dict(_only(StockSnapshot.objects, rest).filter(taken_at=taken_at).values_list('stock_id', 'quantity'))
+            for pk, net in _net(rest, at, taken_at).items():
+                if pk in later:
+                    later[pk] -= net
+            quantities.update(later)
+
+    # and the ones without any snapshot backwards from their current quantity
+    rest = _rest(ids, quantities)
+    if rest != set():
+        current = dict(_only(Stock.objects, rest, 'pk').values_list('pk', 'quantity'))
+        for pk, net in _net(rest, at).items():
+            if pk in current:
+                current[pk] -= net
+        quantities.update(current)
+    return quantities
+
+
+def stock_as_of(stock, when):
+    """Quantity of `stock` at `when` (a date or datetime)."""
+    return as_of(when, stocks=[stock.pk]).get(stock.pk)
+
+
+def take_snapshot(taken_at=None, chunk_size=2000):
+    """
+    Write a StockSnapshot of every stock. With `taken_at` in the past the
+    quantities are worked out with as_of(), e.g. to backfill month ends.
+    Returns the number of snapshots written.
+    """
+    if taken_at is None:
+        shards.compact()                                # sharded stocks' quantities up to date first
+        taken_at = timezone.now()
+        quantities = Stock.objects.values_list('pk', 'quantity').iterator(chunk_size=chunk_size)
+    else:
+        taken_at = moment(taken_at)
+        quantities = as_of(taken_at).items()
+
+    count = 0
+    batch = []
+    for pk, quantity in quantities:
+        batch.append(StockSnapshot(stock_id=pk, taken_at=taken_at, quantity=quantity))
+        if len(batch) >= chunk_size:
+            count += len(StockSnapshot.objects.bulk_create(batch, ignore_conflicts=True))
+            batch = []
+    count += len(StockSnapshot.objects.bulk_create(batch, ignore_conflicts=True))
+    return count
+
+
+def _only(manager, ids, field='stock_id'):
+    queryset = manager.order_by()
+    return queryset if ids is None else queryset.filter(**{f'{field}__in': ids})
+
+
+def _rest(ids, found):
+    """Ids in `ids` not in `found`. None (every stock) stays None while nothing is found,
+    otherwise the missing ids are looked up."""
+    if ids is not None:
+        return ids - set(found)
+    if not found:
+        return None
+    return set(Stock.objects.values_list('pk', flat=True)) - set(found)
+
+
+def _net(ids, start, end=None):
+    """Net change (ins minus outs) per stock id in `ids` (None for all) over [start, end)."""
+    rows = _only(StockHistory.objects, ids).filter(timestamp__gte=start)
+    if end is not None:
+        rows = rows.filter(timestamp__lt=end)
+    return dict(rows.order_by().values('stock_id').annotate(net=Sum(signed_change())).values_list('stock_id', 'net'))
@@ -0,0 +1,63 @@
+// typeahead for StockAutocompleteWidget: fills the hidden stock input with the picked id
+(function () {
+    var timer = null;
+
+    function row(input) {
+        return input.closest('.stock-autocomplete');
+    }
+
+    function clear(box) {
+        box.querySelector('.stock-suggestions').innerHTML = '';
+    }
+
+    function pick(box, stock) {
+        var hidden = box.querySelector('input[type=hidden]');
+        hidden.value = stock.id;
+        hidden.setAttribute('data-quantity', stock.quantity);
+        box.querySelector('.stock-search').value = stock.name;
+        clear(box);
+        hidden.dispatchEvent(new Event('change', {bubbles: true}));
+    }
+
+    function suggest(input) {
+        var box = row(input);
+        var query = input.value.trim();
+        if (!query) {
+            clear(box);
+            return;
+        }
+        // on the sale form, what the basket itself reserved counts as available
+        var basket = document.getElementById('basket');
+        var url = input.getAttribute('data-url') + '?q=' + encodeURIComponent(query);
+        if (basket) url += '&basket=' + encodeURIComponent(basket.value);
+        fetch(url, {credentials: 'same-origin'})
+            .then(function (response) { return response.json(); })
+            .then(function (data) {
+                var list = box.querySelector('.stock-suggestions');
+                list.innerHTML = '';
+                data.results.forEach(function (stock) {
+                    var option = document.createElement('a');
+                    option.href = '#';
+                    option.className = 'list-group-item list-group-item-action';
+                    option.textContent = stock.name + ' (' + stock.quantity + ' available)';
+                    option.addEventListener('mousedown', function (e) {
+                        e.preventDefault();
+                        pick(box, stock);
+                    });
+                    list.appendChild(option);
+                });
+            });
+    }
+
+    document.addEventListener('input', function (e) {
+        if (!e.target.classList.contains('stock-search')) return;
+        // the typed text no longer names the picked stock
+        row(e.target).querySelector('input[type=hidden]').value = '';
+        clearTimeout(timer);
+        timer = setTimeout(function () { suggest(e.target); }, 150);
+    });
+
+    document.addEventListener('focusout', function (e) {
+        if (e.target.classList.contains('stock-search')) clear(row(e.target));
+    });
+})();
@@ -0,0 +1,78 @@
+"""
+Cached inventory dashboard figures.
+
+The figures are computed with database aggregates and cached under a
+version number. Any write to Stock or StockHistory bumps the version (see
+inventory/signals.py and inventory/services.py), so the next request
+recomputes them; until then every request costs a single cache read.
+Only the aggregates and the low stock preview are cached, so the entry
+stays small however many stocks there are; the dashboard pages through
+the stock table itself.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import Coalesce
+
+from .models import Stock
+
+
+VERSION_KEY = 'inventory:dashboard:version'
+STATS_KEY = 'inventory:dashboard:stats'
+LOW_STOCK_PREVIEW = 20
+
+
+def bump_dashboard_version():
+    """Invalidate the cached dashboard figures, now and again once the current transaction commits."""
+    _bump()
+    # a request rebuilding the cache before we commit would store the old figures under the new version
+    transaction.on_commit(_bump)
+
+
+def _bump():
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        # no version yet (or evicted): start from a value no earlier entry can have used
+        cache.set(VERSION_KEY, int(time.time() * 1000), None)
+
+
+def get_dashboard_stats():
+    """
+    Returns a dict with total_items, total_quantity, low_stock_count and
+    low_stock_items (the first LOW_STOCK_PREVIEW, as dicts with id, name,
+    quantity, reorder_point and is_low). A stock is low at or below its
+    reorder point.
+    """
+    key = STATS_KEY
+    cached = cache.get_many([VERSION_KEY, key])
+    version = cached.get(VERSION_KEY)
+    if version is None:
+        _bump()
+        version = cache.get(VERSION_KEY)
+    elif key in cached and cached[key]['version'] == version:
+        return cached[key]['stats']
+
+    stats = compute_dashboard_stats()
+    cache.set(key, {'version': version, 'stats': stats}, getattr(settings, 'DASHBOARD_CACHE_TIMEOUT', 300))
+    return stats
+
+
+def compute_dashboard_stats():
+    stocks = Stock.objects.filter(is_deleted=False).with_on_hand()      # sharded stocks are summed from their shards
+    fields = ('id', 'name', 'on_hand', 'reorder_point', 'is_low')
+    totals = stocks.aggregate(
+        total_items=Count('id'),
+        total_quantity=Coalesce(Sum('on_hand'), 0),
+        low_stock_count=Count('id', filter=Q(is_low=True)),
+    )
+    # the dashboard card shows the first few, the full list is paginated by LowStockListView
+    totals['low_stock_items'] = _rows(stocks.low_stock().order_by('name').values(*fields)[:LOW_STOCK_PREVIEW])
+    return totals
+
+
+def _rows(values):
+    return [dict(row, quantity=row.pop('on_hand')) for row in values]
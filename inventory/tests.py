@@ -1,8 +1,38 @@
-from django.test import TestCase, Client
+import gzip
+import json
+import os
+import tempfile
+import threading
+import time
+import warnings
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase, TransactionTestCase, Client, override_settings
 from django.urls import reverse
 from django.contrib.auth.models import User
-from inventory.models import Stock, StockHistory
-from datetime import datetime
+from django.db import connection, OperationalError
+from django.db.models import Sum
+from django.core.cache import cache
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.paginator import UnorderedObjectListWarning
+from django.test.utils import CaptureQueriesContext
+from core.querycount import QueryBudgetTestMixin
+from core.db.profiles import ScratchDatabaseMixin
+from core.db.sqlite3.base import is_locked
+from inventory import reservations, shards
+from inventory.models import Item, LedgerBalance, Reconciliation, Reservation, Stock, StockHistory, StockShard, StockSnapshot
+from inventory import views as inventory_views
+from inventory.stats import STATS_KEY, get_dashboard_stats
+from inventory.search import search_ids, search_queryset, use_fts
+from inventory.autocomplete import suggest
+from inventory.imports import OPENING_BALANCE_NOTE, import_catalog
+from inventory.snapshots import as_of, stock_as_of, take_snapshot
+from inventory.reconciliation import _drifted, drift_rows, reconcile
+from inventory.services import record_movement, receive_stock, issue_stock, InsufficientStock, CLAMP, REJECT
+from datetime import date, datetime
 from django.utils import timezone
 
 
@@ -164,6 +194,20 @@ class StockChangeViewTest(TestCase):
         self.assertTemplateUsed(response, 'inventory/stock_change.html')
         self.assertIn('item', response.context)
     
+    def test_stock_change_locked_out_asks_to_try_again(self):
+        """Test that a change the database stayed locked for re-renders the form with an error"""
+        self.client.login(username='testuser', password='testpass123')
+        with mock.patch('inventory.views.submit_movement', side_effect=OperationalError('database is locked')), \
+                self.assertLogs('inventory.views', 'WARNING'):
+            response = self.client.post(
+                reverse('inventory:stock_change', args=[self.stock.pk]),
+                {'change': 5, 'type': StockHistory.OUT}
+            )
+        self.assertContains(response, 'Please try again', status_code=503)
+        self.stock.refresh_from_db()
+        self.assertEqual(self.stock.quantity, 10)
+        self.assertFalse(StockHistory.objects.filter(stock=self.stock).exists())
+
     def test_stock_change_view_stock_in(self):
         """Test stock in operation"""
         self.client.login(username='testuser', password='testpass123')
@@ -381,3 +425,947 @@ class StockHistoryIntegrationTest(TestCase):
         # Should only show 20 latest
         self.assertEqual(len(response.context['history']), 20)
 
+
+
+class StockMovementServiceTest(TestCase):
+    """Test the stock mutation service"""
+
+    def setUp(self):
+        self.stock = Stock.objects.create(name="Test Stock", quantity=10)
+
+    def test_stock_in_increments_quantity_and_logs(self):
+        """Test that a stock in updates quantity and writes one history row"""
+        history = record_movement(self.stock, 5, StockHistory.IN, note='Restocking')
+        self.assertEqual(self.stock.quantity, 15)
+        self.assertEqual(history.change, 5)
+        self.assertEqual(StockHistory.objects.filter(stock=self.stock).count(), 1)
+
+    def test_stock_out_clamp_logs_applied_quantity(self):
+        """Test that a clamped stock out only logs what was on hand"""
+        history = record_movement(self.stock, 25, StockHistory.OUT, policy=CLAMP)
+        self.assertEqual(self.stock.quantity, 0)
+        self.assertEqual(history.change, 10)
+
+    def test_stock_out_reject_leaves_stock_untouched(self):
+        """Test that a rejected stock out changes nothing"""
+        with self.assertRaises(InsufficientStock):
+            record_movement(self.stock, 25, StockHistory.OUT, policy=REJECT)
+        self.stock.refresh_from_db()
+        self.assertEqual(self.stock.quantity, 10)
+        self.assertFalse(StockHistory.objects.filter(stock=self.stock).exists())
+
+
+class StockMovementConcurrencyTest(ScratchDatabaseMixin, TransactionTestCase):
+    """Fire parallel writers at a single hot stock, on the production SQLite profile"""
+
+    database_profile = 'production'                         # takes the write lock up front, the writers retry what is left
+    writers = 8
+    moves_per_writer = 10
+
+    def test_parallel_stock_outs_do_not_lose_updates(self):
+        """Test that concurrent stock outs keep quantity and ledger in step"""
+        stock = Stock.objects.create(name="Hot Stock", quantity=50)
+        errors = []
+
+        def writer():
+            try:
+                for _ in range(self.moves_per_writer):
+                    while True:
+                        try:
+                            record_movement(Stock.objects.get(pk=stock.pk), 1, StockHistory.OUT, policy=REJECT)
+                            break
+                        except InsufficientStock:
+                            break
+                        except OperationalError:                                    # sqlite lock contention, try again
+                            time.sleep(0.001)
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=writer) for _ in range(self.writers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        stock.refresh_from_db()
+        taken = StockHistory.objects.filter(stock=stock).aggregate(total=Sum('change'))['total']
+        # 80 stock outs were attempted against 50 units: exactly 50 succeed and none go negative
+        self.assertEqual(stock.quantity, 0)
+        self.assertEqual(taken, 50)
+
+    def test_parallel_baskets_never_oversell(self):
+        """Test that concurrent multi-stock baskets neither deadlock nor go negative"""
+        stocks = [Stock.objects.create(name=f"Basket Stock {i}", quantity=20) for i in range(3)]
+        errors = []
+
+        def till(order):
+            try:
+                for _ in range(self.moves_per_writer):
+                    # every till lists the same stocks in a different order
+                    lines = [(stocks[i], 1) for i in order]
+                    while True:
+                        try:
+                            issue_stock(lines, note='Basket')
+                            break
+                        except InsufficientStock:
+                            break
+                        except OperationalError:                                    # sqlite lock contention, try again
+                            time.sleep(0.001)
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connection.close()
+
+        orders = [(0, 1, 2), (2, 1, 0), (1, 2, 0), (0, 2, 1)] * 2
+        threads = [threading.Thread(target=till, args=(order,)) for order in orders]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        for stock in stocks:
+            stock.refresh_from_db()
+            taken = StockHistory.objects.filter(stock=stock).aggregate(total=Sum('change'))['total']
+            # 80 baskets were attempted against 20 units of each stock: exactly 20 succeed
+            self.assertEqual(stock.quantity, 0)
+            self.assertEqual(taken, 20)
+
+    def test_parallel_sales_of_a_sharded_stock_never_oversell(self):
+        """Test that concurrent sales taking from the shards of one stock stop at zero"""
+        stock = Stock.objects.create(name="Sharded Stock", quantity=30)
+        shards.shard(stock, 4)
+        errors = []
+
+        def till():
+            try:
+                for _ in range(self.moves_per_writer):
+                    while True:
+                        try:
+                            issue_stock([(Stock.objects.get(pk=stock.pk), 1)], note='Sale')
+                            break
+                        except InsufficientStock:
+                            break
+                        except OperationalError:                                    # sqlite lock contention, try again
+                            time.sleep(0.001)
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=till) for _ in range(self.writers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertFalse(StockShard.objects.filter(stock=stock, quantity__lt=0).exists())
+        shards.compact()
+        stock.refresh_from_db()
+        # 80 sales were attempted against 30 units: exactly 30 succeed
+        self.assertEqual(stock.quantity, 0)
+        self.assertEqual(StockHistory.objects.filter(stock=stock).aggregate(total=Sum('change'))['total'], 30)
+
+
+class DefaultProfileConcurrencyTest(ScratchDatabaseMixin, TransactionTestCase):
+    """Fire parallel stock outs at a single hot stock on the default SQLite profile, which ships"""
+
+    writers = 8
+    moves_per_writer = 10
+
+    def test_parallel_stock_outs_lose_no_update_and_swallow_no_error(self):
+        """Test that every stock out is taken and logged, refused, or fails on a lock that reaches the caller"""
+        stock = Stock.objects.create(name="Hot Stock", quantity=50)
+        taken, refused, locked, errors = [], [], [], []
+
+        def writer():
+            try:
+                for _ in range(self.moves_per_writer):
+                    try:
+                        record_movement(Stock.objects.get(pk=stock.pk), 1, StockHistory.OUT, policy=REJECT)
+                        taken.append(1)
+                    except InsufficientStock:
+                        refused.append(1)
+                    except OperationalError as exc:                                 # not retried: counted, not hidden
+                        (locked if is_locked(exc) else errors).append(exc)
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=writer) for _ in range(self.writers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(len(taken) + len(refused) + len(locked), self.writers * self.moves_per_writer)
+        stock.refresh_from_db()
+        # what was taken is exactly what the stock lost and the ledger logged, a failed stock out changed nothing
+        self.assertEqual(stock.quantity, 50 - len(taken))
+        self.assertEqual(StockHistory.objects.filter(stock=stock).aggregate(total=Sum('change'))['total'], len(taken))
+        self.assertGreaterEqual(stock.quantity, 0)
+        if refused:                                         # refused only once the stock ran out
+            self.assertEqual(stock.quantity, 0)
+
+
+class DashboardCacheTest(TestCase):
+    """Test the cached dashboard figures"""
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.client.login(username='testuser', password='testpass123')
+        self.stock1 = Stock.objects.create(name="Stock A", quantity=10)
+        self.stock2 = Stock.objects.create(name="Stock B", quantity=3)
+
+    def stock_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('dashboard'))
+        return response, [q['sql'] for q in queries if 'inventory_stock' in q['sql']]
+
+    def test_dashboard_figures(self):
+        """Test that the aggregates match the stocks"""
+        response, _ = self.stock_queries()
+        self.assertEqual(response.context['total_items'], 2)
+        self.assertEqual(response.context['total_quantity'], 13)
+        self.assertEqual(response.context['low_stock_count'], 1)
+        self.assertEqual(response.context['low_ids'], {self.stock2.id})
+
+    def test_second_request_served_from_cache(self):
+        """Test that a repeat request reads only its page of the stock table, no aggregates"""
+        self.stock_queries()
+        _, queries = self.stock_queries()
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('COUNT(', queries[0])
+        self.assertTrue(queries[0].endswith(f'LIMIT {inventory_views.DASHBOARD_PAGE_SIZE + 1}'))
+
+    def test_file_cache_shared_by_workers(self):
+        """Test that with the file cache a write in one worker invalidates the figures another cached"""
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        workers = [FileBasedCache(directory.name, {}) for _ in range(2)]
+        with mock.patch('inventory.stats.cache', workers[0]):
+            self.assertEqual(get_dashboard_stats()['total_quantity'], 13)
+        with mock.patch('inventory.stats.cache', workers[1]):
+            issue_stock([(self.stock1, 8)], note='Sold')
+        with mock.patch('inventory.stats.cache', workers[0]):
+            self.assertEqual(get_dashboard_stats()['total_quantity'], 5)
+
+    def test_stock_table_paginated_and_not_cached(self):
+        """Test that the cache holds the figures only and the stock table comes a page at a time"""
+        with mock.patch.object(inventory_views, 'DASHBOARD_PAGE_SIZE', 1):
+            response, _ = self.stock_queries()
+            self.assertEqual([stock.name for stock in response.context['stocks']], ["Stock A"])
+            response = self.client.get(reverse('dashboard'), {'cursor': response.context['page_obj'].next_cursor})
+        self.assertEqual([(stock.name, stock.on_hand, stock.is_low) for stock in response.context['stocks']], [("Stock B", 3, True)])
+        self.assertNotIn('stocks', cache.get(STATS_KEY)['stats'])
+
+    def test_stock_movement_invalidates_cache(self):
+        """Test that recording a movement refreshes the figures"""
+        self.stock_queries()
+        issue_stock([(self.stock1, 8)], note='Sold')
+        response, queries = self.stock_queries()
+        self.assertNotEqual(queries, [])
+        self.assertEqual(response.context['total_quantity'], 5)
+        self.assertEqual(response.context['low_stock_count'], 2)
+
+
+class LowStockTest(TestCase):
+    """Test per-stock reorder points and the low stock lists"""
+
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.client.login(username='testuser', password='testpass123')
+        self.bolts = Stock.objects.create(name="Bolts", quantity=40, reorder_point=50)
+        self.nuts = Stock.objects.create(name="Nuts", quantity=40, reorder_point=10)
+
+    def test_flag_set_on_save(self):
+        """Test that saving compares quantity with the stock's own reorder point"""
+        self.assertTrue(self.bolts.is_low)
+        self.assertFalse(self.nuts.is_low)
+        self.nuts.reorder_point = 40
+        self.nuts.save(update_fields=['reorder_point'])
+        self.assertTrue(Stock.objects.get(pk=self.nuts.pk).is_low)
+
+    def test_flag_follows_movements(self):
+        """Test that service updates keep the flag in step with quantity"""
+        issue_stock([(self.nuts, 30)])
+        receive_stock([(self.bolts, 20)])
+        self.assertEqual(list(Stock.objects.low_stock()), [self.nuts])
+        record_movement(self.nuts, 5, StockHistory.IN)
+        record_movement(self.bolts, 15, StockHistory.OUT)
+        self.assertEqual(list(Stock.objects.low_stock()), [self.bolts])
+
+    def test_refresh_low_flags(self):
+        """Test that the bulk refresh fixes rows written without save()"""
+        Stock.objects.filter(pk=self.nuts.pk).update(quantity=1)
+        call_command('refresh_low_stock', stdout=StringIO())
+        self.assertEqual(set(Stock.objects.low_stock()), {self.bolts, self.nuts})
+
+    def test_low_stock_view_lists_only_low_rows(self):
+        """Test that the low stock page shows stocks at or below their reorder point"""
+        response = self.client.get(reverse('inventory:low-stock'))
+        self.assertEqual(list(response.context['object_list']), [self.bolts])
+        self.assertContains(response, "Bolts")
+        self.assertNotContains(response, "Nuts")
+
+    def test_item_low_stock(self):
+        """Test the Item equivalent of the low stock query and page"""
+        low = Item.objects.create(name="Cable", sku="CAB-1", quantity=3, price=Decimal('1.00'), reorder_point=5)
+        Item.objects.create(name="Laptop", sku="LAP-1", quantity=3, price=Decimal('1.00'), reorder_point=2)
+        self.assertTrue(low.is_low_stock())
+        self.assertEqual(list(Item.objects.low_stock()), [low])
+        response = self.client.get(reverse('inventory:low-items'))
+        self.assertEqual(list(response.context['object_list']), [low])
+
+
+class StockSearchTest(TestCase):
+    """Test the stock and item search index"""
+
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.client.login(username='testuser', password='testpass123')
+        self.bolt = Stock.objects.create(name="Hex Bolt M8", quantity=10)
+        self.nut = Stock.objects.create(name="Hex Nut M8", quantity=10)
+        self.washer = Stock.objects.create(name="Washer", quantity=10)
+
+    def search(self, query):
+        return [stock.name for stock in search_queryset(Stock.objects.all(), query)]
+
+    def check_backend(self):
+        self.assertEqual(set(self.search("hex")), {"Hex Bolt M8", "Hex Nut M8"})
+        self.assertEqual(self.search("bol m8"), ["Hex Bolt M8"])
+        self.assertEqual(self.search("wash"), ["Washer"])
+        self.assertEqual(self.search("gasket"), [])
+        # terms match the start of words only, and ignore case and diacritics
+        self.assertEqual(self.search("olt"), [])
+        self.assertEqual(self.search("ex m8"), [])
+        creme = Stock.objects.create(name="Crème Fraîche", quantity=1)
+        self.assertEqual(self.search("CREME fr"), ["Crème Fraîche"])
+        creme.delete()
+
+        # renames and deletes reach the index through the signals
+        self.washer.name = "Spring Washer"
+        self.washer.save()
+        self.assertEqual(self.search("spring"), ["Spring Washer"])
+        self.nut.delete()
+        self.assertEqual(self.search("nut"), [])
+
+        item = Item.objects.create(name="Drill", sku="DRL-100", quantity=1, price=Decimal('9.99'), brand="Bosch")
+        self.assertEqual(search_ids(Item, "bosch"), [item.pk])
+        self.assertEqual(search_ids(Item, "drl"), [item.pk])
+
+    def test_fts5_backend(self):
+        """Test word prefix search through SQLite FTS5"""
+        self.assertTrue(use_fts())
+        self.check_backend()
+
+    @override_settings(INVENTORY_SEARCH_BACKEND='trigram')
+    def test_trigram_backend(self):
+        """Test the trigram fallback gives the same results"""
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.check_backend()
+
+    def test_rebuild_command(self):
+        """Test that a rebuild restores rows written without signals"""
+        Stock.objects.filter(pk=self.washer.pk).update(name="Flat Washer")
+        self.assertEqual(self.search("flat"), [])
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertEqual(self.search("flat"), ["Flat Washer"])
+
+    def test_stock_list_search(self):
+        """Test the stock list page searches through the index"""
+        response = self.client.get(reverse('inventory:inventory'), {'q': 'hex bolt'})
+        self.assertEqual([stock.name for stock in response.context['object_list']], ["Hex Bolt M8"])
+        self.assertFalse(response.context['search_truncated'])
+        self.assertContains(response, 'name="q" value="hex bolt"')
+
+    @override_settings(SEARCH_RESULT_LIMIT=1)
+    def test_truncated_results_are_flagged(self):
+        """Test that the page says when more stocks matched than it lists"""
+        response = self.client.get(reverse('inventory:inventory'), {'q': 'hex'})
+        self.assertEqual(len(response.context['object_list']), 1)
+        self.assertTrue(response.context['search_truncated'])
+        self.assertContains(response, 'Showing the best 1 matches only')
+
+
+class StockAutocompleteTest(TestCase):
+    """Test the stock typeahead endpoint"""
+
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.client.login(username='testuser', password='testpass123')
+        self.bolt = Stock.objects.create(name="Hex Bolt M8", quantity=12)
+        self.nut = Stock.objects.create(name="Hex Nut M8", quantity=3)
+        self.washer = Stock.objects.create(name="Washer", quantity=7)
+        Stock.objects.create(name="Hex Key", quantity=1, is_deleted=True)
+
+    def suggest(self, query):
+        response = self.client.get(reverse('inventory:stock-autocomplete'), {'q': query})
+        self.assertEqual(response.status_code, 200)
+        return [(stock['name'], stock['quantity']) for stock in response.json()['results']]
+
+    def test_prefix_match(self):
+        """Test suggestions match word prefixes and skip deleted stocks"""
+        self.assertEqual(self.suggest("hex"), [("Hex Bolt M8", 12), ("Hex Nut M8", 3)])
+        self.assertEqual(self.suggest("nu m"), [("Hex Nut M8", 3)])
+        self.assertEqual(self.suggest("m8"), [("Hex Bolt M8", 12), ("Hex Nut M8", 3)])
+        self.assertEqual(self.suggest(""), [])
+
+    def test_index_refreshed_on_stock_change(self):
+        """Test that renames and new stocks show up, and quantities are current"""
+        self.assertEqual(self.suggest("wash"), [("Washer", 7)])
+        self.washer.name = "Spring Washer"
+        self.washer.save()
+        Stock.objects.create(name="Washer Flat", quantity=2)
+        record_movement(self.washer, 4, StockHistory.OUT)
+        self.assertEqual(self.suggest("wash"), [("Washer Flat", 2), ("Spring Washer", 3)])
+
+    def test_one_query_per_lookup(self):
+        """Test that a warm index only reads the quantities of the matches"""
+        self.suggest("hex")
+        with CaptureQueriesContext(connection) as queries:
+            suggest("hex")
+        self.assertEqual(len(queries), 1)
+
+
+class StockHistoryExportTest(TestCase):
+    """Test the streaming stock history export"""
+
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.client.login(username='testuser', password='testpass123')
+        self.bolt = Stock.objects.create(name="Bolt", quantity=0)
+        self.nut = Stock.objects.create(name="Nut", quantity=0)
+        record_movement(self.bolt, 5, StockHistory.IN, note="first", timestamp=timezone.make_aware(datetime(2024, 1, 10, 9)))
+        record_movement(self.nut, 7, StockHistory.IN, timestamp=timezone.make_aware(datetime(2024, 2, 1, 9)))
+        record_movement(self.bolt, 2, StockHistory.OUT, timestamp=timezone.make_aware(datetime(2024, 2, 29, 23)))
+
+    def export(self, **params):
+        response = self.client.get(reverse('inventory:export-history'), params)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content)
+
+    def test_csv_export(self):
+        """Test the CSV export is oldest first with a header row"""
+        lines = self.export().decode().splitlines()
+        self.assertEqual(lines[0], 'id,timestamp,stock_id,stock,type,change,note,source_type,source_id')
+        self.assertEqual([line.split(',')[3:6] for line in lines[1:]], [
+            ['Bolt', 'IN', '5'], ['Nut', 'IN', '7'], ['Bolt', 'OUT', '2'],
+        ])
+
+    def test_filters_and_jsonl(self):
+        """Test inclusive date ranges and the stock filter"""
+        rows = [json.loads(line) for line in self.export(format='jsonl', since='2024-02-01', until='2024-02-29').splitlines()]
+        self.assertEqual([(row['stock'], row['change']) for row in rows], [('Nut', 7), ('Bolt', 2)])
+        rows = [json.loads(line) for line in self.export(format='jsonl', stock=self.bolt.pk).splitlines()]
+        self.assertEqual([row['note'] for row in rows], ['first', ''])
+
+    def test_gzip(self):
+        """Test the gzipped download decompresses to the plain export"""
+        response = self.client.get(reverse('inventory:export-history'), {'gzip': '1'})
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        self.assertIn('stock_history.csv.gz', response['Content-Disposition'])
+        self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), self.export())
+
+    def test_bad_parameters(self):
+        """Test unparsable options are refused"""
+        self.assertEqual(self.client.get(reverse('inventory:export-history'), {'since': '2024-13-01'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('inventory:export-history'), {'format': 'xml'}).status_code, 400)
+
+    def test_export_command(self):
+        """Test the management command writes the same export to a file"""
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'history.csv')
+            call_command('export_history', '--since', '2024-02-01', '-o', path, stdout=StringIO())
+            with open(path) as f:
+                self.assertEqual(len(f.read().splitlines()), 3)
+
+
+class CatalogImportTest(TestCase):
+    """Test the bulk CSV catalog import"""
+
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.client.login(username='testuser', password='testpass123')
+        self.existing = Stock.objects.create(name="Bolt", quantity=40, reorder_point=5)
+
+    def run_import(self, text, catalog='stock', chunk_size=1000):
+        return import_catalog(StringIO(text), catalog, chunk_size=chunk_size)
+
+    def test_stock_upsert(self):
+        """Test new stocks get opening balances and existing ones keep their quantity"""
+        report = self.run_import(
+            "name,quantity,reorder_point\n"
+            "Bolt,999,50\n"
+            "Nut,3,10\n"
+            "Washer,0,\n"
+            "Nut,8,10\n"
+        )
+        self.assertEqual((report.created, report.updated, report.errors), (2, 1, []))
+        self.existing.refresh_from_db()
+        self.assertEqual((self.existing.quantity, self.existing.reorder_point, self.existing.is_low), (40, 50, True))
+        nut = Stock.objects.get(name="Nut")
+        self.assertEqual((nut.quantity, nut.is_low), (8, True))
+        self.assertEqual(Stock.objects.get(name="Washer").reorder_point, 5)
+        history = StockHistory.objects.get(stock=nut)
+        self.assertEqual((history.type, history.change, history.note), (StockHistory.IN, 8, OPENING_BALANCE_NOTE))
+        self.assertEqual(StockHistory.objects.count(), 1)
+        self.assertEqual(search_ids(Stock, "was"), [Stock.objects.get(name="Washer").pk])
+
+    def test_row_errors(self):
+        """Test bad rows are reported by line and the rest are imported"""
+        report = self.run_import(
+            "name,quantity\n"
+            "Nut,abc\n"
+            ",4\n"
+            "Washer,-1\n"
+            "Spring,2\n"
+        )
+        self.assertEqual(report.created, 1)
+        self.assertEqual([line for line, _ in report.errors], [2, 3, 4])
+        self.assertIn("quantity", report.errors[0][1])
+        self.assertEqual(self.run_import("quantity\n1\n").errors, [(1, "Missing column(s): name.")])
+
+    def test_item_import(self):
+        """Test items are matched by sku and validated per field"""
+        Item.objects.create(name="Old name", sku="SKU-1", quantity=2, price=Decimal('1.00'))
+        report = self.run_import(
+            "sku,name,price,quantity,expiry_date\n"
+            "SKU-1,Laptop,500.00,9,\n"
+            "SKU-2,Mouse,5.50,20,2030-01-31\n"
+            "SKU-3,Cable,cheap,1,\n",
+            catalog='item',
+        )
+        self.assertEqual((report.created, report.updated, len(report.errors)), (1, 1, 1))
+        laptop = Item.objects.get(sku="SKU-1")
+        self.assertEqual((laptop.name, laptop.price, laptop.quantity), ("Laptop", Decimal('500.00'), 9))     # items keep no ledger
+        self.assertEqual(Item.objects.get(sku="SKU-2").expiry_date.isoformat(), '2030-01-31')
+
+    def test_rows_added_meanwhile_are_reported(self):
+        """Test a chunk clashing with rows another import created is reported, not raised"""
+        with mock.patch('django.db.models.query.QuerySet.in_bulk', return_value={}):  # Bolt looks new, as if created since
+            report = self.run_import("name,quantity\nBolt,1\nNut,2\n")
+        self.assertEqual((report.created, [line for line, _ in report.errors]), (0, [2, 3]))
+        self.assertIn("Import the file again", report.errors[0][1])
+        self.assertFalse(Stock.objects.filter(name="Nut").exists())
+
+    def test_query_count_independent_of_rows(self):
+        """Test the queries grow with the insert batches, not with the rows"""
+        def count(first, rows):
+            text = "name,quantity\n" + ''.join(f"Stock{i},5\n" for i in range(first, first + rows))
+            with CaptureQueriesContext(connection) as queries:
+                self.run_import(text)
+            return len(queries)
+        self.assertLessEqual(count(100, 300), count(0, 5) + 4)       # a few extra insert batches, SQLite caps the parameters per statement
+
+    def test_command_and_upload_view(self):
+        """Test the management command and the upload page"""
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'stock.csv')
+            with open(path, 'w') as f:
+                f.write("name,quantity\nNut,4\nBad,x\n")
+            out, err = StringIO(), StringIO()
+            call_command('import_catalog', path, stdout=out, stderr=err)
+        self.assertIn("1 created", out.getvalue())
+        self.assertIn("line 3", err.getvalue())
+
+        upload = SimpleUploadedFile('stock.csv', "name,quantity\nWasher,6\n".encode())
+        response = self.client.post(reverse('inventory:import-catalog'), {'catalog': 'stock', 'file': upload})
+        self.assertContains(response, "1 created")
+        self.assertEqual(Stock.objects.get(name="Washer").quantity, 6)
+
+
+class StockSnapshotTest(TestCase):
+    """Test point-in-time quantities from snapshots and the ledger"""
+
+    def at(self, *args):
+        return timezone.make_aware(datetime(*args))
+
+    def setUp(self):
+        self.bolt = Stock.objects.create(name="Bolt", quantity=0)
+        self.nut = Stock.objects.create(name="Nut", quantity=0)
+        record_movement(self.bolt, 10, StockHistory.IN, timestamp=self.at(2024, 3, 1, 9))
+        record_movement(self.nut, 4, StockHistory.IN, timestamp=self.at(2024, 3, 5, 9))
+        record_movement(self.bolt, 3, StockHistory.OUT, timestamp=self.at(2024, 3, 31, 18))
+        record_movement(self.bolt, 6, StockHistory.IN, timestamp=self.at(2024, 4, 2, 9))
+        record_movement(self.nut, 1, StockHistory.OUT, timestamp=self.at(2024, 4, 20, 9))
+
+    def expected(self):
+        return {
+            date(2024, 2, 28): {self.bolt.pk: 0, self.nut.pk: 0},
+            date(2024, 3, 30): {self.bolt.pk: 10, self.nut.pk: 4},
+            date(2024, 3, 31): {self.bolt.pk: 7, self.nut.pk: 4},
+            date(2024, 4, 30): {self.bolt.pk: 13, self.nut.pk: 3},
+        }
+
+    def test_without_snapshots(self):
+        """Test quantities are worked back from the current ones"""
+        for day, quantities in self.expected().items():
+            self.assertEqual(as_of(day), quantities)
+        self.assertEqual(stock_as_of(self.bolt, date(2024, 3, 31)), 7)
+
+    def test_with_snapshots(self):
+        """Test snapshots give the same answers and only recent history is read"""
+        self.assertEqual(take_snapshot(date(2024, 3, 31)), 2)
+        call_command('snapshot_stock', stdout=StringIO())
+        # a snapshot wins over the ledger before it, so it is the one being used
+        StockHistory.objects.filter(timestamp__lt=self.at(2024, 4, 1)).delete()
+        for day, quantities in list(self.expected().items())[2:]:
+            self.assertEqual(as_of(day), quantities)
+        self.assertEqual(as_of(date(2024, 4, 30), stocks=[self.nut.pk]), {self.nut.pk: 3})
+
+    def test_later_snapshot_and_new_stock(self):
+        """Test stocks are worked back from a later snapshot, and stocks added since from their quantity"""
+        call_command('snapshot_stock', '--at', '2024-04-30', stdout=StringIO())
+        washer = Stock.objects.create(name="Washer", quantity=0)
+        record_movement(washer, 2, StockHistory.IN, timestamp=self.at(2024, 5, 2, 9))
+        self.assertEqual(StockSnapshot.objects.count(), 2)
+        self.assertEqual(as_of(date(2024, 3, 31)), {self.bolt.pk: 7, self.nut.pk: 4, washer.pk: 0})
+        self.assertEqual(as_of(date(2024, 5, 2))[washer.pk], 2)
+
+
+class ReconciliationTest(TestCase):
+    """Test the incremental stock/ledger reconciliation"""
+
+    def setUp(self):
+        self.bolt = Stock.objects.create(name="Bolt", quantity=0)
+        self.nut = Stock.objects.create(name="Nut", quantity=0)
+        record_movement(self.bolt, 10, StockHistory.IN)
+        record_movement(self.bolt, 4, StockHistory.OUT)
+        record_movement(self.nut, 5, StockHistory.IN)
+
+    def test_no_drift(self):
+        run = reconcile(chunk_size=2)
+        self.assertEqual((run.history_rows, run.drift_count), (3, 0))
+        self.assertEqual(LedgerBalance.objects.get(stock=self.bolt).balance, 6)
+
+    def test_drift_reported_and_corrected(self):
+        """Test an overwritten quantity is reported, then corrected, then clean"""
+        Stock.objects.filter(pk=self.nut.pk).update(quantity=2)
+        run = reconcile()
+        self.assertEqual(list(drift_rows(run)), [(self.nut.pk, "Nut", 2, 5, -3)])
+        self.assertFalse(run.corrected)
+
+        run = reconcile(correct=True)
+        self.assertEqual((run.history_rows, run.drift_count, run.corrected), (0, 1, True))
+        adjustment = StockHistory.objects.get(note__startswith="Reconciliation")
+        self.assertEqual((adjustment.type, adjustment.change), (StockHistory.OUT, 3))
+        self.nut.refresh_from_db()
+        self.assertEqual(self.nut.quantity, 2)
+
+        run = reconcile()
+        self.assertEqual((run.history_rows, run.drift_count), (1, 0))
+
+    def test_incremental_runs_read_only_new_rows(self):
+        """Test the checkpoint, rows written after it and a rebuild"""
+        reconcile()
+        record_movement(self.nut, 1, StockHistory.OUT)
+        run = reconcile()
+        self.assertEqual((run.history_rows, run.drift_count), (1, 0))
+        # rows written after the ledger was brought up to date still count
+        record_movement(self.nut, 1, StockHistory.OUT)
+        self.assertEqual(Reconciliation.objects.count(), 2)
+        self.assertEqual(list(_drifted(run.last_history_id)), [])
+        run = reconcile(rebuild=True)
+        self.assertEqual((run.history_rows, run.drift_count), (5, 0))
+        self.assertEqual(LedgerBalance.objects.get(stock=self.nut).balance, 3)
+
+    def test_command_writes_report(self):
+        Stock.objects.filter(pk=self.bolt.pk).update(quantity=9)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'drift.csv')
+            out = StringIO()
+            call_command('reconcile_stock', '--report', path, stdout=out)
+            with open(path) as f:
+                self.assertEqual(f.read().splitlines(), ['stock_id,stock,quantity,ledger,difference', f'{self.bolt.pk},Bolt,9,6,3'])
+        self.assertIn("1 stocks drifted", out.getvalue())
+
+
+class HistorySourceTest(TestCase):
+    """Test the structured source columns of StockHistory"""
+
+    def test_services_record_source(self):
+        stock = Stock.objects.create(name="Bolt", quantity=0)
+        receive_stock([(stock, 5)], source_type=StockHistory.PURCHASE, source_id=7)
+        record_movement(stock, 2, StockHistory.OUT)
+        self.assertEqual(StockHistory.objects.for_source(StockHistory.PURCHASE, 7).get().change, 5)
+        self.assertEqual(StockHistory.objects.for_source(StockHistory.MANUAL).get().change, 2)
+
+    def test_backfill_from_notes(self):
+        """Test old rows get their source from the note, other rows are left alone"""
+        stock = Stock.objects.create(name="Bolt", quantity=0)
+        notes = [
+            "Purchase from Acme - Bill #12",
+            "Purchase bill #12 cancelled/deleted",
+            "Sale to customer - Bill #3",
+            "Sale bill #3 cancelled/deleted",
+            OPENING_BALANCE_NOTE,
+            "counted by hand",
+        ]
+        StockHistory.objects.bulk_create([StockHistory(stock=stock, change=1, type=StockHistory.IN, note=note) for note in notes])
+        call_command('backfill_history_sources', '--chunk-size', '2', stdout=StringIO())
+        self.assertEqual(
+            list(StockHistory.objects.order_by('id').values_list('source_type', 'source_id')),
+            [
+                (StockHistory.PURCHASE, 12),
+                (StockHistory.PURCHASE_REVERSAL, 12),
+                (StockHistory.SALE, 3),
+                (StockHistory.SALE_REVERSAL, 3),
+                (StockHistory.IMPORT, None),
+                (StockHistory.MANUAL, None),
+            ]
+        )
+
+
+class QueryBudgetTest(QueryBudgetTestMixin, TestCase):
+    """Test that the inventory pages stay within their query budgets"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='budgetuser', password='testpass')
+        self.client = Client(HTTP_HOST='127.0.0.1')
+        self.client.force_login(self.user)
+        for i in range(12):
+            stock = Stock.objects.create(name=f'Budget {i}', quantity=i)
+            record_movement(stock, 1, StockHistory.IN, note='seed')
+        self.stock = stock
+
+    def test_pages_within_budget(self):
+        for url in [
+            reverse('home'), reverse('about'), reverse('dashboard'),
+            reverse('inventory:inventory_list'), reverse('inventory:inventory'), reverse('inventory:inventory') + '?q=budget',
+            reverse('inventory:low-stock'), reverse('inventory:low-items'), reverse('inventory:stock-autocomplete') + '?q=bu',
+            reverse('inventory:import-catalog'), reverse('inventory:new-stock'), reverse('inventory:export-history'),
+            reverse('inventory:stock_change', args=[self.stock.pk]),
+            reverse('inventory:edit-stock', args=[self.stock.pk]), reverse('inventory:delete-stock', args=[self.stock.pk]),
+        ]:
+            with self.subTest(url=url), warnings.catch_warnings():
+                warnings.simplefilter('error', UnorderedObjectListWarning)      # a paginated list must have an order
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertWithinQueryBudget(response)
+
+    def test_posts_within_budget(self):
+        response = self.client.post(reverse('inventory:stock_change', args=[self.stock.pk]), {'change': '50', 'type': 'OUT'})
+        self.assertEqual(response.status_code, 302)
+        self.assertWithinQueryBudget(response)
+
+    def test_edit_and_delete_leave_the_quantity_alone(self):
+        """Test a movement posted while the edit form was open is kept"""
+        url = reverse('inventory:edit-stock', args=[self.stock.pk])
+        self.assertNotIn('quantity', self.client.get(url).context['form'].fields)
+        record_movement(self.stock, 5, StockHistory.IN)                        # posted by a till meanwhile
+        response = self.client.post(url, {'name': 'Renamed', 'quantity': 0, 'reorder_point': 20})
+        self.assertEqual(response.status_code, 302)
+        self.assertWithinQueryBudget(response)
+        self.stock.refresh_from_db()
+        self.assertEqual((self.stock.name, self.stock.quantity, self.stock.reorder_point, self.stock.is_low), ('Renamed', 17, 20, True))
+
+        stale = Stock.objects.get(pk=self.stock.pk)
+        record_movement(self.stock, 3, StockHistory.OUT)
+        with mock.patch.object(inventory_views.StockDeleteView, 'get_object', return_value=stale):
+            response = self.client.post(reverse('inventory:delete-stock', args=[self.stock.pk]))
+        self.assertWithinQueryBudget(response)
+        self.stock.refresh_from_db()
+        self.assertEqual((self.stock.is_deleted, self.stock.quantity), (True, 14))
+
+
+class ShardedStockTest(TestCase):
+    """Test spreading a hot stock's quantity over shard rows"""
+
+    def setUp(self):
+        cache.clear()
+        self.stock = Stock.objects.create(name='Hot', quantity=20, reorder_point=5)
+        shards.shard(self.stock, 4)
+
+    def shard_quantities(self):
+        return list(StockShard.objects.filter(stock=self.stock).order_by('number').values_list('quantity', flat=True))
+
+    def test_shard_spreads_the_quantity(self):
+        self.assertEqual(self.stock.shard_count, 4)
+        self.assertEqual(self.shard_quantities(), [5, 5, 5, 5])
+        shards.unshard(self.stock)
+        self.assertEqual((self.stock.quantity, self.stock.shard_count), (20, 0))
+        self.assertFalse(StockShard.objects.filter(stock=self.stock).exists())
+
+    def test_movements_change_shards_until_compaction(self):
+        other = Stock.objects.create(name='Plain', quantity=10)
+        receive_stock([(self.stock, 6), (other, 1)])
+        issue_stock([(self.stock, 4), (other, 2)])
+        record_movement(self.stock, 3, StockHistory.OUT)
+        self.stock.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual(self.stock.quantity, 20)                   # the figure of the last compaction
+        self.assertEqual(other.quantity, 9)
+        self.assertEqual(sum(self.shard_quantities()), 19)
+        self.assertEqual(shards.on_hand([self.stock, other]), {self.stock.pk: 19, other.pk: 9})
+
+        self.assertEqual(shards.compact(), 1)
+        self.stock.refresh_from_db()
+        self.assertEqual(self.stock.quantity, 19)
+        self.assertEqual(sorted(self.shard_quantities()), [4, 5, 5, 5])
+
+    def test_pages_show_the_shards_on_hand(self):
+        client = Client(HTTP_HOST='127.0.0.1')
+        client.force_login(User.objects.create_user('shards', password='pass'))
+        issue_stock([(self.stock, 16)])
+        self.assertTrue(Stock.objects.get(pk=self.stock.pk).is_low)             # flagged when it crossed the reorder point
+        self.assertEqual(list(Stock.objects.low_stock()), [self.stock])
+        receive_stock([(self.stock, 30)])
+        self.assertFalse(Stock.objects.get(pk=self.stock.pk).is_low)
+        self.assertEqual(Stock.objects.get(pk=self.stock.pk).quantity, 20)     # not compacted yet
+        response = client.get(reverse('dashboard'))
+        self.assertEqual((response.context['total_quantity'], response.context['low_stock_count']), (34, 0))
+        self.assertEqual(response.context['stocks'][0].on_hand, 34)
+        response = client.get(reverse('inventory:inventory'))
+        self.assertEqual(response.context['stocks'][0].on_hand, 34)
+        self.assertEqual(client.get(reverse('home')).context['data'], [34])
+
+    def test_no_oversell_across_shards(self):
+        # no single shard holds 12, together they do
+        issue_stock([(self.stock, 12)])
+        self.assertEqual(sum(self.shard_quantities()), 8)
+        with self.assertRaises(InsufficientStock) as raised:
+            issue_stock([(self.stock, 9)])
+        self.assertEqual(raised.exception.available, 8)
+        self.assertEqual(sum(self.shard_quantities()), 8)
+        self.assertTrue(all(quantity >= 0 for quantity in self.shard_quantities()))
+
+        history = record_movement(self.stock, 50, StockHistory.OUT, policy=CLAMP)
+        self.assertEqual(history.change, 8)
+        self.assertEqual(self.shard_quantities(), [0, 0, 0, 0])
+
+    def test_reconciliation_sees_sharded_quantities(self):
+        StockHistory.objects.create(stock=self.stock, change=20, type=StockHistory.IN)
+        issue_stock([(self.stock, 7)])
+        run = reconcile()
+        self.assertEqual(run.drift_count, 0)
+        self.stock.refresh_from_db()
+        self.assertEqual(self.stock.quantity, 13)
+
+    def test_stock_form_leaves_quantity_to_the_shards(self):
+        from inventory.forms import StockForm
+        form = StockForm({'name': 'Hot', 'quantity': 99, 'reorder_point': 5}, instance=self.stock)
+        self.assertTrue(form.is_valid())
+        form.save()
+        self.stock.refresh_from_db()
+        self.assertEqual(self.stock.quantity, 20)
+
+    def test_command_shards_hot_stocks_and_compacts(self):
+        cold = Stock.objects.create(name='Cold', quantity=3)
+        busy = Stock.objects.create(name='Busy', quantity=30)
+        for _ in range(3):
+            record_movement(busy, 1, StockHistory.IN)
+        record_movement(cold, 1, StockHistory.IN)
+        call_command('stock_shards', hot=1, shards=2, stdout=StringIO())
+        busy.refresh_from_db()
+        cold.refresh_from_db()
+        self.assertEqual((busy.shard_count, cold.shard_count), (2, 0))
+        out = StringIO()
+        call_command('stock_shards', compact=True, stdout=out)
+        self.assertIn('Compacted 2', out.getvalue())
+        call_command('stock_shards', off=True, stdout=StringIO())
+        self.assertFalse(Stock.objects.filter(shard_count__gt=0).exists())
+
+
+class ReservationTest(QueryBudgetTestMixin, TestCase):
+    """Test holding stock for sale baskets"""
+
+    def setUp(self):
+        cache.clear()
+        self.stock = Stock.objects.create(name='Reserved', quantity=10)
+        self.till, self.other = reservations.new_basket(), reservations.new_basket()
+
+    def available(self, basket=None):
+        return reservations.available(Stock.objects.filter(pk=self.stock.pk), basket)[self.stock.pk]
+
+    def test_reservations_hold_stock_from_other_baskets(self):
+        self.assertEqual(reservations.reserve(self.till, self.stock, 6), 4)
+        self.assertEqual(reservations.reserve(self.till, self.stock, 7), 3)     # replaces the basket's hold
+        self.assertEqual((self.available(), self.available(self.till)), (3, 10))
+        with self.assertRaises(InsufficientStock) as raised:
+            reservations.reserve(self.other, self.stock, 4)
+        self.assertEqual(raised.exception.available, 3)
+        reservations.reserve(self.till, self.stock, 0)
+        self.assertEqual(self.available(), 10)
+        self.assertFalse(Reservation.objects.exists())
+
+    def test_stock_outs_leave_reserved_stock_alone(self):
+        reservations.reserve(self.till, self.stock, 8)
+        with self.assertRaises(InsufficientStock):
+            issue_stock([(self.stock, 3)])
+        issue_stock([(self.stock, 2)])
+        issue_stock([(self.stock, 8)], basket=self.till)                        # the basket's own hold is its to take
+        self.stock.refresh_from_db()
+        self.assertEqual(self.stock.quantity, 0)
+        self.assertFalse(Reservation.objects.exists())
+
+    def test_single_stock_outs_leave_reserved_stock_alone(self):
+        reservations.reserve(self.other, self.stock, 7)
+        with self.assertRaises(InsufficientStock) as raised:
+            record_movement(self.stock, 4, StockHistory.OUT, policy=REJECT)
+        self.assertEqual(raised.exception.available, 3)
+        self.assertEqual(record_movement(self.stock, 5, StockHistory.OUT).change, 3)    # CLAMP stops at the hold
+        self.assertEqual(self.stock.quantity, 7)
+        shards.shard(self.stock, 2)
+        with self.assertRaises(InsufficientStock):
+            record_movement(self.stock, 1, StockHistory.OUT, policy=REJECT)
+
+    def test_stock_change_view_leaves_reserved_stock_alone(self):
+        user = User.objects.create_user('till', password='pass')
+        client = Client(HTTP_HOST='127.0.0.1')
+        client.force_login(user)
+        reservations.reserve(self.other, self.stock, 8)
+        response = client.post(reverse('inventory:stock_change', args=[self.stock.pk]), {'change': 5, 'type': 'OUT'})
+        self.assertEqual(response.status_code, 302)
+        self.assertWithinQueryBudget(response)
+        self.stock.refresh_from_db()
+        self.assertEqual(self.stock.quantity, 8)
+        issue_stock([(self.stock, 8)], basket=self.other)                      # the basket still checks out
+
+    def test_expired_reservations_are_ignored_and_swept(self):
+        reservations.reserve(self.till, self.stock, 8)
+        Reservation.objects.update(expires_at=timezone.now() - timezone.timedelta(seconds=1))
+        self.assertEqual(self.available(), 10)
+        issue_stock([(self.stock, 10)])
+        self.assertEqual(reservations.sweep(), 1)
+        self.assertFalse(Reservation.objects.exists())
+
+    def test_sharded_stock_reservations(self):
+        shards.shard(self.stock, 2)
+        reservations.reserve(self.other, self.stock, 9)
+        with self.assertRaises(InsufficientStock):
+            issue_stock([(self.stock, 2)])
+        issue_stock([(self.stock, 1)])
+        cache.clear()                                                           # sharded totals are cached briefly
+        self.assertEqual(self.available(), 0)
+
+    def test_reserve_view(self):
+        user = User.objects.create_user('till', password='pass')
+        client = Client(HTTP_HOST='127.0.0.1')
+        client.force_login(user)
+        url = reverse('inventory:reserve-stock')
+        response = client.post(url, {'basket': self.till, 'stock': self.stock.pk, 'quantity': 4})
+        self.assertEqual(response.json(), {'stock': self.stock.pk, 'reserved': 4, 'available': 6})
+        self.assertWithinQueryBudget(response)
+        response = client.post(url, {'basket': self.other, 'stock': self.stock.pk, 'quantity': 7})
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['available'], 6)
+        self.assertEqual(client.post(url, {'basket': 'nope', 'stock': self.stock.pk, 'quantity': 1}).status_code, 400)
+        self.assertEqual(client.get(url).status_code, 405)
+        response = client.get(reverse('inventory:stock-autocomplete'), {'q': 'reserved', 'basket': self.till})
+        self.assertEqual(response.json()['results'][0]['quantity'], 10)
+        self.assertWithinQueryBudget(response)
@@ -7,7 +7,13 @@ app_name = 'inventory'
 urlpatterns = [
     path('', views.inventory_list, name='inventory_list'),
     path('stock/<int:pk>/', views.stock_change, name='stock_change'),
+    path('history/export', views.export_history, name='export-history'),
     path('list', views.StockListView.as_view(), name='inventory'),
+    path('autocomplete', views.stock_autocomplete, name='stock-autocomplete'),
+    path('reservations', views.reserve_stock, name='reserve-stock'),
+    path('low-stock', views.LowStockListView.as_view(), name='low-stock'),
+    path('items/low-stock', views.LowItemListView.as_view(), name='low-items'),
+    path('import', views.CatalogImportView.as_view(), name='import-catalog'),
     path('new', views.StockCreateView.as_view(), name='new-stock'),
     path('stock/<pk>/edit', views.StockUpdateView.as_view(), name='edit-stock'),
     path('stock/<pk>/delete', views.StockDeleteView.as_view(), name='delete-stock'),
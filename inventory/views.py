@@ -1,49 +1,152 @@
+import logging
+
+from django.conf import settings
+from django.db import OperationalError
+from django.http import HttpResponseBadRequest, JsonResponse
 from django.shortcuts import render, redirect, get_object_or_404
-from django.urls import reverse
-from django.views.decorators.http import require_http_methods
-from django.views.generic import (
-    View,
-    CreateView, 
-    UpdateView
-)
-from django.contrib.messages.views import SuccessMessageMixin
-from django.contrib import messages
-from django.utils import timezone
-from .models import Stock, StockHistory
-from .forms import StockForm
-from django_filters.views import FilterView
-from .filters import StockFilter
-from decimal import Decimal
-from django.shortcuts import render, get_object_or_404
-from django.urls import reverse_lazy
-from django.views.generic import ListView, CreateView, UpdateView, DeleteView
+from django.urls import reverse, reverse_lazy
+from django.views.decorators.http import require_http_methods, require_POST
+from django.views.generic import View, ListView, CreateView, UpdateView, DeleteView
 from django.contrib.messages.views import SuccessMessageMixin
 from django.contrib import messages
-from django.db.models import Q
+from core import export
+from core.pagination import KeysetPaginationMixin, KeysetPaginator
+from core.querycount import query_budget
+from core.replica import read_replica
+
+from .models import Stock, StockHistory, Item
+from .forms import StockForm, CatalogImportForm
+from .services import submit_movement, CLAMP, InsufficientStock
+from .stats import get_dashboard_stats
+from .search import search
+from .autocomplete import suggest
+from . import reservations
+from .exports import HISTORY_HEADER, history_rows
+from .imports import import_catalog
 
-from .models import Stock, Item
-from .forms import StockForm
+
+logger = logging.getLogger(__name__)
+
+DASHBOARD_PAGE_SIZE = 50                        # stock table rows per dashboard page
 
 # ============================
 #   STOCK LIST WITH SEARCH
 # ============================
-class StockListView(ListView):
+@query_budget(queries=5, similar=0)
+class StockListView(KeysetPaginationMixin, ListView):
     model = Stock
-    queryset = Stock.objects.filter(is_deleted=False)
+    queryset = Stock.objects.filter(is_deleted=False).with_on_hand().order_by('name', 'id')
     template_name = "inventory/inventory.html"
     context_object_name = "stocks"
     paginate_by = 10
+    keyset_ordering = ['name', 'id']                # used when keyset_pagination is switched on
 
     def get_queryset(self):
         queryset = super().get_queryset()
         query = self.request.GET.get("q")
+        self.search_truncated = False
         if query:
-            queryset = queryset.filter(Q(name__icontains=query))
+            queryset, self.search_truncated = search(queryset, query)      # ranked, served from the search index
         return queryset
 
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['search_truncated'] = self.search_truncated                 # only the best SEARCH_RESULT_LIMIT are listed
+        context['search_limit'] = settings.SEARCH_RESULT_LIMIT
+        return context
+
+# ============================
+#   CATALOG IMPORT
+# ============================
+@query_budget(queries=12, similar=0)                  # for one chunk, larger files use a few queries per chunk
+class CatalogImportView(View):
+    template_name = "inventory/import_catalog.html"
+    max_errors_shown = 100
+
+    def get(self, request):
+        return render(request, self.template_name, {'form': CatalogImportForm()})
+
+    def post(self, request):
+        form = CatalogImportForm(request.POST, request.FILES)
+        context = {'form': form}
+        if form.is_valid():
+            # streamed and written in chunks, see inventory/imports.py
+            report = import_catalog(form.cleaned_data['file'].file, form.cleaned_data['catalog'])
+            context['report'] = report
+            context['errors'] = report.errors[:self.max_errors_shown]
+            if report.created or report.updated:
+                messages.success(request, f"Imported {report}.")
+        return render(request, self.template_name, context)
+
+# ============================
+#   STOCK AUTOCOMPLETE
+# ============================
+@query_budget(queries=5, similar=0)
+def stock_autocomplete(request):
+    """
+    JSON suggestions for the stock typeahead on the purchase and sale forms,
+    served from the in-process index in inventory/autocomplete.py. The
+    sale form passes its `basket`, so its own reservations count as available.
+    """
+    return JsonResponse({'results': suggest(request.GET.get('q', ''), basket=request.GET.get('basket') or None)})
+
+# ============================
+#   SALE BASKET RESERVATIONS
+# ============================
+@query_budget(queries=10, similar=0)
+@require_POST
+def reserve_stock(request):
+    """
+    Reserve a line of a sale basket, see inventory/reservations.py. Takes
+    `basket`, `stock` and `quantity` (0 releases the line) and answers with
+    the quantity of the stock still available to other baskets, or 409
+    with the quantity available to this one when there is not enough.
+    """
+    basket = request.POST.get('basket', '')
+    if not reservations.valid_basket(basket):
+        return HttpResponseBadRequest("Invalid basket.")
+    try:
+        pk = int(request.POST.get('stock', ''))
+        quantity = int(request.POST.get('quantity', ''))
+    except ValueError:
+        return HttpResponseBadRequest("stock and quantity must be integers.")
+    stock = get_object_or_404(Stock, pk=pk, is_deleted=False)
+    try:
+        left = reservations.reserve(basket, stock, quantity)
+    except InsufficientStock as exc:
+        return JsonResponse({'error': str(exc), 'available': exc.available}, status=409)
+    return JsonResponse({'stock': stock.pk, 'reserved': max(quantity, 0), 'available': left})
+
+# ============================
+#   LOW STOCK LISTS
+# ============================
+@query_budget(queries=3, similar=0)
+class LowStockListView(KeysetPaginationMixin, ListView):
+    queryset = Stock.objects.filter(is_deleted=False).low_stock().with_on_hand()
+    template_name = "inventory/low_stock.html"
+    context_object_name = "stocks"
+    paginate_by = 25
+    keyset_pagination = True                        # only ever reads low rows, whatever the page
+    keyset_ordering = ['name', 'id']
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["title"] = "Low Stock"
+        return context
+
+
+class LowItemListView(LowStockListView):
+    queryset = Item.objects.low_stock()
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["title"] = "Low Stock Items"
+        return context
+
 # ============================
 #   CREATE STOCK
 # ============================
+@query_budget(queries=6, similar=0)
 class StockCreateView(SuccessMessageMixin, CreateView):
     model = Stock
     form_class = StockForm
@@ -60,6 +163,7 @@ class StockCreateView(SuccessMessageMixin, CreateView):
 # ============================
 #   UPDATE STOCK
 # ============================
+@query_budget(queries=10, similar=0)                   # 10 to save: the low flag is set from the stored quantity
 class StockUpdateView(SuccessMessageMixin, UpdateView):
     model = Stock
     form_class = StockForm
@@ -70,10 +174,18 @@ class StockUpdateView(SuccessMessageMixin, UpdateView):
     def get_object(self, queryset=None):
         return get_object_or_404(Stock, pk=self.kwargs["pk"], is_deleted=False)
 
+    def form_valid(self, form):
+        # only the form's fields: saving the whole row would write back the quantity read with the form
+        self.object = form.save(commit=False)
+        self.object.save(update_fields=list(form.fields))
+        messages.success(self.request, self.get_success_message(form.cleaned_data))
+        return redirect(self.get_success_url())
+
 
 # ============================
 #   DELETE STOCK (SOFT DELETE)
 # ============================
+@query_budget(queries=6, similar=0)
 class StockDeleteView(DeleteView):
     model = Stock
     template_name = "inventory/delete_stock.html"
@@ -85,16 +197,18 @@ class StockDeleteView(DeleteView):
     def delete(self, request, *args, **kwargs):
         stock = self.get_object()
         stock.is_deleted = True
-        stock.save()
+        stock.save(update_fields=['is_deleted'])
         messages.success(request, "Stock deleted successfully.")
         return redirect('inventory:inventory')
 
 
+@query_budget(queries=4, similar=0)
+@read_replica
 def inventory_list(request):
     """
     List stocks and show a short stock history preview.
     """
-    stocks = Stock.objects.filter(is_deleted=False).order_by('name')
+    stocks = Stock.objects.filter(is_deleted=False).with_on_hand().order_by('name')
     # show latest 20 history entries
     history = StockHistory.objects.select_related('stock')[:20]
     return render(request, 'inventory/inventory_list.html', {
@@ -102,6 +216,7 @@ def inventory_list(request):
         'history': history,
     })
 
+@query_budget(queries=10, similar=0)                   # 10 when a stock out finds too little stock
 @require_http_methods(["GET", "POST"])
 def stock_change(request, pk):
     """
@@ -127,22 +242,20 @@ def stock_change(request, pk):
                 'error': 'Please enter a positive integer for change.',
             })
 
-        # Apply change
-        if typ == StockHistory.IN:
-            stock.quantity += change
-        else:
-            # Stock out: ensure we don't go negative (you can change this behavior)
-            stock.quantity = max(0, stock.quantity - change)
+        if typ != StockHistory.IN:
+            typ = StockHistory.OUT
 
-        stock.save()
-
-        StockHistory.objects.create(
-            stock=stock,
-            change=change,
-            type=typ,
-            timestamp=timezone.now(),
-            note=note
-        )
+        # Apply change and log it atomically
+        # Stock out: clamps at zero instead of going negative (pass policy=REJECT to refuse instead)
+        try:
+            submit_movement(stock, change, typ, note=note, policy=CLAMP)
+        except OperationalError as exc:
+            # the database stayed locked (e.g. a deferred transaction lost its lock upgrade), nothing was saved
+            logger.warning("Stock change of %s could not be saved: %s", stock, exc)
+            return render(request, 'inventory/stock_change.html', {
+                'item': stock,
+                'error': 'The change could not be saved, the database is busy. Please try again.',
+            }, status=503)
 
         return redirect(reverse('inventory:inventory_list'))
 
@@ -150,33 +263,46 @@ def stock_change(request, pk):
     return render(request, 'inventory/stock_change.html', {'item': stock})
 
 
+@query_budget(queries=2, similar=0)
+@read_replica
+def export_history(request):
+    """
+    Download the stock history as CSV or JSON Lines, streamed row by row.
+    Takes `since`, `until`, `stock`, `format` (csv/jsonl) and `gzip` in the query string.
+    """
+    try:
+        options = export.parse_options(request.GET)
+    except export.ExportError as exc:
+        return HttpResponseBadRequest(str(exc))
+    rows = history_rows(options['since'], options['until'], options['stock'])
+    return export.export_response('stock_history', HISTORY_HEADER, rows, options['format'], options['compress'])
+
+
 # ============================
 #   DASHBOARD
 # ============================
+@query_budget(queries=5, similar=0)
+@read_replica
 def dashboard(request):
     """
     Dashboard view:
-    - highlights low stock items (threshold configurable)
+    - highlights low stock items (at or below each stock's reorder point)
     - shows total items and low stock count
-    - passes low_ids set for template conditional checks
+    - passes low_ids set of the previewed low stock items
+    - lists the stocks a page at a time
+    The figures come from the cache, see inventory/stats.py; the stock table does not.
     """
-    low_threshold = 5  # change this value to adjust what counts as low stock
-    stocks = Stock.objects.filter(is_deleted=False).order_by('name')
-    # compute low stock items and a set of their ids for fast template checks
-    low_stock_items = [stock for stock in stocks if stock.quantity <= low_threshold]
-    low_ids = {stock.id for stock in low_stock_items}
-
-    total_items = stocks.count()
-    total_quantity = sum(stock.quantity for stock in stocks)
-    low_stock_count = len(low_stock_items)
+    stats = get_dashboard_stats()
+    stocks = Stock.objects.filter(is_deleted=False).with_on_hand()
+    page = KeysetPaginator(stocks, ['name', 'id'], DASHBOARD_PAGE_SIZE).page(request.GET.get('cursor'))
 
     context = {
-        'stocks': stocks,
-        'low_stock_items': low_stock_items,
-        'low_threshold': low_threshold,
-        'low_ids': low_ids,
-        'total_items': total_items,
-        'total_quantity': total_quantity,
-        'low_stock_count': low_stock_count,
+        'stocks': page,
+        'page_obj': page,
+        'low_stock_items': stats['low_stock_items'],
+        'low_ids': {stock['id'] for stock in stats['low_stock_items']},
+        'total_items': stats['total_items'],
+        'total_quantity': stats['total_quantity'],
+        'low_stock_count': stats['low_stock_count'],
     }
     return render(request, 'dashboard.html', context)
@@ -0,0 +1,24 @@
+from django import forms
+from django.urls import reverse_lazy
+
+from .autocomplete import stock_label
+
+
+class StockAutocompleteWidget(forms.Widget):
+    """
+    Picks a stock by typing its name instead of choosing from a <select>
+    holding every stock. Only a hidden input with the stock id is posted;
+    the visible text box asks the autocomplete endpoint for suggestions.
+    """
+    template_name = 'inventory/widgets/stock_autocomplete.html'
+    url = reverse_lazy('inventory:stock-autocomplete')
+    choices = ()                                    # set by ModelChoiceField, never rendered
+
+    class Media:
+        js = ('inventory/js/stock_autocomplete.js',)
+
+    def get_context(self, name, value, attrs):
+        context = super().get_context(name, value, attrs)
+        context['widget']['label'] = stock_label(value) if value not in (None, '') else ''
+        context['widget']['url'] = str(self.url)
+        return context
@@ -0,0 +1,32 @@
+"""Exports of purchase and sale bills, one row per bill item, see core/export.py."""
+from core.export import CHUNK_SIZE, date_range
+
+from .models import PurchaseItem, SaleItem
+
+
+PURCHASE_HEADER = ('billno', 'time', 'supplier', 'bill_total', 'stock_id', 'stock', 'quantity', 'perprice', 'totalprice')
+SALE_HEADER = ('billno', 'time', 'customer', 'bill_total', 'stock_id', 'stock', 'quantity', 'perprice', 'totalprice')
+
+
+def _item_rows(queryset, party, since, until, stock, chunk_size):
+    queryset = queryset.filter(**date_range('billno__time', since, until))
+    if stock:
+        queryset = queryset.filter(stock_id=stock)
+    return (
+        queryset.order_by('billno', 'id')
+        .values_list(
+            'billno', 'billno__time', party, 'billno__total',
+            'stock_id', 'stock__name', 'quantity', 'perprice', 'totalprice',
+        )
+        .iterator(chunk_size=chunk_size)
+    )
+
+
+def purchase_rows(since=None, until=None, stock=None, chunk_size=CHUNK_SIZE):
+    """Purchase bill items joined with their bill and supplier, in bill order."""
+    return _item_rows(PurchaseItem.objects.all(), 'billno__supplier__name', since, until, stock, chunk_size)
+
+
+def sale_rows(since=None, until=None, stock=None, chunk_size=CHUNK_SIZE):
+    """Sale bill items joined with their bill, in bill order."""
+    return _item_rows(SaleItem.objects.all(), 'billno__name', since, until, stock, chunk_size)
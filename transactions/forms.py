@@ -1,5 +1,7 @@
 from django import forms
-from django.forms import formset_factory
+from django.core.exceptions import ValidationError
+from django.forms import formset_factory, BaseFormSet
+from django.utils.functional import cached_property
 from .models import (
     Supplier, 
     PurchaseBill, 
@@ -10,6 +12,7 @@ from .models import (
     SaleBillDetails
 )
 from inventory.models import Stock
+from inventory.widgets import StockAutocompleteWidget
 
 
 # form used to select a supplier
@@ -22,20 +25,71 @@ class SelectSupplierForm(forms.ModelForm):
         model = PurchaseBill
         fields = ['supplier']
 
+# stock field that resolves the submitted pk from stocks preloaded by the formset instead of one query per row
+class StockChoiceField(forms.ModelChoiceField):
+    stocks = None
+
+    def to_python(self, value):
+        if self.stocks is None or value in self.empty_values:
+            return super().to_python(value)
+        try:
+            return self.stocks[int(value)]
+        except (KeyError, TypeError, ValueError):
+            raise ValidationError(self.error_messages['invalid_choice'], code='invalid_choice')
+
+# base form for a bill line, picks up the preloaded stocks passed in by 'StockItemFormSet'
+class StockItemForm(forms.ModelForm):
+    def __init__(self, *args, stocks=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['stock'].stocks = stocks
+
+    def clean_quantity(self):
+        quantity = self.cleaned_data['quantity']
+        if quantity is not None and quantity <= 0:
+            raise ValidationError("Quantity must be greater than zero")
+        return quantity
+
+    def _get_validation_exclusions(self):
+        exclude = super()._get_validation_exclusions()
+        # the stock has already been checked against the preloaded stocks, skip the per-row existence query
+        if self.fields['stock'].stocks is not None:
+            exclude.append('stock')
+        return exclude
+
+# formset that loads every stock referenced by the submitted rows with a single in_bulk query
+class StockItemFormSet(BaseFormSet):
+    @cached_property
+    def stocks(self):
+        if not self.is_bound:
+            return None
+        ids = set()
+        for i in range(self.total_form_count()):
+            value = self.data.get(self.add_prefix(i) + '-stock', '')
+            if str(value).isdigit():
+                ids.add(int(value))
+        return Stock.objects.filter(is_deleted=False).in_bulk(ids)
+
+    def get_form_kwargs(self, index):
+        kwargs = super().get_form_kwargs(index)
+        kwargs['stocks'] = self.stocks
+        return kwargs
+
 # form used to render a single stock item form
-class PurchaseItemForm(forms.ModelForm):
+class PurchaseItemForm(StockItemForm):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.fields['stock'].queryset = Stock.objects.filter(is_deleted=False)
-        self.fields['stock'].widget.attrs.update({'class': 'textinput form-control setprice stock', 'required': 'true'})
+        self.fields['stock'].widget.attrs.update({'class': 'setprice stock'})
         self.fields['quantity'].widget.attrs.update({'class': 'textinput form-control setprice quantity', 'min': '0', 'required': 'true'})
         self.fields['perprice'].widget.attrs.update({'class': 'textinput form-control setprice price', 'min': '0', 'required': 'true'})
     class Meta:
         model = PurchaseItem
         fields = ['stock', 'quantity', 'perprice']
+        field_classes = {'stock': StockChoiceField}
+        widgets = {'stock': StockAutocompleteWidget}                            # typeahead instead of a <select> of every stock
 
 # formset used to render multiple 'PurchaseItemForm'
-PurchaseItemFormset = formset_factory(PurchaseItemForm, extra=1)
+PurchaseItemFormset = formset_factory(PurchaseItemForm, formset=StockItemFormSet, extra=1)
 
 # form used to accept the other details for purchase bill
 class PurchaseDetailsForm(forms.ModelForm):
@@ -86,19 +140,21 @@ class SaleForm(forms.ModelForm):
         }
 
 # form used to render a single stock item form
-class SaleItemForm(forms.ModelForm):
+class SaleItemForm(StockItemForm):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.fields['stock'].queryset = Stock.objects.filter(is_deleted=False)
-        self.fields['stock'].widget.attrs.update({'class': 'textinput form-control setprice stock', 'required': 'true'})
+        self.fields['stock'].widget.attrs.update({'class': 'setprice stock'})
         self.fields['quantity'].widget.attrs.update({'class': 'textinput form-control setprice quantity', 'min': '0', 'required': 'true'})
         self.fields['perprice'].widget.attrs.update({'class': 'textinput form-control setprice price', 'min': '0', 'required': 'true'})
     class Meta:
         model = SaleItem
         fields = ['stock', 'quantity', 'perprice']
+        field_classes = {'stock': StockChoiceField}
+        widgets = {'stock': StockAutocompleteWidget}                            # typeahead instead of a <select> of every stock
 
 # formset used to render multiple 'SaleItemForm'
-SaleItemFormset = formset_factory(SaleItemForm, extra=1)
+SaleItemFormset = formset_factory(SaleItemForm, formset=StockItemFormSet, extra=1)
 
 # form used to accept the other details for sales bill
 class SaleDetailsForm(forms.ModelForm):
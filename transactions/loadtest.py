@@ -0,0 +1,286 @@
+"""
+Write-contention load test: many tills posting at once.
+
+`workers` threads each act as one till and post a mix of sales, purchases
+and manual stock changes through the real views, either in-process
+through the WSGI app (Django's test client, one database connection per
+thread) or against a running server given by `url`. Lines are drawn with
+a skew towards a few hot stocks, as in a shop where most sales are of a
+handful of products, since that is where rows and SQLite's write lock
+are fought over.
+
+The report gives the throughput, the latency distribution per kind of
+request, the failures, how many of them failed on `database is locked`
+(seen exactly in-process; against a server only when the error page says
+so) and whether the ledger still matches the stock quantities. A request
+that hit a lock but posted after a retry counts as posted.
+"""
+import http.cookiejar
+import random
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import OperationalError, connection
+from django.db.models import F, IntegerField, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.test import Client
+from django.urls import reverse
+
+from core.benchmark import percentile
+from inventory import shards
+from inventory.models import Stock, StockHistory, signed_change
+
+from .models import PurchaseBill, SaleBill, Supplier
+
+
+MIX = {'sale': 70, 'purchase': 20, 'stock_change': 10}
+HOT_SKUS = 5
+HOT_SHARE = 0.8                                         # share of lines drawn from the hot stocks
+
+
+def parse_mix(value):
+    """'sale=70,purchase=20,stock_change=10' -> {'sale': 70, ...}."""
+    mix = {}
+    for part in value.split(','):
+        kind, _, weight = part.partition('=')
+        kind = kind.strip()
+        if kind not in MIX:
+            raise ValueError(f"Unknown request kind '{kind}', use {', '.join(MIX)}.")
+        try:
+            mix[kind] = int(weight)
+        except ValueError:
+            raise ValueError(f"Weight of '{kind}' must be an integer.")
+    if not any(mix.values()):
+        raise ValueError("The mix needs at least one positive weight.")
+    return mix
+
+
+class LocalTill:
+    """Posts through the WSGI app in this process, in the calling thread."""
+
+    def __init__(self, user):
+        self.client = Client(HTTP_HOST='127.0.0.1', raise_request_exception=False)
+        self.client.force_login(user)
+        self.locked = False
+
+    def _watch(self, execute, sql, params, many, context):
+        try:
+            return execute(sql, params, many, context)
+        except OperationalError as exc:
+            if 'locked' in str(exc):
+                self.locked = True
+            raise
+
+    def post(self, path, data):
+        """(status, locked) of POSTing `data` to `path`."""
+        self.locked = False
+        with connection.execute_wrapper(self._watch):
+            response = self.client.post(path, data)
+        return response.status_code, self.locked
+
+    def close(self):
+        connection.close()
+
+
+class RemoteTill:
+    """Posts to a running server over HTTP with its own login session."""
+
+    def __init__(self, url, username, password):
+        self.url = url.rstrip('/')
+        self.cookies = http.cookiejar.CookieJar()
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(self.cookies), _NoRedirect,
+        )
+        self.opener.open(self.url + reverse('login')).read()
+        status, _ = self.post(reverse('login'), {'username': username, 'password': password})
+        if status != 302:
+            raise ValueError(f"Could not log in to {self.url} as {username}.")
+
+    def _csrf_token(self):
+        return next((cookie.value for cookie in self.cookies if cookie.name == 'csrftoken'), '')
+
+    def post(self, path, data):
+        body = urllib.parse.urlencode(dict(data, csrfmiddlewaretoken=self._csrf_token())).encode()
+        request = urllib.request.Request(self.url + path, data=body, headers={'Referer': self.url + path})
+        try:
+            with self.opener.open(request) as response:
+                return response.status, False
+        except urllib.error.HTTPError as exc:
+            page = exc.read()
+            return exc.code, b'database is locked' in page or b'database table is locked' in page
+
+    def close(self):
+        pass
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    """Report redirects (a posted bill) instead of following them."""
+
+    def http_error_302(self, req, fp, code, msg, headers):
+        return fp
+
+    http_error_301 = http_error_303 = http_error_307 = http_error_302
+
+
+class Workload:
+    """Draws the next request of a till: its kind, path and form data."""
+
+    def __init__(self, stock_ids, supplier_ids, mix=MIX, hot_skus=HOT_SKUS, hot_share=HOT_SHARE, lines=2, seed=None):
+        if not stock_ids:
+            raise ValueError("There are no stocks to post against, run seed_scale first.")
+        self.rng = random.Random(seed)
+        self.stock_ids = stock_ids
+        self.hot = stock_ids[:hot_skus]
+        self.hot_share = hot_share
+        self.supplier_ids = supplier_ids
+        self.kinds = [kind for kind in mix if mix[kind] > 0 and (kind != 'purchase' or supplier_ids)]
+        self.weights = [mix[kind] for kind in self.kinds]
+        self.lines = lines
+
+    def stock(self):
+        pool = self.hot if self.rng.random() < self.hot_share else self.stock_ids
+        return self.rng.choice(pool)
+
+    def _formset(self, low, high):
+        stocks = []
+        while len(stocks) < min(self.lines, len(self.stock_ids)):   # one line per stock, as a till would
+            pk = self.stock()
+            if pk not in stocks:
+                stocks.append(pk)
+        data = {
+            'form-TOTAL_FORMS': str(len(stocks)),
+            'form-INITIAL_FORMS': '0',
+            'form-MIN_NUM_FORMS': '0',
+            'form-MAX_NUM_FORMS': '1000',
+        }
+        for i, pk in enumerate(stocks):
+            data[f'form-{i}-stock'] = str(pk)
+            data[f'form-{i}-quantity'] = str(self.rng.randint(low, high))
+            data[f'form-{i}-perprice'] = str(self.rng.randint(10, 500))
+        return data
+
+    def next(self):
+        kind = self.rng.choices(self.kinds, self.weights)[0]
+        if kind == 'sale':
+            data = dict(self._formset(1, 3), name='Load Test', phone='9999999999', address='Till',
+                        email='till@example.com', gstin='LOADTEST1234567')
+            return kind, reverse('transactions:new-sale'), data
+        if kind == 'purchase':
+            path = reverse('transactions:new-purchase', args=[self.rng.choice(self.supplier_ids)])
+            return kind, path, self._formset(5, 20)
+        data = {'change': str(self.rng.randint(1, 5)), 'type': self.rng.choice([StockHistory.IN, StockHistory.OUT])}
+        return kind, reverse('inventory:stock_change', args=[self.stock()]), data
+
+
+def ledger_drift():
+    """Number of stocks whose quantity differs from the sum of their history."""
+    net = (
+        StockHistory.objects.filter(stock=OuterRef('pk')).order_by().values('stock')
+        .annotate(net=Sum(signed_change())).values('net')
+    )
+    return (
+        Stock.objects.annotate(ledger=Coalesce(Subquery(net, output_field=IntegerField()), 0))
+        .exclude(quantity=F('ledger')).count()
+    )
+
+
+def _last(model):
+    return model.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+
+
+def _unposted(model, source_type, after):
+    """Bills numbered above `after` that have no stock movements."""
+    posted = StockHistory.objects.for_source(source_type).values('source_id')
+    return model.objects.filter(pk__gt=after).exclude(pk__in=posted).count()
+
+
+def run(user=None, workers=8, requests=200, mix=MIX, hot_skus=HOT_SKUS, hot_share=HOT_SHARE, lines=2,
+        url=None, username=None, password=None, seed=None):
+    """Run the load test and return its report as a dict."""
+    stock_ids = list(Stock.objects.filter(is_deleted=False).order_by('pk').values_list('pk', flat=True))
+    supplier_ids = list(Supplier.objects.filter(is_deleted=False).order_by('pk').values_list('pk', flat=True))
+    shards.compact()
+    drift_before = ledger_drift()
+    last_sale, last_purchase = _last(SaleBill), _last(PurchaseBill)
+
+    results = []                                        # (kind, status, ms, locked)
+    lock = threading.Lock()
+    remaining = [requests]
+
+    def till(number, client):
+        workload = Workload(stock_ids, supplier_ids, mix, hot_skus, hot_share, lines,
+                            seed=None if seed is None else seed + number)
+        try:
+            while True:
+                with lock:
+                    if remaining[0] <= 0:
+                        return
+                    remaining[0] -= 1
+                kind, path, data = workload.next()
+                started = time.perf_counter()
+                status, locked = client.post(path, data)
+                elapsed = (time.perf_counter() - started) * 1000
+                with lock:
+                    results.append((kind, status, elapsed, locked))
+        finally:
+            client.close()
+
+    # logged in one by one, before the clock starts: concurrent logins only contend for the session table
+    clients = [RemoteTill(url, username, password) if url else LocalTill(user) for _ in range(workers)]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for future in [pool.submit(till, number, client) for number, client in enumerate(clients)]:
+            future.result()
+    elapsed = time.perf_counter() - started
+    shards.compact()                                    # the ledger figures compare Stock.quantity
+
+    return {
+        'workers': workers,
+        'requests': len(results),
+        'seconds': round(elapsed, 2),
+        'throughput': round(len(results) / elapsed, 1) if elapsed else 0,
+        'kinds': {kind: _summary([r for r in results if r[0] == kind]) for kind in mix if mix[kind] > 0},
+        'total': _summary(results),
+        'ledger': {
+            'drifted_before': drift_before,
+            'drifted_after': ledger_drift(),
+            'negative_stocks': Stock.objects.filter(quantity__lt=0).count(),
+            'unposted_sales': _unposted(SaleBill, StockHistory.SALE, last_sale),
+            'unposted_purchases': _unposted(PurchaseBill, StockHistory.PURCHASE, last_purchase),
+        },
+    }
+
+
+def consistent(report):
+    """Whether the ledger figures of `report` show no damage done by the run."""
+    ledger = report['ledger']
+    return (
+        ledger['drifted_after'] <= ledger['drifted_before']
+        and not ledger['negative_stocks'] and not ledger['unposted_sales'] and not ledger['unposted_purchases']
+    )
+
+
+def _summary(results):
+    # a posted bill or stock change redirects; 200 re-renders the form (e.g. not enough stock),
+    # unless a lock was seen on the way: that is an error whatever the page says
+    timings = [ms for _, _, ms, _ in results]
+    failed = [(status, locked) for _, status, _, locked in results if status != 302]
+    summary = {
+        'requests': len(results),
+        'posted': len(results) - len(failed),
+        'rejected': sum(1 for status, locked in failed if status == 200 and not locked),
+        'errors': sum(1 for status, locked in failed if status >= 400 or locked),
+        'locked': sum(1 for _, locked in failed if locked),
+    }
+    if timings:
+        summary.update({
+            'p50_ms': round(percentile(timings, 50), 2),
+            'p95_ms': round(percentile(timings, 95), 2),
+            'p99_ms': round(percentile(timings, 99), 2),
+            'max_ms': round(max(timings), 2),
+        })
+    return summary
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+from transactions.models import PurchaseBill, PurchaseItem, SaleBill, SaleItem
+
+
+class Command(BaseCommand):
+    help = "Recompute the stored total and line_count of every purchase and sale bill from its items."
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            purchases = self.backfill(PurchaseBill, PurchaseItem)
+            sales = self.backfill(SaleBill, SaleItem)
+        self.stdout.write(self.style.SUCCESS(f"Updated {purchases} purchase bills and {sales} sale bills."))
+
+    def backfill(self, bill_model, item_model):
+        # one UPDATE per table, the sums are computed by correlated subqueries
+        items = item_model.objects.filter(billno=OuterRef('pk')).order_by().values('billno')
+        total = items.annotate(total=Sum('totalprice')).values('total')
+        line_count = items.annotate(line_count=Count('pk')).values('line_count')
+        return bill_model.objects.update(
+            total=Coalesce(Subquery(total, output_field=IntegerField()), 0),
+            line_count=Coalesce(Subquery(line_count, output_field=IntegerField()), 0),
+        )
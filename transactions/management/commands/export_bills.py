@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core import export
+from transactions.exports import PURCHASE_HEADER, SALE_HEADER, purchase_rows, sale_rows
+
+
+EXPORTS = {
+    'purchases': (PURCHASE_HEADER, purchase_rows),
+    'sales': (SALE_HEADER, sale_rows),
+}
+
+
+class Command(BaseCommand):
+    help = "Export purchase or sale bills, one row per item, as CSV or JSON Lines, streamed in constant memory."
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(EXPORTS))
+        export.add_arguments(parser)
+
+    def handle(self, *args, **options):
+        try:
+            params = export.parse_options(options)
+        except export.ExportError as exc:
+            raise CommandError(exc)
+        header, rows = EXPORTS[options['kind']]
+        rows = rows(params['since'], params['until'], params['stock'])
+        written = export.write_export(options['output'], header, rows, params['format'], params['compress'])
+        if options['output']:
+            self.stdout.write(self.style.SUCCESS(f"Wrote {written} bytes to {options['output']}."))
@@ -0,0 +1,77 @@
+import json
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from transactions import loadtest
+
+
+class Command(BaseCommand):
+    help = "Post sales, purchases and stock changes from many concurrent tills and report contention."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=8, help="Concurrent tills (threads).")
+        parser.add_argument('--requests', type=int, default=200, help="Requests in total, shared by the tills.")
+        parser.add_argument('--mix', default='sale=70,purchase=20,stock_change=10', help="Relative weights per request kind.")
+        parser.add_argument('--hot-skus', type=int, default=loadtest.HOT_SKUS, help="Number of hot stocks.")
+        parser.add_argument('--hot-share', type=float, default=loadtest.HOT_SHARE, help="Share of lines drawn from the hot stocks.")
+        parser.add_argument('--lines', type=int, default=2, help="Lines per bill.")
+        parser.add_argument('--url', help="Post to this running server (e.g. http://127.0.0.1:8000) instead of in-process.")
+        parser.add_argument('--user', help="Username to post as (default: the first superuser).")
+        parser.add_argument('--password', help="Password of --user, needed with --url.")
+        parser.add_argument('--seed', type=int, help="Random seed, for repeatable runs.")
+        parser.add_argument('--output', help="Write the report to this JSON file.")
+
+    def handle(self, *args, **options):
+        try:
+            mix = loadtest.parse_mix(options['mix'])
+        except ValueError as exc:
+            raise CommandError(exc)
+        User = get_user_model()
+        users = User.objects.filter(username=options['user']) if options['user'] else User.objects.filter(is_superuser=True)
+        user = users.order_by('pk').first()
+        if user is None:
+            raise CommandError("No user to post as, create a superuser or pass --user.")
+        if options['url'] and not options['password']:
+            raise CommandError("--url needs --password to log in.")
+
+        try:
+            report = loadtest.run(
+                user=user,
+                workers=options['workers'],
+                requests=options['requests'],
+                mix=mix,
+                hot_skus=options['hot_skus'],
+                hot_share=options['hot_share'],
+                lines=options['lines'],
+                url=options['url'],
+                username=user.get_username(),
+                password=options['password'],
+                seed=options['seed'],
+            )
+        except ValueError as exc:
+            raise CommandError(exc)
+
+        self.stdout.write(
+            f"{report['requests']} requests from {report['workers']} tills in {report['seconds']}s "
+            f"({report['throughput']} requests/s)"
+        )
+        self.stdout.write(f"{'kind':<14} {'posted':>7} {'rejected':>9} {'errors':>7} {'locked':>7} {'p50':>8} {'p95':>8} {'p99':>8}")
+        for kind, summary in list(report['kinds'].items()) + [('total', report['total'])]:
+            self.stdout.write(
+                f"{kind:<14} {summary['posted']:>7} {summary['rejected']:>9} {summary['errors']:>7} {summary['locked']:>7} "
+                f"{summary.get('p50_ms', '-'):>8} {summary.get('p95_ms', '-'):>8} {summary.get('p99_ms', '-'):>8}"
+            )
+        ledger = report['ledger']
+        self.stdout.write(
+            f"Ledger: {ledger['drifted_after']} stocks drifted (was {ledger['drifted_before']}), "
+            f"{ledger['negative_stocks']} negative, {ledger['unposted_sales']} sales and "
+            f"{ledger['unposted_purchases']} purchases without movements."
+        )
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(f"Report written to {options['output']}.")
+        if not loadtest.consistent(report):
+            raise CommandError("The ledger is inconsistent after the run.")
+        self.stdout.write(self.style.SUCCESS("Ledger consistent."))
@@ -0,0 +1,34 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from transactions.seed import seed
+
+
+class Command(BaseCommand):
+    help = "Add a large synthetic dataset (stocks, suppliers, bills, stock history) with bulk inserts, for benchmarking."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stocks', type=int, default=1000)
+        parser.add_argument('--bills', type=int, default=1000, help="Split evenly between purchases and sales.")
+        parser.add_argument('--history', type=int, default=10000, help="Manual stock movements on top of the bill lines.")
+        parser.add_argument('--suppliers', type=int, default=50)
+        parser.add_argument('--lines', type=int, default=3, help="Average lines per bill.")
+        parser.add_argument('--days', type=int, default=365, help="Spread bills and movements over this many past days.")
+        parser.add_argument('--seed', type=int, help="Random seed, for repeatable datasets.")
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        counts = seed(
+            stocks=options['stocks'],
+            bills=options['bills'],
+            history=options['history'],
+            suppliers=options['suppliers'],
+            lines=options['lines'],
+            days=options['days'],
+            seed=options['seed'],
+            log=lambda message: self.stdout.write(f"  {message}"),
+        )
+        elapsed = time.perf_counter() - started
+        rows = sum(counts.values())
+        self.stdout.write(self.style.SUCCESS(f"Seeded {rows} rows in {elapsed:.1f}s."))
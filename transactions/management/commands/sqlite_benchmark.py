@@ -0,0 +1,73 @@
+import copy
+import os
+import tempfile
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+
+from core.db.profiles import use_database
+from inventory import shards
+from inventory.models import Stock
+from transactions import loadtest
+from transactions.seed import seed
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare write throughput of the SQLite profiles (SQLITE_PROFILES) under concurrent tills, "
+        "each on a fresh seeded database file."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=8)
+        parser.add_argument('--requests', type=int, default=300)
+        parser.add_argument('--stocks', type=int, default=500, help="Stocks in each seeded database.")
+        parser.add_argument('--hot-skus', type=int, default=loadtest.HOT_SKUS)
+        parser.add_argument('--mix', default='sale=70,purchase=20,stock_change=10',
+                            help="Weights of the kinds of request, e.g. stock_change=100 for a cycle count.")
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        try:
+            mix = loadtest.parse_mix(options['mix'])
+        except ValueError as exc:
+            raise CommandError(str(exc))
+        variants = [
+            ('default', 'default', {}, False),
+            ('production', 'production', {}, False),
+            ('production+queue', 'production', {'SQLITE_WRITER_QUEUE': True}, False),
+            ('production+group', 'production', {'STOCK_GROUP_COMMIT': True}, False),
+            ('production+shards', 'production', {}, True),
+        ]
+        results = []
+        with tempfile.TemporaryDirectory() as directory:
+            for label, profile, overrides, sharded in variants:
+                settings_dict = copy.deepcopy(settings.SQLITE_PROFILES[profile])
+                settings_dict['NAME'] = os.path.join(directory, f'{label}.sqlite3')
+                with use_database(settings_dict), override_settings(**overrides):
+                    call_command('migrate', run_syncdb=True, verbosity=0)
+                    seed(stocks=options['stocks'], bills=200, history=1000, suppliers=20, seed=options['seed'])
+                    if sharded:                                 # the stocks the tills draw most lines from
+                        for stock in Stock.objects.filter(is_deleted=False).order_by('pk')[:options['hot_skus']]:
+                            shards.shard(stock)
+                    user = get_user_model().objects.create_superuser('benchmark', 'benchmark@example.com', None)
+                    self.stdout.write(f"{label}: {options['requests']} requests from {options['workers']} tills...")
+                    report = loadtest.run(
+                        user=user, workers=options['workers'], requests=options['requests'], mix=mix,
+                        hot_skus=options['hot_skus'], seed=options['seed'],
+                    )
+                results.append((label, report))
+
+        baseline = results[0][1]['throughput'] or 1
+        self.stdout.write(f"\n{'profile':<18} {'req/s':>7} {'gain':>6} {'p50':>8} {'p95':>8} {'posted':>7} {'errors':>7} {'locked':>7}  ledger")
+        for label, report in results:
+            total = report['total']
+            self.stdout.write(
+                f"{label:<18} {report['throughput']:>7} {report['throughput'] / baseline:>5.2f}x "
+                f"{total.get('p50_ms', '-'):>8} {total.get('p95_ms', '-'):>8} {total['posted']:>7} "
+                f"{total['errors'] + total['rejected']:>7} {total['locked']:>7}  "
+                f"{'ok' if loadtest.consistent(report) else 'INCONSISTENT'}"
+            )
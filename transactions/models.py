@@ -1,5 +1,6 @@
 from django.db import models
-from inventory.models import Stock
+from django.db.models import Prefetch, Q
+from inventory.models import Stock, StockHistory
 
 #contains suppliers
 class Supplier(models.Model):
@@ -11,28 +12,50 @@ class Supplier(models.Model):
     gstin = models.CharField(max_length=15, unique=True)
     is_deleted = models.BooleanField(default=False)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['name'], name='supplier_name_idx', condition=Q(is_deleted=False)),
+        ]
+
     def __str__(self):
 	    return self.name
 
 
+#queries used to list purchase bills along with their supplier and items
+class PurchaseBillQuerySet(models.QuerySet):
+    def for_list(self):
+        return self.select_related('supplier').prefetch_related(
+            Prefetch('purchasebillno', queryset=PurchaseItem.objects.select_related('stock'))
+        )
+
 #contains the purchase bills made
 class PurchaseBill(models.Model):
     billno = models.AutoField(primary_key=True)
     time = models.DateTimeField(auto_now=True)
     supplier = models.ForeignKey(Supplier, on_delete = models.CASCADE, related_name='purchasesupplier')
+    total = models.IntegerField(default=0)                  # sum of the items' totalprice, stored when the bill is posted
+    line_count = models.IntegerField(default=0)             # number of items, stored when the bill is posted
+
+    objects = PurchaseBillQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # newest first lists, keyset paginated on (time, billno), overall and per supplier
+            models.Index(fields=['-time', '-billno'], name='purchasebill_time_idx'),
+            models.Index(fields=['supplier', '-time'], name='purchasebill_supplier_time_idx'),
+        ]
 
     def __str__(self):
 	    return "Bill no: " + str(self.billno)
 
     def get_items_list(self):
-        return PurchaseItem.objects.filter(billno=self)
+        return self.purchasebillno.all()                    # served from the prefetch cache when loaded with for_list()
+
+    def get_stock_movements(self):
+        return StockHistory.objects.for_source([StockHistory.PURCHASE, StockHistory.PURCHASE_REVERSAL], self.billno)
 
     def get_total_price(self):
-        purchaseitems = PurchaseItem.objects.filter(billno=self)
-        total = 0
-        for item in purchaseitems:
-            total += item.totalprice
-        return total
+        return self.total
 
 #contains the purchase stocks made
 class PurchaseItem(models.Model):
@@ -65,6 +88,13 @@ class PurchaseBillDetails(models.Model):
 	    return "Bill no: " + str(self.billno.billno)
 
 
+#queries used to list sale bills along with their items
+class SaleBillQuerySet(models.QuerySet):
+    def for_list(self):
+        return self.prefetch_related(
+            Prefetch('salebillno', queryset=SaleItem.objects.select_related('stock'))
+        )
+
 #contains the sale bills made
 class SaleBill(models.Model):
     billno = models.AutoField(primary_key=True)
@@ -75,19 +105,27 @@ class SaleBill(models.Model):
     address = models.CharField(max_length=200)
     email = models.EmailField(max_length=254)
     gstin = models.CharField(max_length=15)
+    total = models.IntegerField(default=0)                  # sum of the items' totalprice, stored when the bill is posted
+    line_count = models.IntegerField(default=0)             # number of items, stored when the bill is posted
+
+    objects = SaleBillQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-time', '-billno'], name='salebill_time_idx'),
+        ]
 
     def __str__(self):
 	    return "Bill no: " + str(self.billno)
 
     def get_items_list(self):
-        return SaleItem.objects.filter(billno=self)
+        return self.salebillno.all()                        # served from the prefetch cache when loaded with for_list()
+
+    def get_stock_movements(self):
+        return StockHistory.objects.for_source([StockHistory.SALE, StockHistory.SALE_REVERSAL], self.billno)
         
     def get_total_price(self):
-        saleitems = SaleItem.objects.filter(billno=self)
-        total = 0
-        for item in saleitems:
-            total += item.totalprice
-        return total
+        return self.total
 
 #contains the sale stocks made
 class SaleItem(models.Model):
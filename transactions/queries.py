@@ -0,0 +1,34 @@
+"""Hot query shapes of the transactions app, checked by `python manage.py index_advisor`."""
+from core.index_advisor import register
+
+from .models import PurchaseBill, PurchaseItem, SaleBill, SaleItem, Supplier
+
+
+@register('purchases list')
+def purchases_list():
+    return PurchaseBill.objects.select_related('supplier').order_by('-time', '-billno')[:10]
+
+
+@register('sales list')
+def sales_list():
+    return SaleBill.objects.order_by('-time', '-billno')[:10]
+
+
+@register('bills of a supplier')
+def supplier_bills():
+    return PurchaseBill.objects.filter(supplier_id=1).order_by('-time')[:10]
+
+
+@register('suppliers by name')
+def suppliers_list():
+    return Supplier.objects.filter(is_deleted=False).order_by('name')[:10]
+
+
+@register('items of purchase bills')
+def purchase_items():
+    return PurchaseItem.objects.filter(billno__in=[1, 2, 3]).select_related('stock')
+
+
+@register('items of sale bills')
+def sale_items():
+    return SaleItem.objects.filter(billno__in=[1, 2, 3]).select_related('stock')
@@ -0,0 +1,172 @@
+"""
+Synthetic data at scale, for benchmarking (`python manage.py seed_scale`).
+
+Rows are built in Python and written with bulk_create in batches, with
+primary keys assigned up front so related rows can point at them without
+reading anything back. Every stock gets an opening balance, every bill
+line its stock movement, and `history` extra manual movements are spread
+over the period. Stock quantities then move by the new ledger rows, so
+the generated data reconciles if the data it was added to did. Bill times
+are spread over the last `days` days rather than all being "now".
+"""
+import random
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import F, IntegerField, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from inventory import search
+from inventory.autocomplete import bump_autocomplete_version
+from inventory.models import Stock, StockHistory, signed_change
+from inventory.stats import bump_dashboard_version
+
+from .models import PurchaseBill, PurchaseBillDetails, PurchaseItem, SaleBill, SaleBillDetails, SaleItem, Supplier
+
+
+BATCH_SIZE = 2000
+OPENING_BALANCE = 1000
+
+WORDS = [
+    'Bolt', 'Nut', 'Washer', 'Screw', 'Hinge', 'Bracket', 'Cable', 'Switch', 'Socket', 'Fuse',
+    'Pipe', 'Valve', 'Clamp', 'Gasket', 'Spring', 'Bearing', 'Filter', 'Hose', 'Lamp', 'Relay',
+]
+SIZES = ['M4', 'M6', 'M8', 'M10', 'Small', 'Large', 'Steel', 'Brass', 'PVC', 'Zinc']
+
+
+@contextmanager
+def _keep_times(*models):
+    """Let bulk_create write the given times instead of auto_now overwriting them."""
+    fields = [model._meta.get_field('time') for model in models]
+    for field in fields:
+        field.auto_now = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now = True
+
+
+def _next_id(model):
+    last = model.objects.order_by('-pk').values_list('pk', flat=True).first()
+    return (last or 0) + 1
+
+
+def _insert(model, rows):
+    model.objects.bulk_create(rows, batch_size=BATCH_SIZE)
+
+
+def seed(stocks=1000, bills=1000, history=10000, suppliers=50, lines=3, days=365, seed=None, log=None):
+    """Add the given numbers of rows on top of the existing data. Returns {model name: rows added}."""
+    rng = random.Random(seed)
+    log = log or (lambda message: None)
+    now = timezone.now()
+    start = now - timedelta(days=days)
+
+    def moment():
+        return start + timedelta(seconds=rng.randrange(days * 86400))
+
+    counts = {}
+    with transaction.atomic():
+        # suppliers and stocks, names made unique with their id
+        first = _next_id(Supplier)
+        _insert(Supplier, [
+            Supplier(
+                id=pk, name=f"Supplier {pk}", phone=f"{pk:010d}", address=f"{pk} Market Road",
+                email=f"supplier{pk}@example.com", gstin=f"{pk:015d}",
+            )
+            for pk in range(first, first + suppliers)
+        ])
+        supplier_ids = list(Supplier.objects.filter(is_deleted=False).values_list('pk', flat=True))
+        counts['Supplier'] = suppliers
+        log(f"{suppliers} suppliers")
+
+        first = _next_id(Stock)
+        stock_ids = list(range(first, first + stocks))
+        _insert(Stock, [
+            Stock(id=pk, name=f"{rng.choice(WORDS)} {rng.choice(SIZES)} {pk}"[:30], quantity=0,
+                  reorder_point=rng.choice([5, 10, 20, 50]))
+            for pk in stock_ids
+        ])
+        stock_ids = list(Stock.objects.filter(is_deleted=False).values_list('pk', flat=True))
+        counts['Stock'] = stocks
+        log(f"{stocks} stocks")
+
+        movements = [
+            StockHistory(stock_id=pk, change=OPENING_BALANCE, type=StockHistory.IN, timestamp=start,
+                         note="Opening balance", source_type=StockHistory.IMPORT)
+            for pk in range(first, first + stocks)
+        ]
+
+        # bills, half purchases and half sales, each with its lines, details and movements
+        with _keep_times(PurchaseBill, SaleBill):
+            for bill_model, item_model, details_model, source_type in [
+                (PurchaseBill, PurchaseItem, PurchaseBillDetails, StockHistory.PURCHASE),
+                (SaleBill, SaleItem, SaleBillDetails, StockHistory.SALE),
+            ]:
+                count = bills // 2 if bill_model is PurchaseBill else bills - bills // 2
+                first = _next_id(bill_model)
+                bill_rows, item_rows, details_rows = [], [], []
+                for billno in range(first, first + count):
+                    time = moment()
+                    items = [
+                        item_model(billno_id=billno, stock_id=rng.choice(stock_ids), quantity=rng.randint(1, 5),
+                                   perprice=rng.randint(10, 500))
+                        for _ in range(rng.randint(1, 2 * lines - 1))
+                    ]
+                    for item in items:
+                        item.totalprice = item.quantity * item.perprice
+                        movements.append(StockHistory(
+                            stock_id=item.stock_id, change=item.quantity,
+                            type=StockHistory.IN if bill_model is PurchaseBill else StockHistory.OUT,
+                            timestamp=time, note=f"Bill #{billno}", source_type=source_type, source_id=billno,
+                        ))
+                    total = sum(item.totalprice for item in items)
+                    if bill_model is PurchaseBill:
+                        bill = PurchaseBill(billno=billno, time=time, supplier_id=rng.choice(supplier_ids))
+                    else:
+                        bill = SaleBill(billno=billno, time=time, name=f"Customer {billno}", phone=f"9{billno % 10**9:09d}",
+                                        address="1 High Street", email=f"customer{billno}@example.com", gstin=f"{billno:015d}")
+                    bill.total = total
+                    bill.line_count = len(items)
+                    bill_rows.append(bill)
+                    item_rows.extend(items)
+                    details_rows.append(details_model(billno_id=billno, total=total))
+                    if len(item_rows) >= BATCH_SIZE:
+                        _insert(bill_model, bill_rows)
+                        _insert(item_model, item_rows)
+                        _insert(details_model, details_rows)
+                        bill_rows, item_rows, details_rows = [], [], []
+                _insert(bill_model, bill_rows)
+                _insert(item_model, item_rows)
+                _insert(details_model, details_rows)
+                counts[bill_model.__name__] = count
+                log(f"{count} {bill_model._meta.verbose_name_plural}")
+
+        # manual movements, mostly small stock outs
+        for _ in range(history):
+            out = rng.random() < 0.7
+            movements.append(StockHistory(
+                stock_id=rng.choice(stock_ids), change=rng.randint(1, 10),
+                type=StockHistory.OUT if out else StockHistory.IN, timestamp=moment(), note="Manual count",
+            ))
+        movements.sort(key=lambda movement: movement.timestamp)
+        first_movement = _next_id(StockHistory)
+        for i in range(0, len(movements), BATCH_SIZE):
+            _insert(StockHistory, movements[i:i + BATCH_SIZE])
+        counts['StockHistory'] = len(movements)
+        log(f"{len(movements)} stock history rows")
+
+        # quantities move by the new ledger rows, then the derived flags and indexes
+        net = (
+            StockHistory.objects.filter(stock=OuterRef('pk'), id__gte=first_movement).order_by().values('stock')
+            .annotate(net=Sum(signed_change())).values('net')
+        )
+        Stock.objects.update(quantity=F('quantity') + Coalesce(Subquery(net, output_field=IntegerField()), 0))
+        Stock.objects.refresh_low_flags()
+        search.rebuild()
+        bump_dashboard_version()
+        bump_autocomplete_version()
+    return counts
@@ -1,5 +1,15 @@
-from django.test import TestCase, Client
+import gzip
+import os
+import tempfile
+import warnings
+from io import StringIO
+from unittest import mock
+from django.core.management import call_command
+from django.core.paginator import UnorderedObjectListWarning
+from django.test import TestCase, TransactionTestCase, Client, RequestFactory
+from django.test.utils import CaptureQueriesContext
 from django.contrib.auth.models import User
+from django.db import connection, OperationalError
 from transactions.models import (
     Supplier, 
     PurchaseBill, 
@@ -9,7 +19,11 @@ from transactions.models import (
     SaleItem,
     SaleBillDetails
 )
-from inventory.models import Stock
+from inventory import reservations
+from inventory.models import Reservation, Stock, StockHistory
+from transactions.views import SaleView
+from core.db.profiles import ScratchDatabaseMixin
+from core.querycount import QueryBudgetTestMixin
 
 
 class PurchaseFlowTestCase(TestCase):
@@ -70,6 +84,37 @@ class PurchaseFlowTestCase(TestCase):
         # Check details
         details = PurchaseBillDetails.objects.get(billno=bill)
         self.assertEqual(details.total, 250)
+
+        # Check the stock movement points back at the bill
+        movement = bill.get_stock_movements().get()
+        self.assertEqual((movement.source_type, movement.type, movement.change), (StockHistory.PURCHASE, StockHistory.IN, 5))
+
+        # Deleting the bill logs the reversal against the same bill
+        self.client.post(f'/transactions/purchases/{bill.pk}/delete', HTTP_HOST='127.0.0.1')
+        reversal = StockHistory.objects.for_source(StockHistory.PURCHASE_REVERSAL, bill.billno).get()
+        self.assertEqual((reversal.type, reversal.change), (StockHistory.OUT, 5))
+
+    def test_purchase_locked_out_answers_503_and_saves_nothing(self):
+        """Test that a purchase the database stayed locked for asks the cashier to try again."""
+        post_data = {
+            'form-TOTAL_FORMS': '1',
+            'form-INITIAL_FORMS': '0',
+            'form-MIN_NUM_FORMS': '0',
+            'form-MAX_NUM_FORMS': '1000',
+            'form-0-stock': str(self.stock.pk),
+            'form-0-quantity': '5',
+            'form-0-perprice': '50',
+        }
+
+        url = f'/transactions/purchases/new/{self.supplier.pk}'
+        with mock.patch('transactions.views.receive_stock', side_effect=OperationalError('database is locked')), \
+                self.assertLogs('transactions.views', 'WARNING') as logs:
+            response = self.client.post(url, post_data, HTTP_HOST='127.0.0.1')
+
+        self.assertEqual(response.status_code, 503)
+        self.assertContains(response, 'could not be posted', status_code=503)
+        self.assertIn('database is locked', logs.output[0])
+        self.assertFalse(PurchaseBill.objects.exists())
     
     def test_purchase_updates_stock_quantity(self):
         """Test that purchasing updates stock quantity correctly."""
@@ -147,6 +192,14 @@ class SaleFlowTestCase(TestCase):
         # Check details
         details = SaleBillDetails.objects.get(billno=bill)
         self.assertEqual(details.total, 225)
+
+        # Check the stock movements point back at the bill, before and after deleting it
+        self.assertEqual(list(bill.get_stock_movements().values_list('source_type', 'change')), [(StockHistory.SALE, 3)])
+        self.client.post(f'/transactions/sales/{bill.pk}/delete', HTTP_HOST='127.0.0.1')
+        self.assertEqual(
+            list(StockHistory.objects.for_source(StockHistory.SALE_REVERSAL, bill.billno).values_list('type', 'change')),
+            [(StockHistory.IN, 3)]
+        )
     
     def test_sale_decreases_stock_quantity(self):
         """Test that selling updates stock quantity correctly."""
@@ -171,3 +224,498 @@ class SaleFlowTestCase(TestCase):
         
         self.stock.refresh_from_db()
         self.assertEqual(self.stock.quantity, initial_qty - 7)
+
+    def test_sale_exceeding_stock_is_rejected(self):
+        """Test that a sale larger than the stock on hand saves nothing."""
+        post_data = {
+            'name': 'Test Customer',
+            'phone': '8888888888',
+            'address': '456 Customer St',
+            'email': 'customer@example.com',
+            'gstin': 'CUSTGSTIN12345',
+            'form-TOTAL_FORMS': '1',
+            'form-INITIAL_FORMS': '0',
+            'form-MIN_NUM_FORMS': '0',
+            'form-MAX_NUM_FORMS': '1000',
+            'form-0-stock': str(self.stock.pk),
+            'form-0-quantity': '101',
+            'form-0-perprice': '50',
+        }
+        
+        url = '/transactions/sales/new'
+        response = self.client.post(url, post_data, HTTP_HOST='127.0.0.1')
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(SaleBill.objects.exists())
+        self.stock.refresh_from_db()
+        self.assertEqual(self.stock.quantity, 100)
+        self.assertFalse(StockHistory.objects.filter(stock=self.stock).exists())
+
+
+    def test_sale_locked_out_answers_503_and_saves_nothing(self):
+        """Test that a sale the database stayed locked for asks the cashier to try again."""
+        post_data = {
+            'name': 'Test Customer',
+            'phone': '8888888888',
+            'address': '456 Customer St',
+            'email': 'customer@example.com',
+            'gstin': 'CUSTGSTIN12345',
+            'form-TOTAL_FORMS': '1',
+            'form-INITIAL_FORMS': '0',
+            'form-MIN_NUM_FORMS': '0',
+            'form-MAX_NUM_FORMS': '1000',
+            'form-0-stock': str(self.stock.pk),
+            'form-0-quantity': '5',
+            'form-0-perprice': '50',
+        }
+
+        url = '/transactions/sales/new'
+        with mock.patch('transactions.views.issue_stock', side_effect=OperationalError('database is locked')), \
+                self.assertLogs('transactions.views', 'WARNING') as logs:
+            response = self.client.post(url, post_data, HTTP_HOST='127.0.0.1')
+
+        self.assertEqual(response.status_code, 503)
+        self.assertContains(response, 'could not be posted', status_code=503)
+        self.assertIn('database is locked', logs.output[0])
+        self.assertFalse(SaleBill.objects.exists())
+        self.stock.refresh_from_db()
+        self.assertEqual(self.stock.quantity, 100)
+    
+    def test_sale_rejected_when_any_line_is_short(self):
+        """Test that one short line rejects the whole basket."""
+        other = Stock.objects.create(name='TestStock3', quantity=1)
+        post_data = {
+            'name': 'Test Customer',
+            'phone': '8888888888',
+            'address': '456 Customer St',
+            'email': 'customer@example.com',
+            'gstin': 'CUSTGSTIN12345',
+            'form-TOTAL_FORMS': '2',
+            'form-INITIAL_FORMS': '0',
+            'form-MIN_NUM_FORMS': '0',
+            'form-MAX_NUM_FORMS': '1000',
+            'form-0-stock': str(self.stock.pk),
+            'form-0-quantity': '5',
+            'form-0-perprice': '50',
+            'form-1-stock': str(other.pk),
+            'form-1-quantity': '2',
+            'form-1-perprice': '50',
+        }
+        
+        url = '/transactions/sales/new'
+        response = self.client.post(url, post_data, HTTP_HOST='127.0.0.1')
+        
+        self.assertContains(response, 'Not enough')
+        self.assertFalse(SaleBill.objects.exists())
+        self.assertFalse(SaleItem.objects.exists())
+        self.stock.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual(self.stock.quantity, 100)
+        self.assertEqual(other.quantity, 1)
+
+    def test_new_sale_page_does_not_list_every_stock(self):
+        """Test that the sale form posts a stock id picked by typeahead instead of a full <select>."""
+        response = self.client.get('/transactions/sales/new', HTTP_HOST='127.0.0.1')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotContains(response, '<option')
+        self.assertNotContains(response, 'TestStock2')
+        self.assertContains(response, 'type="hidden" name="form-0-stock"')
+        self.assertContains(response, 'inventory/js/stock_autocomplete.js')
+
+        # a re-rendered form shows the name of the stock already picked
+        response = self.client.post('/transactions/sales/new', {
+            'name': 'Test Customer',
+            'phone': '8888888888',
+            'address': '456 Customer St',
+            'email': 'customer@example.com',
+            'gstin': 'CUSTGSTIN12345',
+            'form-TOTAL_FORMS': '1',
+            'form-INITIAL_FORMS': '0',
+            'form-MIN_NUM_FORMS': '0',
+            'form-MAX_NUM_FORMS': '1000',
+            'form-0-stock': str(self.stock.pk),
+            'form-0-quantity': '101',
+            'form-0-perprice': '50',
+        }, HTTP_HOST='127.0.0.1')
+        self.assertContains(response, 'value="TestStock2"')
+
+    def sale(self, quantity, basket=None):
+        data = {
+            'name': 'Reserving Customer',
+            'phone': '8888888888',
+            'address': '456 Customer St',
+            'email': 'customer@example.com',
+            'gstin': 'CUSTGSTIN12345',
+            'form-TOTAL_FORMS': '1',
+            'form-INITIAL_FORMS': '0',
+            'form-MIN_NUM_FORMS': '0',
+            'form-MAX_NUM_FORMS': '1000',
+            'form-0-stock': str(self.stock.pk),
+            'form-0-quantity': str(quantity),
+            'form-0-perprice': '50',
+        }
+        if basket:
+            data['basket'] = basket
+        return self.client.post('/transactions/sales/new', data, HTTP_HOST='127.0.0.1')
+
+    def test_sale_uses_its_basket_reservations(self):
+        """Test that a posted sale converts its basket's reservations and cannot take another's"""
+        response = self.client.get('/transactions/sales/new', HTTP_HOST='127.0.0.1')
+        basket = response.context['basket']
+        self.assertContains(response, f'name="basket" id="basket" value="{basket}"')
+        reservations.reserve(basket, self.stock, 60)
+        reservations.reserve(reservations.new_basket(), self.stock, 30)
+
+        # another till's sale only gets what no basket holds
+        response = self.sale(11)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, '10 available')
+        self.assertEqual(self.sale(10).status_code, 302)
+
+        self.assertEqual(self.sale(60, basket).status_code, 302)
+        self.assertFalse(Reservation.objects.filter(basket=basket).exists())
+        self.stock.refresh_from_db()
+        self.assertEqual(self.stock.quantity, 30)
+
+class PurchaseQueryCountTestCase(TestCase):
+    """Test that purchase posting runs a fixed number of queries."""
+    
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser3', password='testpass')
+        self.supplier = Supplier.objects.create(
+            name='Bulk Supplier',
+            phone='7777777777',
+            address='1 Bulk St',
+            email='bulk@example.com',
+            gstin='BULKGSTIN123456'
+        )
+        self.stocks = [Stock.objects.create(name=f'BulkStock{i}', quantity=0) for i in range(20)]
+        self.client = Client()
+        self.client.login(username='testuser3', password='testpass')
+    
+    def post_bill(self, lines):
+        post_data = {
+            'form-TOTAL_FORMS': str(lines),
+            'form-INITIAL_FORMS': '0',
+            'form-MIN_NUM_FORMS': '0',
+            'form-MAX_NUM_FORMS': '1000',
+        }
+        for i, stock in enumerate(self.stocks[:lines]):
+            post_data[f'form-{i}-stock'] = str(stock.pk)
+            post_data[f'form-{i}-quantity'] = '2'
+            post_data[f'form-{i}-perprice'] = '10'
+        url = f'/transactions/purchases/new/{self.supplier.pk}'
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(url, post_data, HTTP_HOST='127.0.0.1')
+        self.assertEqual(response.status_code, 302)
+        return len(queries)
+    
+    def test_query_count_independent_of_line_count(self):
+        """Test that a 20 line bill costs the same queries as a 1 line bill."""
+        self.assertEqual(self.post_bill(1), self.post_bill(20))
+    
+    def test_bulk_purchase_updates_stock_and_history(self):
+        """Test that every line is saved, stocked in and logged."""
+        self.post_bill(20)
+        bill = PurchaseBill.objects.get()
+        self.assertEqual(PurchaseItem.objects.filter(billno=bill).count(), 20)
+        self.assertEqual(PurchaseBillDetails.objects.get(billno=bill).total, 400)
+        self.assertEqual(StockHistory.objects.filter(type=StockHistory.IN).count(), 20)
+        for stock in self.stocks:
+            stock.refresh_from_db()
+            self.assertEqual(stock.quantity, 2)
+
+
+class BillListQueryCountTestCase(TestCase):
+    """Test that the bill list pages render in a fixed number of queries."""
+    
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser4', password='testpass')
+        self.supplier = Supplier.objects.create(
+            name='List Supplier',
+            phone='6666666666',
+            address='1 List St',
+            email='list@example.com',
+            gstin='LISTGSTIN123456'
+        )
+        self.stocks = [Stock.objects.create(name=f'ListStock{i}', quantity=0) for i in range(3)]
+        self.client = Client()
+        self.client.login(username='testuser4', password='testpass')
+    
+    def add_bills(self, count):
+        for _ in range(count):
+            purchase = PurchaseBill.objects.create(supplier=self.supplier, total=30, line_count=3)
+            sale = SaleBill.objects.create(name='Customer', phone='1', address='a', email='c@example.com', gstin='G', total=30, line_count=3)
+            for stock in self.stocks:
+                PurchaseItem.objects.create(billno=purchase, stock=stock, quantity=1, perprice=10, totalprice=10)
+                SaleItem.objects.create(billno=sale, stock=stock, quantity=1, perprice=10, totalprice=10)
+    
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, HTTP_HOST='127.0.0.1')
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+    
+    def test_list_pages_query_count_independent_of_rows(self):
+        """Test that 1 and 10 bills cost the same queries on every list page."""
+        self.add_bills(1)
+        urls = ['/transactions/purchases/', '/transactions/sales/', '/', f'/transactions/suppliers/{self.supplier.name}']
+        few = [self.count_queries(url) for url in urls]
+        self.add_bills(9)
+        many = [self.count_queries(url) for url in urls]
+        self.assertEqual(few, many)
+    
+    def test_posted_bill_stores_total_and_line_count(self):
+        """Test that posting a purchase stores its total and line count."""
+        post_data = {
+            'form-TOTAL_FORMS': '2',
+            'form-INITIAL_FORMS': '0',
+            'form-MIN_NUM_FORMS': '0',
+            'form-MAX_NUM_FORMS': '1000',
+            'form-0-stock': str(self.stocks[0].pk),
+            'form-0-quantity': '2',
+            'form-0-perprice': '10',
+            'form-1-stock': str(self.stocks[1].pk),
+            'form-1-quantity': '3',
+            'form-1-perprice': '5',
+        }
+        self.client.post(f'/transactions/purchases/new/{self.supplier.pk}', post_data, HTTP_HOST='127.0.0.1')
+        bill = PurchaseBill.objects.get()
+        self.assertEqual(bill.total, 35)
+        self.assertEqual(bill.line_count, 2)
+    
+    def test_backfill_bill_totals(self):
+        """Test that the backfill command recomputes stored totals from items."""
+        self.add_bills(2)
+        PurchaseBill.objects.update(total=0, line_count=0)
+        call_command('backfill_bill_totals', stdout=StringIO())
+        for bill in PurchaseBill.objects.all():
+            self.assertEqual(bill.total, 30)
+            self.assertEqual(bill.line_count, 3)
+    
+    def test_sales_list_keyset_mode_renders_cursor_links(self):
+        """Test that the sales list renders next cursors in keyset mode."""
+        self.add_bills(12)
+        request = RequestFactory().get('/transactions/sales/')
+        request.user = self.user
+        response = SaleView.as_view(keyset_pagination=True)(request)
+        response.render()
+        page = response.context_data['page_obj']
+        self.assertEqual(len(page), 10)
+        self.assertTrue(page.has_next())
+        self.assertContains(response, f'cursor={page.next_cursor}')
+        self.assertNotContains(response, '?page=')
+
+
+class BillExportTestCase(TestCase):
+    """Test the streaming bill exports."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser5', password='testpass')
+        supplier = Supplier.objects.create(
+            name='Export Supplier',
+            phone='5555555555',
+            address='1 Export St',
+            email='export@example.com',
+            gstin='EXPGSTIN1234567'
+        )
+        self.bolt = Stock.objects.create(name='Bolt', quantity=0)
+        self.nut = Stock.objects.create(name='Nut', quantity=0)
+        purchase = PurchaseBill.objects.create(supplier=supplier, total=50, line_count=2)
+        PurchaseItem.objects.create(billno=purchase, stock=self.bolt, quantity=2, perprice=10, totalprice=20)
+        PurchaseItem.objects.create(billno=purchase, stock=self.nut, quantity=3, perprice=10, totalprice=30)
+        sale = SaleBill.objects.create(name='Export Customer', phone='1', address='a', email='c@example.com', gstin='G', total=10, line_count=1)
+        SaleItem.objects.create(billno=sale, stock=self.nut, quantity=1, perprice=10, totalprice=10)
+        self.client = Client()
+        self.client.login(username='testuser5', password='testpass')
+
+    def test_purchases_csv_streams_one_row_per_item(self):
+        response = self.client.get('/transactions/purchases/export', {'stock': self.nut.pk}, HTTP_HOST='127.0.0.1')
+        self.assertTrue(response.streaming)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], 'billno,time,supplier,bill_total,stock_id,stock,quantity,perprice,totalprice')
+        self.assertEqual(len(lines), 2)
+        self.assertIn('Export Supplier,50,%d,Nut,3,10,30' % self.nut.pk, lines[1])
+
+    def test_sales_export_date_filter(self):
+        response = self.client.get('/transactions/sales/export', {'format': 'jsonl', 'until': '2000-01-01'}, HTTP_HOST='127.0.0.1')
+        self.assertEqual(b''.join(response.streaming_content), b'')
+        response = self.client.get('/transactions/sales/export', {'format': 'jsonl', 'since': '2000-01-01'}, HTTP_HOST='127.0.0.1')
+        self.assertIn(b'"customer":"Export Customer"', b''.join(response.streaming_content))
+
+    def test_export_bills_command(self):
+        out = StringIO()
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'purchases.csv.gz')
+            call_command('export_bills', 'purchases', '--gzip', '-o', path, stdout=out)
+            with gzip.open(path, 'rt') as f:
+                self.assertEqual(len(f.read().splitlines()), 3)
+        self.assertIn('Wrote', out.getvalue())
+
+
+class SeedAndBenchmarkTestCase(TestCase):
+    """Test the synthetic data generator and the page benchmark."""
+
+    def setUp(self):
+        self.user = User.objects.create_superuser(username='benchuser', password='testpass', email='b@example.com')
+
+    def test_seed_adds_rows_that_reconcile(self):
+        from inventory.reconciliation import reconcile
+        from transactions.seed import seed
+        counts = seed(stocks=20, bills=10, history=50, suppliers=3, seed=1)
+        self.assertEqual(Stock.objects.count(), 20)
+        self.assertEqual(PurchaseBill.objects.count() + SaleBill.objects.count(), 10)
+        self.assertEqual(StockHistory.objects.count(), counts['StockHistory'])
+        self.assertEqual(
+            StockHistory.objects.for_source(StockHistory.PURCHASE).count(),
+            PurchaseItem.objects.count(),
+        )
+        # a second run adds to the first and still matches the ledger
+        seed(stocks=5, bills=4, history=10, suppliers=1, seed=2)
+        self.assertEqual(Stock.objects.count(), 25)
+        self.assertEqual(reconcile().drift_count, 0)
+
+    def test_benchmark_writes_results_and_fails_over_budget(self):
+        import json
+        from django.core.management.base import CommandError
+        from transactions.seed import seed
+        seed(stocks=10, bills=4, history=10, suppliers=2, seed=1)
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'results.json')
+            call_command('benchmark', 'stock_list', 'sale_bill', '--runs', '2', '--output', output, stdout=StringIO())
+            with open(output) as f:
+                results = json.load(f)['results']
+            self.assertEqual(set(results), {'stock_list', 'sale_bill'})
+            self.assertEqual(results['stock_list']['status'], 200)
+            self.assertGreater(results['stock_list']['queries'], 0)
+            self.assertLessEqual(results['stock_list']['p50_ms'], results['stock_list']['max_ms'])
+
+            budgets = os.path.join(directory, 'budgets.json')
+            with open(budgets, 'w') as f:
+                json.dump({'stock_list': {'queries': 0}}, f)
+            with self.assertRaisesMessage(CommandError, 'stock_list'):
+                call_command('benchmark', 'stock_list', '--runs', '1', '--budgets', budgets, stdout=StringIO())
+
+
+class LoadTestTestCase(ScratchDatabaseMixin, TransactionTestCase):
+    """Test the concurrent till load test on the default profile (committed data, so the tills' connections can see it)."""
+
+    def setUp(self):
+        from transactions.seed import seed
+        self.user = User.objects.create_superuser(username='loaduser', password='testpass', email='l@example.com')
+        seed(stocks=10, bills=4, history=10, suppliers=2, seed=1)
+
+    def test_tills_post_and_ledger_stays_consistent(self):
+        from transactions import loadtest
+        report = loadtest.run(user=self.user, workers=2, requests=12, hot_skus=2, seed=1)
+        self.assertEqual(report['requests'], 12)
+        total = report['total']
+        self.assertEqual(total['posted'] + total['rejected'] + total['errors'], 12)
+        self.assertGreater(total['posted'], 0)
+        self.assertEqual(total['locked'], 0)                                    # no request failed on a lock
+        self.assertEqual(sum(kind['requests'] for kind in report['kinds'].values()), 12)
+        self.assertEqual(report['ledger']['drifted_after'], 0)
+        self.assertTrue(loadtest.consistent(report))
+
+    def test_lock_failures_are_errors_and_retried_locks_posted(self):
+        from transactions.loadtest import _summary
+        summary = _summary([
+            ('sale', 302, 1.0, True),                                           # hit a lock, posted after a retry
+            ('sale', 200, 1.0, False),                                          # not enough stock
+            ('sale', 200, 1.0, True),                                           # re-rendered after a lock
+            ('sale', 503, 1.0, True),
+            ('sale', 500, 1.0, False),
+        ])
+        self.assertEqual(
+            {key: summary[key] for key in ('posted', 'rejected', 'errors', 'locked')},
+            {'posted': 1, 'rejected': 1, 'errors': 3, 'locked': 2},
+        )
+
+    def test_workload_skews_to_hot_stocks(self):
+        from transactions.loadtest import Workload
+        workload = Workload(list(range(1, 101)), [1], hot_skus=3, hot_share=0.9, seed=1)
+        picks = [workload.stock() for _ in range(1000)]
+        self.assertGreater(sum(1 for pk in picks if pk <= 3), 850)
+
+    def test_parse_mix(self):
+        from transactions.loadtest import parse_mix
+        self.assertEqual(parse_mix('sale=3,stock_change=1'), {'sale': 3, 'stock_change': 1})
+        with self.assertRaises(ValueError):
+            parse_mix('refund=1')
+
+
+class TransactionsQueryBudgetTestCase(QueryBudgetTestMixin, TestCase):
+    """Test that the transactions pages stay within their query budgets."""
+
+    def setUp(self):
+        from transactions.seed import seed
+        seed(stocks=20, bills=30, history=20, suppliers=3, seed=1)
+        self.user = User.objects.create_user(username='budgetuser5', password='testpass')
+        self.client = Client(HTTP_HOST='127.0.0.1')
+        self.client.force_login(self.user)
+
+    def test_pages_within_budget(self):
+        supplier = Supplier.objects.first()
+        purchase = PurchaseBill.objects.last().pk
+        sale = SaleBill.objects.last().pk
+        for url in [
+            '/transactions/suppliers/', '/transactions/suppliers/new', f'/transactions/suppliers/{supplier.pk}/edit',
+            f'/transactions/suppliers/{supplier.pk}/delete', f'/transactions/suppliers/{supplier.name}',
+            '/transactions/purchases/', '/transactions/purchases/new', f'/transactions/purchases/new/{supplier.pk}',
+            f'/transactions/purchases/{purchase}', f'/transactions/purchases/{purchase}/delete', '/transactions/purchases/export',
+            '/transactions/sales/', '/transactions/sales/new', f'/transactions/sales/{sale}', f'/transactions/sales/{sale}/delete',
+            '/transactions/sales/export',
+        ]:
+            with self.subTest(url=url), warnings.catch_warnings():
+                warnings.simplefilter('error', UnorderedObjectListWarning)      # a paginated list must have an order
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertWithinQueryBudget(response)
+
+    def test_bill_deletion_within_budget_for_any_number_of_lines(self):
+        for bill in SaleBill.objects.order_by('-line_count')[:1]:
+            response = self.client.post(f'/transactions/sales/{bill.pk}/delete')
+            self.assertEqual(response.status_code, 302)
+            self.assertWithinQueryBudget(response)
+        for bill in PurchaseBill.objects.order_by('-line_count')[:1]:
+            response = self.client.post(f'/transactions/purchases/{bill.pk}/delete')
+            self.assertWithinQueryBudget(response)
+
+    def post_bill(self, url, stocks, quantity=1, **data):
+        data.update({
+            'form-TOTAL_FORMS': str(len(stocks)),
+            'form-INITIAL_FORMS': '0',
+            'form-MIN_NUM_FORMS': '0',
+            'form-MAX_NUM_FORMS': '1000',
+        })
+        for i, stock in enumerate(stocks):
+            data.update({f'form-{i}-stock': str(stock.pk), f'form-{i}-quantity': str(quantity), f'form-{i}-perprice': '10'})
+        return self.client.post(url, data)
+
+    def test_bill_posting_within_budget_for_any_number_of_lines(self):
+        supplier = Supplier.objects.first()
+        stocks = list(Stock.objects.filter(is_deleted=False).order_by('pk')[:10])
+        Stock.objects.filter(pk__in=[stock.pk for stock in stocks]).update(quantity=100)
+        customer = {'name': 'Budget Customer', 'phone': '1', 'address': 'Street', 'email': 'b@example.com', 'gstin': 'G'}
+        basket, other = reservations.new_basket(), reservations.new_basket()
+        for stock in stocks:
+            reservations.reserve(basket, stock, 1)
+            reservations.reserve(other, stock, 50)
+        for lines in (1, len(stocks)):
+            with self.subTest(bill='purchase', lines=lines):
+                response = self.post_bill(f'/transactions/purchases/new/{supplier.pk}', stocks[:lines])
+                self.assertEqual(response.status_code, 302)
+                self.assertWithinQueryBudget(response)
+            with self.subTest(bill='sale', lines=lines):
+                response = self.post_bill('/transactions/sales/new', stocks[:lines], **customer)
+                self.assertEqual(response.status_code, 302)
+                self.assertWithinQueryBudget(response)
+            with self.subTest(bill='sale with reservations', lines=lines):
+                response = self.post_bill('/transactions/sales/new', stocks[:lines], basket=basket, **customer)
+                self.assertEqual(response.status_code, 302)
+                self.assertWithinQueryBudget(response)
+            with self.subTest(bill='rejected sale', lines=lines):
+                response = self.post_bill('/transactions/sales/new', stocks[:lines], quantity=90, **customer)
+                self.assertEqual(response.status_code, 200)
+                self.assertWithinQueryBudget(response)
@@ -16,11 +16,13 @@ urlpatterns = [
     path('suppliers/<name>', views.SupplierView.as_view(), name='supplier'),
 
     path('purchases/', views.PurchaseView.as_view(), name='purchases-list'), 
+    path('purchases/export', views.PurchaseExportView.as_view(), name='export-purchases'),
     path('purchases/new', views.SelectSupplierView.as_view(), name='select-supplier'), 
     path('purchases/new/<pk>', views.PurchaseCreateView.as_view(), name='new-purchase'),    
     path('purchases/<pk>/delete', views.PurchaseDeleteView.as_view(), name='delete-purchase'),
     
     path('sales/', views.SaleView.as_view(), name='sales-list'),
+    path('sales/export', views.SaleExportView.as_view(), name='export-sales'),
     path('sales/new', views.SaleCreateView.as_view(), name='new-sale'),
     path('sales/<pk>/delete', views.SaleDeleteView.as_view(), name='delete-sale'),
 
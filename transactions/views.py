@@ -1,3 +1,5 @@
+import logging
+
 from django.shortcuts import render, redirect, get_object_or_404
 from django.views.generic import (
     View, 
@@ -9,6 +11,13 @@ from django.views.generic import (
 from django.contrib.messages.views import SuccessMessageMixin
 from django.contrib import messages
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
+from django.db import DatabaseError
+from django.http import HttpResponseBadRequest
+from core import export
+from core.db.writes import write_atomic
+from core.pagination import KeysetPaginationMixin, KeysetPaginator
+from core.querycount import query_budget
+from core.replica import read_replica
 from .models import (
     PurchaseBill, 
     Supplier, 
@@ -27,16 +36,24 @@ from .forms import (
     SaleItemFormset,
     SaleDetailsForm
 )
+from .exports import PURCHASE_HEADER, SALE_HEADER, purchase_rows, sale_rows
 from inventory.models import Stock, StockHistory
+from inventory import reservations
+from inventory.services import receive_stock, issue_stock, InsufficientStock
+
+
+logger = logging.getLogger(__name__)
 
 # shows a lists of all suppliers
+@query_budget(queries=4, similar=0)
 class SupplierListView(ListView):
     model = Supplier
     template_name = "suppliers/suppliers_list.html"
-    queryset = Supplier.objects.filter(is_deleted=False)
+    queryset = Supplier.objects.filter(is_deleted=False).order_by('name', 'id')
     paginate_by = 10
 
 # used to add a new supplier
+@query_budget(queries=6, similar=0)
 class SupplierCreateView(SuccessMessageMixin, CreateView):
     model = Supplier
     form_class = SupplierForm
@@ -51,6 +68,7 @@ class SupplierCreateView(SuccessMessageMixin, CreateView):
         return context     
 
 # used to update a supplier's info
+@query_budget(queries=7, similar=0)
 class SupplierUpdateView(SuccessMessageMixin, UpdateView):
     model = Supplier
     form_class = SupplierForm
@@ -66,6 +84,7 @@ class SupplierUpdateView(SuccessMessageMixin, UpdateView):
         return context
 
 # used to delete a supplier
+@query_budget(queries=4, similar=0)
 class SupplierDeleteView(View):
     template_name = "suppliers/delete_supplier.html"
     success_message = "Supplier has been deleted successfully"
@@ -82,18 +101,26 @@ class SupplierDeleteView(View):
         return redirect('transactions:suppliers-list')
 
 # used to view a supplier's profile
+@query_budget(queries=6, similar=0)
 class SupplierView(View):
+    keyset_pagination = False                                                   # page by cursor instead of page number
+    keyset_count = False
+
     def get(self, request, name):
         supplierobj = get_object_or_404(Supplier, name=name)
-        bill_list = PurchaseBill.objects.filter(supplier=supplierobj)
-        page = request.GET.get('page', 1)
-        paginator = Paginator(bill_list, 10)
-        try:
-            bills = paginator.page(page)
-        except PageNotAnInteger:
-            bills = paginator.page(1)
-        except EmptyPage:
-            bills = paginator.page(paginator.num_pages)
+        bill_list = PurchaseBill.objects.for_list().filter(supplier=supplierobj).order_by('-time')
+        if self.keyset_pagination:
+            paginator = KeysetPaginator(bill_list, ['-time', '-billno'], 10, count=self.keyset_count)
+            bills = paginator.page(request.GET.get('cursor'))
+        else:
+            page = request.GET.get('page', 1)
+            paginator = Paginator(bill_list, 10)
+            try:
+                bills = paginator.page(page)
+            except PageNotAnInteger:
+                bills = paginator.page(1)
+            except EmptyPage:
+                bills = paginator.page(paginator.num_pages)
         context = {
             'supplier'  : supplierobj,
             'bills'     : bills
@@ -101,14 +128,19 @@ class SupplierView(View):
         return render(request, 'suppliers/supplier.html', context)
 
 # shows the list of bills of all purchases 
-class PurchaseView(ListView):
+@query_budget(queries=5, similar=0)
+@read_replica
+class PurchaseView(KeysetPaginationMixin, ListView):
     model = PurchaseBill
+    queryset = PurchaseBill.objects.for_list()                                  # loads suppliers and items up front, no queries per row
     template_name = "purchases/purchases_list.html"
     context_object_name = 'bills'
     ordering = ['-time']
     paginate_by = 10
+    keyset_ordering = ['-time', '-billno']                                      # used when keyset_pagination is switched on
 
 # used to select the supplier
+@query_budget(queries=5, similar=0)
 class SelectSupplierView(View):
     form_class = SelectSupplierForm
     template_name = 'purchases/select_supplier.html'
@@ -126,6 +158,7 @@ class SelectSupplierView(View):
         return render(request, self.template_name, {'form': form})
 
 # used to generate a bill object and save items
+@query_budget(queries=13, similar=0)                                          # for any number of lines of unsharded stocks
 class PurchaseCreateView(View):                                                 
     template_name = 'purchases/new_purchase.html'
 
@@ -142,59 +175,48 @@ class PurchaseCreateView(View):
         formset = PurchaseItemFormset(request.POST)                             # recieves a post method for the formset
         supplierobj = get_object_or_404(Supplier, pk=pk)                        # gets the supplier object
         if formset.is_valid():
-            # saves bill
+            # saves the bill, its details, items and stock movements as one unit,
+            # using a fixed number of queries however many lines the bill has
             try:
-                # create and save a PurchaseBill linked to the selected supplier
-                billobj = PurchaseBill(supplier=supplierobj)
-                billobj.save()
-
-            except Exception as exc:
-                print('Exception error! ',exc)
+                with write_atomic():
+                    billitems = []
+                    for form in formset:                                        # stocks were loaded in one query when the formset was validated
+                        if not form.has_changed():                              # skips blank rows
+                            continue
+                        # false saves the item without writing it
+                        billitem = form.save(commit=False)
+                        # calculates the total price
+                        billitem.totalprice = billitem.perprice * billitem.quantity
+                        billitems.append(billitem)
+                    total = sum(billitem.totalprice for billitem in billitems)
+
+                    # create and save a PurchaseBill linked to the selected supplier, storing its total for the list pages
+                    billobj = PurchaseBill(supplier=supplierobj, total=total, line_count=len(billitems))
+                    billobj.save()
+                    for billitem in billitems:
+                        billitem.billno = billobj                               # links the bill object to the items
+                    PurchaseItem.objects.bulk_create(billitems)
+
+                    # create bill details object with the total of all lines
+                    PurchaseBillDetails.objects.create(billno=billobj, total=total)
+
+                    # updates quantities in stock db with one statement and logs the movements to StockHistory
+                    receive_stock(
+                        [(billitem.stock, billitem.quantity) for billitem in billitems],
+                        note=f"Purchase from {supplierobj.name} - Bill #{billobj.billno}",
+                        source_type=StockHistory.PURCHASE,
+                        source_id=billobj.billno
+                    )
+
+            except DatabaseError as exc:                                        # nothing was saved, the transaction was rolled back
+                logger.warning("Purchase from %s could not be posted: %s", supplierobj.name, exc)
+                messages.error(request, "The purchase could not be posted, the database is busy. Please try again.")
                 context = {
                     'formset'   : formset,
                     'supplier'  : supplierobj
                 }
-                return render(request, self.template_name, context)
-            
-            try:
-                # create bill details object
-                billdetailsobj = PurchaseBillDetails(billno=billobj)
-                billdetailsobj.save()
-
-            except Exception as exc:
-                print('Exception error! ',exc)
-                # Removing purchase transaction to keep transaction data clean
-                billobj.delete()
-                context = {
-                    'formset'   : formset,
-                    'supplier'  : supplierobj
-                }
-                return render(request, self.template_name, context)
-
-            for form in formset:                                                # for loop to save each individual form as its own object
-                # false saves the item and links bill to the item
-                billitem = form.save(commit=False)
-                billitem.billno = billobj                                       # links the bill object to the items
-                # gets the stock item
-                stock = get_object_or_404(Stock, name=billitem.stock.name)       # gets the item
-                # calculates the total price
-                billitem.totalprice = billitem.perprice * billitem.quantity
-                # updates quantity in stock db
-                stock.quantity += billitem.quantity                             # updates quantity
-                billdetailsobj.total += billitem.totalprice
-                # saves bill item and stock
-                stock.save()
-                billitem.save()
-                
-                # Log stock movement to StockHistory
-                StockHistory.objects.create(
-                    stock=stock,
-                    change=billitem.quantity,
-                    type=StockHistory.IN,
-                    note=f"Purchase from {supplierobj.name} - Bill #{billobj.billno}"
-                )
+                return render(request, self.template_name, context, status=503)
 
-            billdetailsobj.save()
             messages.success(request, "Purchased items have been registered successfully")
             return redirect('transactions:purchase-bill', billno=billobj.billno)
         formset = PurchaseItemFormset(request.GET or None)
@@ -205,6 +227,7 @@ class PurchaseCreateView(View):
         return render(request, self.template_name, context)
 
 # used to delete a bill object
+@query_budget(queries=16, similar=0)
 class PurchaseDeleteView(SuccessMessageMixin, DeleteView):
     model = PurchaseBill
     template_name = "purchases/delete_purchase.html"
@@ -212,102 +235,115 @@ class PurchaseDeleteView(SuccessMessageMixin, DeleteView):
     
     def delete(self, *args, **kwargs):
         self.object = self.get_object()
-        items = PurchaseItem.objects.filter(billno=self.object.billno)
-        for item in items:
-            stock = get_object_or_404(Stock, name=item.stock.name)
-            if stock.is_deleted == False:
-                stock.quantity -= item.quantity
-                stock.save()
-                
-                # Log stock reversal to StockHistory
-                StockHistory.objects.create(
-                    stock=stock,
-                    change=item.quantity,
-                    type=StockHistory.OUT,
-                    note=f"Purchase bill #{self.object.billno} cancelled/deleted"
+        items = PurchaseItem.objects.filter(billno=self.object.billno).select_related('stock')
+        try:
+            with write_atomic():
+                # reverses the stock movements in one batch and logs them to StockHistory,
+                # refusing the whole bill if any purchased stock has already been sold on
+                issue_stock(
+                    [(item.stock, item.quantity) for item in items if item.stock.is_deleted == False],
+                    note=f"Purchase bill #{self.object.billno} cancelled/deleted",
+                    source_type=StockHistory.PURCHASE_REVERSAL,
+                    source_id=self.object.billno
                 )
+                response = super(PurchaseDeleteView, self).delete(*args, **kwargs)
+        except InsufficientStock as exc:
+            messages.error(self.request, f"Purchase bill cannot be deleted. {exc}")
+            return redirect('transactions:purchases-list')
         messages.success(self.request, "Purchase bill has been deleted successfully")
-        return super(PurchaseDeleteView, self).delete(*args, **kwargs)
+        return response
 
 # shows the list of bills of all sales 
-class SaleView(ListView):
+@query_budget(queries=5, similar=0)
+@read_replica
+class SaleView(KeysetPaginationMixin, ListView):
     model = SaleBill
+    queryset = SaleBill.objects.for_list()                                      # loads items up front, no queries per row
     template_name = "sales/sales_list.html"
     context_object_name = 'bills'
     ordering = ['-time']
     paginate_by = 10
+    keyset_ordering = ['-time', '-billno']                                      # used when keyset_pagination is switched on
 
 # used to generate a bill object and save items
+@query_budget(queries=15, similar=0)                                          # for any number of lines of unsharded stocks, basket or not; fewer when refused
 class SaleCreateView(View):                                                      
     template_name = 'sales/new_sale.html'
 
     def get(self, request):
         form = SaleForm(request.GET or None)
         formset = SaleItemFormset(request.GET or None)                          # renders an empty formset
-        stocks = Stock.objects.filter(is_deleted=False)
         context = {
             'form'      : form,
             'formset'   : formset,
-            'stocks'    : stocks
+            'basket'    : reservations.new_basket(),                            # the lines the till adds are reserved under it
         }
         return render(request, self.template_name, context)
 
     def post(self, request):
         form = SaleForm(request.POST)
         formset = SaleItemFormset(request.POST)                                 # recieves a post method for the formset
+        basket = request.POST.get('basket')
+        if not reservations.valid_basket(basket):
+            basket = reservations.new_basket()
         if form.is_valid() and formset.is_valid():
-            # saves bill
+            # saves the bill, its details, items and stock movements as one unit,
+            # refusing the whole bill if any line cannot be filled
             try:
-                billobj = form.save(commit=False)
-                billobj.save()
-
-            except Exception as exc:
-                print('Exception error! ',exc)
+                with write_atomic():
+                    billitems = []
+                    for itemform in formset:                                    # stocks were loaded in one query when the formset was validated
+                        if not itemform.has_changed():                          # skips blank rows
+                            continue
+                        # false saves the item without writing it
+                        billitem = itemform.save(commit=False)
+                        # calculates the total price
+                        billitem.totalprice = billitem.perprice * billitem.quantity
+                        billitems.append(billitem)
+                    total = sum(billitem.totalprice for billitem in billitems)
+
+                    # saves the bill, storing its total for the list pages
+                    billobj = form.save(commit=False)
+                    billobj.total = total
+                    billobj.line_count = len(billitems)
+                    billobj.save()
+                    for billitem in billitems:
+                        billitem.billno = billobj                               # links the bill object to the items
+
+                    # locks the stocks in id order, checks the whole basket is available (what other
+                    # baskets reserved is not), then updates quantities in stock db, logs the movements
+                    # to StockHistory and turns this basket's reservations into the sale
+                    issue_stock(
+                        [(billitem.stock, billitem.quantity) for billitem in billitems],
+                        note=f"Sale to customer - Bill #{billobj.billno}",
+                        source_type=StockHistory.SALE,
+                        source_id=billobj.billno,
+                        basket=basket,
+                    )
+                    SaleItem.objects.bulk_create(billitems)
+
+                    # create bill details object with the total of all lines
+                    SaleBillDetails.objects.create(billno=billobj, total=total)
+
+            except InsufficientStock as exc:                                    # nothing was saved, the transaction was rolled back
+                messages.error(request, str(exc))
                 context = {
                     'form'      : form,
                     'formset'   : formset,
+                    'basket'    : basket,
                 }
                 return render(request, self.template_name, context)
-            
-            try:
-                # create bill details object
-                billdetailsobj = SaleBillDetails(billno=billobj)
-                billdetailsobj.save()
-
-            except Exception as exc:
-                print('Exception error! ',exc)
-                # Removing purchase transaction to keep transaction data clean
-                billobj.delete()
+
+            except DatabaseError as exc:                                        # e.g. the database stayed locked, nothing was saved
+                logger.warning("Sale could not be posted: %s", exc)
+                messages.error(request, "The sale could not be posted, the database is busy. Please try again.")
                 context = {
                     'form'      : form,
                     'formset'   : formset,
+                    'basket'    : basket,
                 }
-                return render(request, self.template_name, context)
-
-            for form in formset:                                                # for loop to save each individual form as its own object
-                # false saves the item and links bill to the item
-                billitem = form.save(commit=False)
-                billitem.billno = billobj                                       # links the bill object to the items
-                # gets the stock item
-                stock = get_object_or_404(Stock, name=billitem.stock.name)      
-                # calculates the total price
-                billitem.totalprice = billitem.perprice * billitem.quantity
-                # updates quantity in stock db
-                stock.quantity -= billitem.quantity
-                billdetailsobj.total += billitem.totalprice 
-                # saves bill item and stock
-                stock.save()
-                billitem.save()
-
-                # Log stock movement to StockHistory
-                StockHistory.objects.create(
-                    stock=stock,
-                    change=billitem.quantity,
-                    type=StockHistory.OUT,
-                    note=f"Sale to customer - Bill #{billobj.billno}"
-                )
+                return render(request, self.template_name, context, status=503)
 
-            billdetailsobj.save()
             messages.success(request, "Sold items have been registered successfully")
             return redirect('transactions:sale-bill', billno=billobj.billno)
         form = SaleForm(request.GET or None)
@@ -315,10 +351,12 @@ class SaleCreateView(View):
         context = {
             'form'      : form,
             'formset'   : formset,
+            'basket'    : basket,
         }
         return render(request, self.template_name, context)
 
 # used to delete a bill object
+@query_budget(queries=14, similar=0)
 class SaleDeleteView(SuccessMessageMixin, DeleteView):
     model = SaleBill
     template_name = "sales/delete_sale.html"
@@ -326,25 +364,21 @@ class SaleDeleteView(SuccessMessageMixin, DeleteView):
 
     def delete(self, *args, **kwargs):
         self.object = self.get_object()
-        items = SaleItem.objects.filter(billno=self.object.billno)
-        for item in items:
-            stock = get_object_or_404(Stock, name=item.stock.name)
-            if stock.is_deleted == False:
-                stock.quantity += item.quantity
-                stock.save()
-
-                # Log stock reversal to StockHistory
-                StockHistory.objects.create(
-                    stock=stock,
-                    change=item.quantity,
-                    type=StockHistory.IN,
-                    note=f"Sale bill #{self.object.billno} cancelled/deleted"
-                )
-
+        items = SaleItem.objects.filter(billno=self.object.billno).select_related('stock')
+        with write_atomic():
+            # returns the sold stock in one batch and logs the reversal to StockHistory
+            receive_stock(
+                [(item.stock, item.quantity) for item in items if item.stock.is_deleted == False],
+                note=f"Sale bill #{self.object.billno} cancelled/deleted",
+                source_type=StockHistory.SALE_REVERSAL,
+                source_id=self.object.billno
+            )
+            response = super(SaleDeleteView, self).delete(*args, **kwargs)
         messages.success(self.request, "Sale bill has been deleted successfully")
-        return super(SaleDeleteView, self).delete(*args, **kwargs)
+        return response
 
 # used to display the purchase bill object
+@query_budget(queries=6, similar=0)
 class PurchaseBillView(View):
     model = PurchaseBill
     template_name = "bill/purchase_bill.html"
@@ -353,7 +387,7 @@ class PurchaseBillView(View):
     def get(self, request, billno):
         context = {
             'bill'          : PurchaseBill.objects.get(billno=billno),
-            'items'         : PurchaseItem.objects.filter(billno=billno),
+            'items'         : PurchaseItem.objects.filter(billno=billno).select_related('stock'),
             'billdetails'   : PurchaseBillDetails.objects.get(billno=billno),
             'bill_base'     : self.bill_base,
         }
@@ -379,13 +413,14 @@ class PurchaseBillView(View):
             messages.success(request, "Bill details have been modified successfully")
         context = {
             'bill'          : PurchaseBill.objects.get(billno=billno),
-            'items'         : PurchaseItem.objects.filter(billno=billno),
+            'items'         : PurchaseItem.objects.filter(billno=billno).select_related('stock'),
             'billdetails'   : PurchaseBillDetails.objects.get(billno=billno),
             'bill_base'     : self.bill_base,
         }
         return render(request, self.template_name, context)
 
 # used to display the sale bill object
+@query_budget(queries=5, similar=0)
 class SaleBillView(View):
     model = SaleBill
     template_name = "bill/sale_bill.html"
@@ -394,7 +429,7 @@ class SaleBillView(View):
     def get(self, request, billno):
         context = {
             'bill'          : SaleBill.objects.get(billno=billno),
-            'items'         : SaleItem.objects.filter(billno=billno),
+            'items'         : SaleItem.objects.filter(billno=billno).select_related('stock'),
             'billdetails'   : SaleBillDetails.objects.get(billno=billno),
             'bill_base'     : self.bill_base,
         }
@@ -420,8 +455,34 @@ class SaleBillView(View):
             messages.success(request, "Bill details have been modified successfully")
         context = {
             'bill'          : SaleBill.objects.get(billno=billno),
-            'items'         : SaleItem.objects.filter(billno=billno),
+            'items'         : SaleItem.objects.filter(billno=billno).select_related('stock'),
             'billdetails'   : SaleBillDetails.objects.get(billno=billno),
             'bill_base'     : self.bill_base,
         }
-        return render(request, self.template_name, context)
\ No newline at end of file
+        return render(request, self.template_name, context)
+
+# streams the bill items as CSV or JSON Lines, filtered by the 'since', 'until' and 'stock' query parameters
+@query_budget(queries=2, similar=0)
+@read_replica
+class BillExportView(View):
+    filename = None
+    header = None
+    rows = None
+
+    def get(self, request):
+        try:
+            options = export.parse_options(request.GET)
+        except export.ExportError as exc:
+            return HttpResponseBadRequest(str(exc))
+        rows = self.rows(options['since'], options['until'], options['stock'])
+        return export.export_response(self.filename, self.header, rows, options['format'], options['compress'])
+
+class PurchaseExportView(BillExportView):
+    filename = 'purchases'
+    header = PURCHASE_HEADER
+    rows = staticmethod(purchase_rows)
+
+class SaleExportView(BillExportView):
+    filename = 'sales'
+    header = SALE_HEADER
+    rows = staticmethod(sale_rows)